@@ -1,9 +1,11 @@
 import sys
-import smartcard.util
+import itertools
 from enum import Enum
-from smartcard.ATR import ATR
-
-from smartcard.CardConnection import CardConnection
+from collections import namedtuple
+try:
+    from smartcard.ATR import ATR
+except ImportError: #no PC/SC stack: everything except printATR works
+    ATR = None
 
 import do_comm
 
@@ -24,47 +26,164 @@ class status(Enum):
     S_WRITE_ERROR= "WRITE ERROR"
     S_KEY_ERROR  = "KEY ERROR"
     S_NO_READERS = "NO READERS"
+    S_NO_CARD    = "CARD REMOVED"
+    S_TIMEOUT    = "TIMEOUT"
+    S_DENIED     = "ACCESS DENIED"
 
 
-def parseAccessBits(b6, b7):
-    b6 ^= 0xFF #C23│C22│C21│C20│C13│C12│C11│C10 (7-1)
-    b7 ^= 0xFF #C33│C32│C31│C30│C23│C22│C21│C20
-    #b8 ^= 0xFF #~C13│~C12│~C11│~C10│~C33│~C32│~C31│~C30│ it's checking byte that duplicate info
+#Access bits (trailer bytes 6-8) hold C1, C2, C3 of the 4 blocks of the sector, each byte with an inverted copy:
+#  b6 = ~C2[3..0] ~C1[3..0],  b7 = C1[3..0] ~C3[3..0],  b8 = C3[3..0] C2[3..0]
+#return C1C2C3 (3 bit condition) of each block; None if b8 is given and the inverted copies do not match
+def parseAccessBits(b6, b7, b8=None):
+    c1 =  ~b6       & 0x0F
+    c2 = (~b6 >> 4) & 0x0F
+    c3 =  ~b7       & 0x0F
+    if b8 is not None  and  ((b7 >> 4) != c1  or  b8 != (c3 << 4 | c2)):
+        return None
     blockAcess=bytearray(MIFARE_1K_blocks_per_sector)
-    blockAcess[0] = ( (b6       & 0x01)  << 2) | ( (b7       & 0x01) < 1) | ((b7 >> 4) & 0x01)
-    blockAcess[1] = (((b6 >> 1) & 0x01)  << 2) | (((b7 >> 1) & 0x01) < 1) | ((b7 >> 5) & 0x01)
-    blockAcess[2] = (((b6 >> 2) & 0x01)  << 2) | (((b7 >> 2) & 0x01) < 1) | ((b7 >> 6) & 0x01)
-    blockAcess[3] = (((b6 >> 3) & 0x01)  << 2) | (((b7 >> 3) & 0x01) < 1) | ((b7 >> 7) & 0x01)
+    for i in range(MIFARE_1K_blocks_per_sector):
+        blockAcess[i] = (((c1 >> i) & 0x01) << 2) | (((c2 >> i) & 0x01) << 1) | ((c3 >> i) & 0x01)
     return blockAcess
-    
+
+#trailer bytes 6-8 for C1C2C3 of the 4 blocks (inverse of parseAccessBits)
+def encodeAccessBits(conditions: list[int]) -> bytearray:
+    if len(conditions) != MIFARE_1K_blocks_per_sector  or  any(c not in range(8) for c in conditions):
+        raise ValueError(f"need {MIFARE_1K_blocks_per_sector} conditions 0-7: {list(conditions)}")
+    c1 = c2 = c3 = 0
+    for i, c in enumerate(conditions):
+        c1 |= ((c >> 2) & 0x01) << i
+        c2 |= ((c >> 1) & 0x01) << i
+        c3 |= ( c       & 0x01) << i
+    return bytearray([(~c2 << 4 | ~c1 & 0x0F) & 0xFF, (c1 << 4 | ~c3 & 0x0F) & 0xFF, c3 << 4 | c2])
+
+#all 4096 valid access bytes -> conditions of the 4 blocks (invalid bytes are not in the table)
+ACCESS_CONDITIONS = {bytes(encodeAccessBits(conditions)): conditions
+                     for conditions in itertools.product(range(8), repeat=MIFARE_1K_blocks_per_sector)}
+
+#C1C2C3 of the 4 blocks of a sector from trailer bytes 6-8, None if the inverted copies do not match
+def accessConditions(accessBytes) -> list[int]:
+    conditions = ACCESS_CONDITIONS.get(bytes(accessBytes[0:3]))
+    return list(conditions) if conditions is not None else None
+
+#Access conditions of the MIFARE Classic datasheet: key types allowed per operation, indexed by C1C2C3 of the block
+A, B, AB, NEVER = "A", "B", "AB", ""
+#operations of data blocks (index in dataBlockRights)
+OP_READ      = 0
+OP_WRITE     = 1
+OP_INCREMENT = 2
+OP_DECREMENT = 3    #decrement, transfer, restore
+#data block: (read, write, increment, decrement/transfer/restore)
+dataBlockRights = {
+    0b000: (AB,    AB,    AB,    AB),
+    0b010: (AB,    NEVER, NEVER, NEVER),
+    0b100: (AB,    B,     NEVER, NEVER),
+    0b110: (AB,    B,     B,     AB),
+    0b001: (AB,    NEVER, NEVER, AB),
+    0b011: (B,     B,     NEVER, NEVER),
+    0b101: (B,     NEVER, NEVER, NEVER),
+    0b111: (NEVER, NEVER, NEVER, NEVER),
+}
+#sector trailer: (write key A, read access bits, write access bits, read key B, write key B)
+trailerRights = {
+    0b000: (A,     A,  NEVER, A,     A),
+    0b010: (NEVER, A,  NEVER, A,     NEVER),
+    0b100: (B,     AB, NEVER, NEVER, B),
+    0b110: (NEVER, AB, NEVER, NEVER, NEVER),
+    0b001: (A,     A,  A,     A,     A),
+    0b011: (B,     AB, B,     NEVER, B),
+    0b101: (NEVER, AB, B,     NEVER, NEVER),
+    0b111: (NEVER, AB, NEVER, NEVER, NEVER),
+}
+#trailer conditions where key B is readable - then key B can not be used to access the sector
+keyBReadable = (0b000, 0b010, 0b001)
+
+#key types ("A", "B", "AB" or "" = nobody) that may do the operation on the block (0-3 inside the sector);
+#for the trailer OP_READ reads access bits and OP_WRITE rewrites keys and access bits together.
+#None if the access bytes are not valid
+def allowedKeys(accessBytes, nBlockInSector: int, nOperation: int) -> str:
+    conditions = accessConditions(accessBytes)
+    if conditions is None:
+        return None
+    if nBlockInSector == MIFARE_1K_blocks_per_sector - 1:
+        writeKeyA, readAccess, writeAccess, _, writeKeyB = trailerRights[conditions[3]]
+        match nOperation:
+            case 0: #OP_READ
+                rights = readAccess
+            case 1: #OP_WRITE
+                rights = "".join(k for k in AB if k in writeKeyA  and  k in writeAccess  and  k in writeKeyB)
+            case _:
+                rights = NEVER
+    else:
+        rights = dataBlockRights[conditions[nBlockInSector]][nOperation]
+    if conditions[3] in keyBReadable:
+        rights = rights.replace(B, "")
+    return rights
+
+#text of data block conditions: R(ead) W(rite) I(ncrement) D(ecrement/transfer/restore) by key A, B or nobody (-)
 bitAccessMap = {
     0b000: "R(A,B) W(A,B) I(A,B) D(A,B)",
-    0b001: "R(A,B) W(B,B) I(-) D(-)",
-    0b010: "R(A,B) W(B) I(A,B) D(A,B)",
+    0b001: "R(A,B) W(-) I(-) D(A,B)",
+    0b010: "R(A,B) W(-) I(-) D(-)",
     0b011: "R(B) W(B) I(-) D(-)",
-    0b100: "R(A,B) W(B) I(A,B) D(A,B)",
-    0b101: "R(B) W(-) I(-,B) D(-,B)",
-    0b110: "R(A,B) W(-,B) I(-) D(-)",
-    0b111: "R(A,B) W(-) I(-) D(-)"
-} 
+    0b100: "R(A,B) W(B) I(-) D(-)",
+    0b101: "R(B) W(-) I(-) D(-)",
+    0b110: "R(A,B) W(B) I(B) D(A,B)",
+    0b111: "R(-) W(-) I(-) D(-)"
+}
+#text of trailer conditions: key A, access bits, key B - R(ead) and W(rite) by key A, B or nobody (-)
+trailerAccessMap = {
+    0b000: "keyA W(A) access R(A) W(-) keyB R(A) W(A)",
+    0b001: "keyA W(A) access R(A) W(A) keyB R(A) W(A)",
+    0b010: "keyA W(-) access R(A) W(-) keyB R(A) W(-)",
+    0b011: "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)",
+    0b100: "keyA W(B) access R(A,B) W(-) keyB R(-) W(B)",
+    0b101: "keyA W(-) access R(A,B) W(B) keyB R(-) W(-)",
+    0b110: "keyA W(-) access R(A,B) W(-) keyB R(-) W(-)",
+    0b111: "keyA W(-) access R(A,B) W(-) keyB R(-) W(-)"
+}
 
 def bytes2str(b) -> str:
     return "[" + " ".join(f"{ch:02X}" for ch in b) + "]"
 
 #return array of strings, where each string is human representation of block access rights
+#(empty strings if the access bytes are not valid)
 def accessBitsToStr(accessBytes) -> [str]:
-    blockAcess = parseAccessBits(accessBytes[0], accessBytes[1])
+    blockAcess = accessConditions(accessBytes)
     resultStrBlocks = [""  for _ in range(MIFARE_1K_blocks_per_sector)]
-    for i in range(MIFARE_1K_blocks_per_sector):
+    for i in range(MIFARE_1K_blocks_per_sector if blockAcess is not None else 0):
         resultStrBlocks[i] = bitAccessMap.get(blockAcess[i])
     return resultStrBlocks
 
+#condition of a rule text of bitAccessMap (trailerAccessMap for the trailer), case and spaces do not matter
+def ruleToCondition(rule: str, isTrailer: bool = False) -> int:
+    normalize = lambda text: "".join(text.split()).upper()
+    for condition, text in sorted((trailerAccessMap if isTrailer else bitAccessMap).items()):
+        if normalize(text) == normalize(rule):
+            return condition
+    raise ValueError(f"unknown {'trailer' if isTrailer else 'data block'} access rule: {rule}")
+
+#access bytes from readable rules, e.g. accessBitsFromRules("R(A,B) W(B) I(-) D(-)", "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)");
+#blockRules: one rule for all data blocks or a rule for each of blocks 0-2
+def accessBitsFromRules(blockRules, trailerRule: str) -> bytearray:
+    blockRules = [blockRules] * (MIFARE_1K_blocks_per_sector - 1) if isinstance(blockRules, str) else list(blockRules)
+    if len(blockRules) != MIFARE_1K_blocks_per_sector - 1:
+        raise ValueError(f"need 1 or {MIFARE_1K_blocks_per_sector - 1} data block rules")
+    return encodeAccessBits([ruleToCondition(rule) for rule in blockRules] + [ruleToCondition(trailerRule, isTrailer=True)])
+
+#sector trailer block: key A, access bits, GPB (0x69 as in transport configuration), key B
+def buildTrailer(keyA: list[bytes], accessBits: list[bytes], keyB: list[bytes], GPB: int = 0x69) -> bytes:
+    if accessConditions(accessBits) is None:
+        raise ValueError(f"invalid access bits: {bytes2str(accessBits[0:3])}")
+    if len(keyA) != MIFARE_1K_bytes_per_key  or  len(keyB) != MIFARE_1K_bytes_per_key:
+        raise ValueError(f"keys must be {MIFARE_1K_bytes_per_key} bytes")
+    return bytes(keyA) + bytes(accessBits[0:3]) + bytes([GPB]) + bytes(keyB)
+
 class keyType(Enum):
     KT_A = "A"
     KT_B = "B"
 
 class key:
-    def __init__(self, kType = keyType.KT_B, kData: list[bytes] = MIFARE_1K_default_key):
+    def __init__(self, kType = keyType.KT_A, kData: list[bytes] = MIFARE_1K_default_key):
         self.keyType = kType
         self.keyData = kData
 
@@ -144,17 +263,63 @@ class dumpMifare_1k:
         self.head    = dumpMifare_1k.head()
         self.sectors = [dumpMifare_1k.sector() for _ in range(MIFARE_1K_total_sectors)]
         self.ATR     = bytearray(0)
+        self.ATS     = bytearray(0)  #historical bytes of ATS (GET DATA), empty for MIFARE Classic
+        self.UID     = bytearray(0)  #full UID by GET DATA (4, 7 or 10 bytes; head.UID keeps 4), empty if not asked
         self.status  = status.S_NOINIT
 
+    #block by absolute number (0-63)
+    def blockAt(self, nBlockThrowCard: int) -> "dumpMifare_1k.block":
+        return self.sectors[nBlockThrowCard // MIFARE_1K_blocks_per_sector].blocks[nBlockThrowCard % MIFARE_1K_blocks_per_sector]
+
+    #forget card content (other card in the field or card was written), ATR stays
+    def clear(self) -> None:
+        self.head = dumpMifare_1k.head()
+        for iSector in range(len(self.sectors)):
+            self.sectors[iSector] = dumpMifare_1k.sector()
+        self.ATS    = bytearray(0)
+        self.UID    = bytearray(0)
+        self.status = status.S_NOINIT
+
+    #sectors never read or not reached by an aborted read
+    def missingSectors(self) -> list[int]:
+        return [iSector for iSector, sector in enumerate(self.sectors) if sector.status in (status.S_NOINIT, status.S_NOT_READ)]
+
 ############################################################################################################
+#access rights of data blocks and of the trailer (last string) as text
+def sectorAccessToStr(accessBytes) -> [str]:
+    accessBitsStr = accessBitsToStr(accessBytes)
+    conditions    = accessConditions(accessBytes)
+    if conditions is not None:
+        accessBitsStr[-1] = trailerAccessMap[conditions[-1]]
+    return accessBitsStr
+
+
 #dump sector
 def printSector(n : int, sector : dumpMifare_1k.sector):
     print(f"sector {n:02d} {sector.status.value}; {sector.trailer.toStr()} -----------------------------------------------")
-    accessBitsStr = accessBitsToStr(sector.trailer.accessBits)
+    accessBitsStr = sectorAccessToStr(sector.trailer.accessBits)
     for iBlock, block in enumerate(sector.blocks):
         print (f" {iBlock:02d} {block.toStr(iBlock + 1 < MIFARE_1K_blocks_per_sector)}  access: {accessBitsStr[iBlock]}")
 
 
+#sector as plain data for JSON: statuses, block data and trailer in hex, access rights as printed
+def sectorToDict(n: int, sector: dumpMifare_1k.sector) -> dict:
+    accessBitsStr = sectorAccessToStr(sector.trailer.accessBits)
+    trailer = sector.trailer
+    return {
+        "sector":  n,
+        "status":  sector.status.value,
+        "blocks":  [{"status": block.status.value,
+                     "data":   bytes(block.data).hex().upper() if block.status == status.S_OK else None,
+                     "access": accessBitsStr[iBlock]}
+                    for iBlock, block in enumerate(sector.blocks)],
+        "trailer": {"status":     trailer.status.value,
+                    "accessBits": bytes(trailer.accessBits).hex().upper(),
+                    "GPB":        trailer.GPB,
+                    "keyB":       bytes(trailer.keyB.keyData).hex().upper()} if trailer.status == status.S_OK else None,
+    }
+
+
 #dump all card info
 def printDump(dump, sectors=[0]):
     print(dump.head.toStr())
@@ -169,3 +334,179 @@ def printATR(dump):
     print(f"ATR: T0:{atr.isT0Supported()} T1:{atr.isT1Supported()} T15:{atr.isT15Supported()} GuardTime:{atr.getGuardTime()} Hist btytes {atr.getHistoricalBytes()} ")
 
 
+
+
+############################################################################################################
+#MIFARE Application Directory (MAD v1, NXP AN10787): sector 0 blocks 1-2 hold CRC, info byte and one
+#application ID (AID, 2 bytes little endian: application code, function cluster) per sector 1-15
+MAD_KEY_A   = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]  #public key A of sector 0
+NDEF_KEY_A  = [0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7]  #public key A of NDEF sectors (NFC Forum Type MIFARE Classic)
+NDEF_AID    = 0xE103
+MAD_AID_FREE        = 0x0000
+MAD_AID_DEFECT      = 0x0001
+MAD_AID_RESERVED    = 0x0002
+MAD_AID_ADDITIONAL  = 0x0003
+MAD_AID_CARD_HOLDER = 0x0004
+MAD_AID_NOT_APPLIED = 0x0005
+MAD_GPB_DA          = 0x80  #GPB of sector 0: MAD is present
+
+#CRC-8 of MAD: polynomial x8+x4+x3+x2+1 (0x1D), preset 0xC7
+def madCRC(data) -> int:
+    crc = 0xC7
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1D) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def decodeMAD(dump: dumpMifare_1k) -> list[int]:
+    """
+    AIDs of sectors from the MAD in sector 0 of the dump.
+
+    Returns:
+        list: AID of every sector (index = sector number, sector 0 holds MAD_AID_NOT_APPLIED),
+              None if blocks 1-2 are not read, the CRC is wrong or GPB says there is no MAD.
+    """
+    sector0 = dump.sectors[0]
+    if sector0.blocks[1].status != status.S_OK  or  sector0.blocks[2].status != status.S_OK:
+        return None
+    if sector0.trailer.status == status.S_OK  and  not sector0.trailer.GPB & MAD_GPB_DA:
+        return None
+    mad = bytes(sector0.blocks[1].data) + bytes(sector0.blocks[2].data)
+    if madCRC(mad[1:]) != mad[0]:
+        return None
+    return [MAD_AID_NOT_APPLIED] + [mad[2 + 2 * i] | (mad[3 + 2 * i] << 8) for i in range(MIFARE_1K_total_sectors - 1)]
+
+
+#sectors of the application (in order: data of an application continues from one sector to the next)
+def applicationSectors(mad: list[int], aid: int) -> list[int]:
+    return [iSector for iSector, sectorAID in enumerate(mad or []) if sectorAID == aid  and  iSector != 0]
+
+
+#data blocks (trailers excluded) of sectors joined together, None if any of them is not read
+def sectorsData(dump: dumpMifare_1k, sectors: list[int]) -> bytes:
+    Result = bytearray()
+    for iSector in sectors:
+        for block in dump.sectors[iSector].blocks[:MIFARE_1K_blocks_per_sector - 1]:
+            if block.status != status.S_OK:
+                return None
+            Result += bytes(block.data)
+    return bytes(Result)
+
+
+#NDEF TLV types in data area of NDEF sectors
+TLV_NULL       = 0x00
+TLV_NDEF       = 0x03
+TLV_TERMINATOR = 0xFE
+
+def decodeTLVs(data: bytes) -> list[tuple]:
+    """(type, value) of TLVs until terminator or end of data; length is 1 byte or FF + 2 bytes big endian."""
+    Result = []
+    i = 0
+    while i < len(data):
+        tlvType = data[i]
+        i += 1
+        if tlvType == TLV_NULL:
+            continue
+        if tlvType == TLV_TERMINATOR  or  i >= len(data):
+            break
+        length = data[i]
+        i += 1
+        if length == 0xFF:
+            length = int.from_bytes(data[i:i + 2], "big")
+            i += 2
+        Result.append((tlvType, bytes(data[i:i + length])))
+        i += length
+    return Result
+
+
+#one record of NDEF message: tnf - type name format (1 = NFC Forum well-known type, 2 = MIME, 3 = URI...)
+ndefRecord = namedtuple("ndefRecord", ["tnf", "type", "id", "payload"])
+
+def decodeNdefMessage(message: bytes) -> list[ndefRecord]:
+    Result = []
+    i = 0
+    while i + 2 < len(message):
+        header  = message[i]
+        typeLen = message[i + 1]
+        i += 2
+        if header & 0x10: #SR: 1 byte payload length
+            payloadLen = message[i]
+            i += 1
+        else:
+            payloadLen = int.from_bytes(message[i:i + 4], "big")
+            i += 4
+        idLen = 0
+        if header & 0x08: #IL: ID length present
+            idLen = message[i]
+            i += 1
+        recordType = message[i:i + typeLen]
+        i += typeLen
+        recordId = message[i:i + idLen]
+        i += idLen
+        Result.append(ndefRecord(header & 0x07, bytes(recordType), bytes(recordId), bytes(message[i:i + payloadLen])))
+        i += payloadLen
+        if header & 0x40: #ME: message end
+            break
+    return Result
+
+
+#NDEF records of all NDEF message TLVs in the given sectors (MAD sectors with NDEF_AID by default)
+def decodeNdef(dump: dumpMifare_1k, sectors: list[int] | None = None) -> list[ndefRecord]:
+    if sectors is None:
+        sectors = applicationSectors(decodeMAD(dump), NDEF_AID)
+    data = sectorsData(dump, sectors)
+    if data is None:
+        return []
+    Result = []
+    for tlvType, value in decodeTLVs(data):
+        if tlvType == TLV_NDEF:
+            Result += decodeNdefMessage(value)
+    return Result
+
+
+#URI prefixes of well-known URI record ("U"), by first payload byte
+NDEF_URI_PREFIXES = ("", "http://www.", "https://www.", "http://", "https://", "tel:", "mailto:", "ftp://anonymous:anonymous@",
+                     "ftp://ftp.", "ftps://", "sftp://", "smb://", "nfs://", "ftp://", "dav://", "news:", "telnet://", "imap:",
+                     "rtsp://", "urn:", "pop:", "sip:", "sips:", "tftp:", "btspp://", "btl2cap://", "btgoep://", "tcpobex://",
+                     "irdaobex://", "file://", "urn:epc:id:", "urn:epc:tag:", "urn:epc:pat:", "urn:epc:raw:", "urn:epc:", "urn:nfc:")
+
+def ndefRecordToStr(record: ndefRecord) -> str:
+    if record.tnf == 0x01  and  record.type == b"U"  and  len(record.payload) > 0:
+        prefix = NDEF_URI_PREFIXES[record.payload[0]] if record.payload[0] < len(NDEF_URI_PREFIXES) else ""
+        return "URI: " + prefix + record.payload[1:].decode("utf-8", errors="replace")
+    if record.tnf == 0x01  and  record.type == b"T"  and  len(record.payload) > 0:
+        langLen  = record.payload[0] & 0x3F
+        encoding = "utf-16" if record.payload[0] & 0x80 else "utf-8"
+        lang = record.payload[1:1 + langLen].decode("ascii", errors="replace")
+        return f"Text({lang}): " + record.payload[1 + langLen:].decode(encoding, errors="replace")
+    return f"TNF:{record.tnf} type:{record.type.decode('ascii', errors='replace')} payload:{bytes2str(record.payload)}"
+
+
+############################################################################################################
+#Value block (MIFARE Classic datasheet, 8.6.2.1): signed 4-byte value (little endian) stored as value, ~value, value,
+#then a 1-byte address (free use, e.g. block number of the backup) stored as addr, ~addr, addr, ~addr
+VALUE_MIN = -0x80000000
+VALUE_MAX =  0x7FFFFFFF
+
+def encodeValue(value: int, nAddr: int = 0) -> bytearray:
+    if not VALUE_MIN <= value <= VALUE_MAX:
+        raise ValueError(f"value {value} does not fit into 32 bits")
+    valueBytes = (value & 0xFFFFFFFF).to_bytes(4, "little")
+    inverted   = bytes(b ^ 0xFF for b in valueBytes)
+    nAddr &= 0xFF
+    return bytearray(valueBytes + inverted + valueBytes + bytes([nAddr, nAddr ^ 0xFF, nAddr, nAddr ^ 0xFF]))
+
+
+#(value, address) of a value block, None if the data is not a value block (copies do not match)
+def decodeValue(data) -> (int, int):
+    data = bytes(data)
+    if len(data) != MIFARE_1K_bytes_per_block:
+        return None
+    valueBytes, inverted, copy = data[0:4], data[4:8], data[8:12]
+    if valueBytes != copy  or  any(b ^ c != 0xFF for b, c in zip(valueBytes, inverted)):
+        return None
+    if data[12] != data[14]  or  data[13] != data[15]  or  data[12] ^ data[13] != 0xFF:
+        return None
+    return int.from_bytes(valueBytes, "little", signed=True), data[12]
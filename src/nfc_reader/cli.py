@@ -1,7 +1,77 @@
-from nfc_reader.do_card import startObserver  # type: ignore[import-not-found]
+import argparse
+import os
+import sys
+
+#modules of the package import each other as top-level modules (import card_data, import do_comm...)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import card_data  # type: ignore[import-not-found]
+import do_card  # type: ignore[import-not-found]
+import do_prompt  # type: ignore[import-not-found]
+import do_stats  # type: ignore[import-not-found]
 
 
 def main() -> None:
-    #Console entry point: waits for card and prints dump.
-    startObserver()
+    #Console entry point: interactive menu by default, UID-only reading with --uid.
+    parser = argparse.ArgumentParser(prog="nfc-read", description="MIFARE Classic 1K reader")
+    parser.add_argument("--uid",  action="store_true", help="print UID of every card put on the reader (no authentication)")
+    parser.add_argument("--ats",  action="store_true", help="with --uid: print ATS historical bytes too (ISO 14443-4 cards)")
+    parser.add_argument("--once", action="store_true", help="with --uid, --ndjson, --write or --watch: exit after the first card")
+    parser.add_argument("--ndjson", action="store_true", help="read whole cards, one JSON line per sector as soon as it is read")
+    parser.add_argument("--write", metavar="FILE", help="write the file (- for stdin) to every card put on the reader")
+    parser.add_argument("--hex",  action="store_true", help="with --write: the file holds hex digits, not binary data")
+    parser.add_argument("--at",   metavar="SECTOR:BLOCK", default="1:0", help="with --write: first block to write (default 1:0)")
+    parser.add_argument("--allow-reserved", action="store_true",
+                        help="with --write: accept --at on block 0 or a sector trailer (writing starts at the next data block)")
+    parser.add_argument("--no-incremental", action="store_true",
+                        help="with --write or in the menu: write every block, also those holding the data already")
+    parser.add_argument("--no-verify", action="store_true", help="with --write or in the menu: do not read written blocks back")
+    parser.add_argument("--watch", metavar="BLOCKS", help="print changes of the blocks (e.g. 4,5,8-11 or 1:0-1:2) while the card stays on the reader")
+    parser.add_argument("--rate", type=float, default=20.0, help="with --watch: samples per second (default 20)")
+    parser.add_argument("--keys", metavar="FILE", help="candidate keys, one per line: [A:|B:]12 hex digits")
+    parser.add_argument("--secret", metavar="FILE", help="site secret (hex): sector keys are derived from it and the card UID")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="keep APDU counters and latencies in FILE, Prometheus text format (node_exporter textfile collector)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="with --metrics: seconds between updates (default 15)")
+    args = parser.parse_args()
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be positive")
+    exporter = None
+    if args.metrics is not None:
+        try:
+            exporter = do_stats.periodicExport(args.metrics, args.metrics_interval).start()
+        except OSError as e:
+            parser.error(f"--metrics: {e}")
+    try:
+        fnRunMode(parser, args)
+    finally:
+        exporter and exporter.stop()
+
 
+#mode chosen by the arguments, runs until the mode ends (Ctrl+C, --once, quit in the menu)
+def fnRunMode(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.uid:
+        do_card.startUidReader(withATS=args.ats, once=args.once)
+    elif args.watch is not None:
+        try:
+            blockNumbers = do_prompt.fnParseBlockList(args.watch, card_data.MIFARE_1K_blocks_per_sector,
+                                                      card_data.MIFARE_1K_total_sectors * card_data.MIFARE_1K_blocks_per_sector)
+        except ValueError as e:
+            parser.error(f"--watch: {e}")
+        if args.rate <= 0:
+            parser.error("--rate must be positive")
+        do_card.startWatch(blockNumbers, args.rate, keysFile=args.keys, secretFile=args.secret, once=args.once)
+    elif args.write is not None:
+        try:
+            nSector, nBlock = do_prompt.fnParseBlockAddress(args.at, card_data.MIFARE_1K_blocks_per_sector,
+                                                            card_data.MIFARE_1K_total_sectors, args.allow_reserved)
+        except ValueError as e:
+            parser.error(f"--at: {e}")
+        do_card.startFileWriter(args.write, nSector, nBlock, isHex=args.hex, keysFile=args.keys,
+                                secretFile=args.secret, once=args.once, incremental=not args.no_incremental,
+                                verify=not args.no_verify)
+    elif args.ndjson:
+        do_card.startStreamReader(keysFile=args.keys, once=args.once, secretFile=args.secret)
+    else:
+        do_card.startObserver(keysFile=args.keys, secretFile=args.secret, incremental=not args.no_incremental,
+                              verify=not args.no_verify)
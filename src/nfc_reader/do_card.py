@@ -1,19 +1,31 @@
 import sys
+import json
 import time 
+import contextlib
 import queue
 import threading
 import smartcard.System
-from enum                      import Enum
-from smartcard.CardRequest     import CardRequest
-from smartcard.CardMonitoring  import CardMonitor, CardObserver
+from collections.abc            import Callable
+from enum                       import Enum
+from smartcard.CardRequest      import CardRequest
+from smartcard.Exceptions       import CardConnectionException, CardRequestTimeoutException, NoCardException
+from smartcard.CardMonitoring   import CardMonitor, CardObserver
+from smartcard.ReaderMonitoring import ReaderMonitor, ReaderObserver
 
 import card_data
+import do_comm
+import do_keys
 import do_prompt
+import do_reader
+import do_stats
 import do_wr
 
 
 TIME_TO_WAIT_CARD = 12
 
+#errors that end the work on one card, not the loop waiting for the next card
+CARD_ERRORS = (CardConnectionException, NoCardException, do_comm.TransmitTimeout)
+
 readers = []
 
 class actResponce(Enum):
@@ -33,7 +45,8 @@ class BackgroundInputProcessor:
         self.resultQueue = queue.Queue(maxsize=1)
         self.cancelEvent = threading.Event()
         self.lock        = threading.Lock()  
-        self.key         = card_data.key() #default Key B:FFFFFFFFFFFF for card operations
+        self.key         = card_data.key() #default Key A:FFFFFFFFFFFF for writes
+        self.keyring     = do_keys.keyRing() #keys tried on each sector when reading (well-known keys by default)
         self.writeData   = do_prompt.PromptAnswer_ForWrite()
         self.nSector     = -1
 
@@ -60,7 +73,8 @@ class BackgroundInputProcessor:
                 case do_prompt.actions.A_READ_KEY:
                     isOk, keyType, keyData = do_prompt.askKey_FromTerminal(card_data.MIFARE_1K_bytes_per_key, self.cancelEvent)
                     if isOk:
-                        self.key = card_data.key(keyType, keyData)
+                        self.key = card_data.key(card_data.keyType(keyType), keyData)
+                        self.keyring.add(self.key, preferred=True)
 
                 case do_prompt.actions.A_PRINT_SECTOR:
                     isOk, self.nSector = do_prompt.askSectorNumber_FromTerminal(card_data.MIFARE_1K_total_sectors, self.cancelEvent)
@@ -106,15 +120,19 @@ class CardProcessor():
         def __init__(self) -> None:
             self.sectorIndex = -1
             self.blockIndex  = -1
+            self.sectors     = []  #sectors to read for printing
             #self.key         = card_data.MIFARE_1K_default_key
             self.blockData   = bytearray(card_data.MIFARE_1K_bytes_per_block)
 
     class LocalCardObeserver(CardObserver):
-        def __init__(self, insertEvent: threading.Event) -> None:
+        #monitor/cardRequest can be replaced (e.g. by do_emul.VirtualReader) to run without hardware
+        def __init__(self, insertEvent: threading.Event, monitor = None, cardRequest: Callable | None = None) -> None:
             super().__init__()
             self.insertEvent    = insertEvent
-            self.monitor        = CardMonitor()
+            self.monitor        = monitor if monitor is not None else CardMonitor()
+            self.cardRequest    = cardRequest if cardRequest is not None else CardRequest
             self.ATR            = bytearray(0)
+            self.readerName     = ""    #reader of the last inserted card
             self.inputProcessor = BackgroundInputProcessor()
             self.monitor.addObserver(self)
 
@@ -122,6 +140,7 @@ class CardProcessor():
         def update(self, observable, handlers) -> None:
             inserted, removed = handlers
             if len(inserted) != 0: #we have a card inserted
+                self.readerName = str(inserted[0].reader)
                 sys.stdout.write(f"\rInserted: {card_data.bytes2str(inserted[0].atr)}\n")
                 self.insertEvent.set()
             if len(removed) != 0:
@@ -134,13 +153,17 @@ class CardProcessor():
             self.insertEvent.wait(timeout=1)
             if self.insertEvent.is_set():
                 try:
-                    cardRequest    = CardRequest(timeout=1)
-                    cardService    = cardRequest.waitforcard()
-                    cardConnection = cardService.connection
-                    cardConnection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)
+                    cardRequest, cardService = None, None
+                    cardConnection = do_reader.fnConnection(self.readerName) #pre-warmed: no reader lookup per tap
+                    if cardConnection is None:
+                        cardRequest    = self.cardRequest(timeout=1)
+                        cardService    = cardRequest.waitforcard()
+                        cardConnection = cardService.connection
+                    cardConnection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)
                     self.ATR = cardConnection.getATR()
                     return True, cardRequest, cardService, cardConnection
                 except Exception as e:
+                    do_reader.fnForget(self.readerName) #probe again on next tap
                     sys.stdout.write(f"\nConnection error {e}\n")
             else:
                 sys.stdout.write("\rconnection timeout            ")
@@ -149,8 +172,12 @@ class CardProcessor():
 
     def executeCommunication(self, operation: callable):  
         isOkConnection, cardRequest, cardService, cardConnection = self.observer.waitForConnection()
-        isOkResult = isOkConnection and operation(cardConnection)
-        isOkConnection and cardConnection.disconnect()
+        isOkResult = isOkConnection and operation(do_reader.fnOpenSession(cardConnection))
+        if isOkConnection:
+            try: #wedged reader must not hang service thread (and main loop waiting for responce)
+                do_comm.transmitWatchdog.call(cardConnection.disconnect, timeout=do_comm.TIMEOUT_APDU)
+            except (do_comm.TransmitTimeout, CardConnectionException) as e:
+                sys.stdout.write(f"\nDisconnect error {e}\n")
         self.responceQueue.put(actResponce.fromBool(isOkResult))
 
 
@@ -168,24 +195,70 @@ class CardProcessor():
                         self.responceQueue.put(actResponce.A_RESPONCE_OK)
 
                     case do_prompt.actions.A_READ:
-                        self.executeCommunication(lambda conn: do_wr.fnRead (conn, self.dump, self.observer.inputProcessor.key))
+                        #previous tap was cut off: finish that dump if the same card is back
+                        resume = self.dump.status in (card_data.status.S_NO_CARD, card_data.status.S_TIMEOUT)
+                        if not resume:
+                            self.dump.clear() #new card: other sectors are read when they are printed
+                        self.executeCommunication(lambda conn, resume=resume: do_wr.fnReadSectors(conn, self.dump, self.observer.inputProcessor.key, [0], resume=resume,
+                                                                                                  keyring=self.observer.inputProcessor.keyring))
+
+                    case do_prompt.actions.A_PRINT_SECTOR:
+                        #read sectors to print that are not in dump yet (dump is cleared if another card is tapped)
+                        self.executeCommunication(lambda conn: do_wr.fnReadSectors(conn, self.dump, self.observer.inputProcessor.key,
+                                                                                   self.dataToProcess.sectors, resume=True,
+                                                                                   keyring=self.observer.inputProcessor.keyring))
+
+                    case do_prompt.actions.A_READ_NDEF:
+                        self.dump.clear()
+                        self.executeCommunication(lambda conn: do_wr.fnReadApplication(conn, self.dump)[0])
+
+                    case do_prompt.actions.A_READ_UID:
+                        self.executeCommunication(lambda conn: do_wr.fnReadUID(conn, self.dump))
 
                     case do_prompt.actions.A_WRITE:
-                        self.executeCommunication(lambda conn: do_wr.fnWrite(conn, self.observer.inputProcessor.writeData, self.observer.inputProcessor.key))
+                        #incremental: blocks holding the data are skipped (read from the card again, the dump may be
+                        #older than the card content); verify: written blocks are read back. Both update the dump
+                        self.executeCommunication(lambda conn: do_wr.fnWrite(conn, self.observer.inputProcessor.writeData, self.observer.inputProcessor.key,
+                                                                             incremental=self.incremental, baseline=self.dump, verify=self.verify,
+                                                                             keyring=self.observer.inputProcessor.keyring, refresh=True))
 
                 self.messageQueue.task_done()
         except Exception as e:
             print(f"{e}")
             
             
-    def __init__(self) -> None:
+    def __init__(self, monitor = None, cardRequest: Callable | None = None, incremental: bool = True, verify: bool = True) -> None:
         self.messageQueue     = queue.Queue(maxsize=2)
+        self.incremental      = incremental  #writes skip blocks that hold the data already
+        self.verify           = verify       #written blocks are read back
         self.responceQueue    = queue.Queue(maxsize=2)
         self.dump             = card_data.dumpMifare_1k()
         self.dataToProcess    = CardProcessor.processData()
         self.cardInsertedEvent= threading.Event()
         self.selfTask         = threading.Thread(target=self.process, daemon=True)
-        self.observer         = CardProcessor.LocalCardObeserver(self.cardInsertedEvent)
+        self.observer         = CardProcessor.LocalCardObeserver(self.cardInsertedEvent, monitor, cardRequest)
+
+#read sectors that are not in dump yet (waits for a tap), False if reading failed
+def fnFetchSectors(processor: CardProcessor, sectors: list[int]) -> bool:
+    missing = [iSector for iSector in processor.dump.missingSectors() if iSector in sectors]
+    if len(missing) == 0:
+        return True
+    WaitForCard(processor.cardInsertedEvent)
+    processor.dataToProcess.sectors = missing
+    processor.messageQueue.put(do_prompt.actions.A_PRINT_SECTOR)
+    return fnWaitForResponce(processor.responceQueue)
+
+
+#probe readers when they appear (vendor setup is applied once), forget them when unplugged
+class LocalReaderObserver(ReaderObserver):
+    def update(self, observable, handlers) -> None:
+        added, removed = handlers
+        for reader in added:
+            profile = do_reader.fnPrewarm(reader)
+            sys.stdout.write(f"\rReader: {profile.toStr()}\n")
+        for reader in removed:
+            do_reader.fnForget(str(reader))
+
 
 #waiting while ervice thread process it's queue
 def fnWaitForResponce(queueResponce: queue.Queue) -> bool:
@@ -212,15 +285,29 @@ def WaitForCard(e: threading.Event):
         nWaitStr += 1
 
 
-###################################################
-if __name__ == "__main__":
+#keys of files given on the command line: candidate keys (see do_keys.parseKeyLine), site secret for keys derived per UID
+def fnSetupKeyring(keyring: do_keys.keyRing, keysFile: str | None = None, secretFile: str | None = None, out=sys.stdout) -> None:
+    if keysFile is not None:
+        print(f"keys loaded: {keyring.load(keysFile)}", file=out)
+    if secretFile is not None:
+        keyring.addDerivation(do_keys.keyDerivation(do_keys.fnLoadSecret(secretFile)))
+        print("keys are derived from UID", file=out)
+
+
+#interactive loop: wait for card, run actions chosen in terminal (keysFile, secretFile: see fnSetupKeyring;
+#incremental, verify: see do_wr.fnWrite)
+def startObserver(keysFile: str | None = None, secretFile: str | None = None, incremental: bool = True, verify: bool = True) -> None:
     readers = smartcard.System.readers()
     if not readers:
         print("no readers")
     else:
         print(readers[0])
+        readerMonitor  = ReaderMonitor()
+        readerObserver = LocalReaderObserver()
+        readerMonitor.addObserver(readerObserver) #reports readers already attached at once
         # Create input manager for interruptible user input
-        mainCardProcessor = CardProcessor()
+        mainCardProcessor = CardProcessor(incremental=incremental, verify=verify)
+        fnSetupKeyring(mainCardProcessor.observer.inputProcessor.keyring, keysFile, secretFile)
         mainCardProcessor.selfTask.start()
         action = do_prompt.actions.A_READ
 
@@ -228,7 +315,7 @@ if __name__ == "__main__":
             while mainCardProcessor.selfTask.is_alive():
                 # Skip action processing if action is None (input was cancelled in previous iteration)
                 if action is not None:
-                    if action == do_prompt.actions.A_READ  or action == do_prompt.actions.A_WRITE:
+                    if action in (do_prompt.actions.A_READ, do_prompt.actions.A_READ_UID, do_prompt.actions.A_READ_NDEF, do_prompt.actions.A_WRITE):
                         WaitForCard(mainCardProcessor.cardInsertedEvent)
 
                     match action:
@@ -237,12 +324,27 @@ if __name__ == "__main__":
                             if fnWaitForResponce(mainCardProcessor.responceQueue):
                                 card_data.printSector(0, mainCardProcessor.dump.sectors[0])
 
+                        case do_prompt.actions.A_READ_UID:
+                            mainCardProcessor.messageQueue.put(do_prompt.actions.A_READ_UID)
+                            if fnWaitForResponce(mainCardProcessor.responceQueue):
+                                print(f"UID: {card_data.bytes2str(mainCardProcessor.dump.head.UID)}")
+
+                        case do_prompt.actions.A_READ_NDEF:
+                            mainCardProcessor.messageQueue.put(do_prompt.actions.A_READ_NDEF)
+                            fnWaitForResponce(mainCardProcessor.responceQueue)
+                            records = card_data.decodeNdef(mainCardProcessor.dump)
+                            if len(records) == 0:
+                                print("no NDEF records")
+                            for record in records:
+                                print(card_data.ndefRecordToStr(record))
+
                         case do_prompt.actions.A_READ_KEY:
                             pass #already read key from terminal in background thread
 
                         case do_prompt.actions.A_PRINT_SECTOR:
                             nSector = mainCardProcessor.observer.inputProcessor.nSector
                             if nSector >= 0 and nSector < card_data.MIFARE_1K_total_sectors:
+                                fnFetchSectors(mainCardProcessor, [nSector])
                                 card_data.printSector(nSector, mainCardProcessor.dump.sectors[nSector])
                             else:
                                 print("Invalid sector number")
@@ -253,8 +355,12 @@ if __name__ == "__main__":
 
                         case do_prompt.actions.A_PRINT_ALL:
                             all_sectors = list(range(card_data.MIFARE_1K_total_sectors))
+                            fnFetchSectors(mainCardProcessor, all_sectors)
                             card_data.printDump(mainCardProcessor.dump, sectors=all_sectors)
 
+                        case do_prompt.actions.A_PRINT_STATS:
+                            print(do_stats.stats.toStr())
+
                         case do_prompt.actions.A_QUIT:
                             mainCardProcessor.messageQueue.put(do_prompt.actions.A_QUIT)
                             if fnWaitForResponce(mainCardProcessor.responceQueue):
@@ -266,6 +372,138 @@ if __name__ == "__main__":
         finally:
             # Cleanup: cancel input and wait for thread to finish
             mainCardProcessor.observer.inputProcessor.cleanup()
+            readerMonitor.deleteObserver(readerObserver)
 
         sys.stdout.write("\rgood by\n\n")
 
+
+
+#print UID of every card put on the reader (GET DATA only, no authentication) until Ctrl+C or first card if once
+def startUidReader(withATS: bool = False, once: bool = False) -> None:
+    try:
+        while True:
+            try:
+                cardService = CardRequest(timeout=TIME_TO_WAIT_CARD, newcardonly=True).waitforcard()
+            except CardRequestTimeoutException:
+                continue
+            connection = cardService.connection
+            try:
+                connection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)
+                dump   = card_data.dumpMifare_1k()
+                result = do_wr.fnReadUID(do_reader.fnOpenSession(connection), dump, withATS)
+                if result:
+                    ats = f" ATS:{card_data.bytes2str(dump.ATS)}" if withATS and len(dump.ATS) != 0 else ""
+                    print(f"UID:{card_data.bytes2str(dump.head.UID)}{ats}", flush=True)
+                else:
+                    print(f"UID read failed: {result.stopReason.value}", flush=True)
+                connection.disconnect()
+            except CARD_ERRORS as e:
+                print(f"Connection error {e}")
+            if once:
+                break
+    except KeyboardInterrupt:
+        pass
+
+
+#read every card put on the reader and write it to stdout as NDJSON: one line per sector as soon as it is
+#read (card_data.sectorToDict), then a summary line; messages of the read go to stderr. Until Ctrl+C or first card if once
+def startStreamReader(keysFile: str | None = None, once: bool = False, secretFile: str | None = None) -> None:
+    out     = sys.stdout
+    keyring = do_keys.keyRing()
+    fnSetupKeyring(keyring, keysFile, secretFile, out=sys.stderr)
+    try:
+        while True:
+            try:
+                cardService = CardRequest(timeout=TIME_TO_WAIT_CARD, newcardonly=True).waitforcard()
+            except CardRequestTimeoutException:
+                continue
+            connection = cardService.connection
+            try:
+                connection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)
+                dump   = card_data.dumpMifare_1k()
+                result = do_wr.opResult(0)
+                with contextlib.redirect_stdout(sys.stderr):
+                    for nSector, sector in do_wr.fnReadIter(do_reader.fnOpenSession(connection), dump, None,
+                                                            keyring=keyring, result=result):
+                        out.write(json.dumps(card_data.sectorToDict(nSector, sector), separators=(",", ":")) + "\n")
+                        out.flush()
+                summary = {"UID": bytes(dump.UID or dump.head.UID).hex().upper(), "done": result.nDone, "total": result.nTotal,
+                           "stopReason": result.stopReason.value if result.isAborted else None}
+                out.write(json.dumps(summary, separators=(",", ":")) + "\n")
+                out.flush()
+                connection.disconnect()
+            except CARD_ERRORS as e:
+                print(f"Connection error {e}", file=sys.stderr)
+            if once:
+                break
+    except KeyboardInterrupt:
+        pass
+
+
+#write the payload of a file (stdin for "-", see do_prompt.fnLoadPayload) from block nSector:nBlock on to every
+#card put on the reader, skipping blocks that hold the data (incremental) and reading each sector back (verify);
+#the payload is loaded once. Until Ctrl+C or first card if once
+def startFileWriter(path: str, nSector: int, nBlock: int, isHex: bool = False, keysFile: str | None = None,
+                    secretFile: str | None = None, once: bool = False, incremental: bool = True, verify: bool = True) -> None:
+    try:
+        writeData = do_prompt.fnWriteFromFile(path, nSector, nBlock, card_data.MIFARE_1K_bytes_per_block, isHex)
+    except (OSError, ValueError) as e:
+        print(f"payload error: {e}")
+        return
+    keyring = do_keys.keyRing()
+    fnSetupKeyring(keyring, keysFile, secretFile)
+    print(f"payload: {len(writeData.data)} bytes from {'stdin' if path == '-' else path}, put card on the reader")
+    try:
+        while True:
+            try:
+                cardService = CardRequest(timeout=TIME_TO_WAIT_CARD, newcardonly=True).waitforcard()
+            except CardRequestTimeoutException:
+                continue
+            connection = cardService.connection
+            try:
+                connection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)
+                result = do_wr.fnWrite(do_reader.fnOpenSession(connection), writeData, card_data.key(),
+                                       incremental=incremental, verify=verify, keyring=keyring)
+                print(f"write {'done' if result else 'FAILED'}", flush=True)
+                connection.disconnect()
+            except CARD_ERRORS as e:
+                print(f"Connection error {e}")
+            if once:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writeData.close()
+
+
+#watch blocks of the card on the reader (one session per card) and print their changes with a byte diff;
+#rate: samples per second. Until Ctrl+C or the first card is removed if once
+def startWatch(blockNumbers: list[int], rate: float = 20.0, keysFile: str | None = None, secretFile: str | None = None, once: bool = False) -> None:
+    keyring = do_keys.keyRing()
+    fnSetupKeyring(keyring, keysFile, secretFile)
+    print(f"watching {len(blockNumbers)} blocks at {rate:g} Hz, put card on the reader")
+    try:
+        while True:
+            try:
+                cardService = CardRequest(timeout=TIME_TO_WAIT_CARD, newcardonly=True).waitforcard()
+            except CardRequestTimeoutException:
+                continue
+            connection = cardService.connection
+            try:
+                connection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)
+                result = do_wr.opResult(0)
+                for change in do_wr.fnWatch(do_reader.fnOpenSession(connection), None, blockNumbers, rate, keyring=keyring, result=result):
+                    print(do_wr.fnChangeToStr(change), flush=True)
+                print(f"watch stopped: {result.toStr()}", flush=True)
+                connection.disconnect()
+            except CARD_ERRORS as e:
+                print(f"Connection error {e}")
+            if once:
+                break
+    except KeyboardInterrupt:
+        pass
+
+
+###################################################
+if __name__ == "__main__":
+    startObserver()
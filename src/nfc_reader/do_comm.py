@@ -1,9 +1,273 @@
-from smartcard.CardConnection import CardConnection
+import time
+import queue
+import threading
+from enum import Enum
+from collections import namedtuple
+try:
+    from smartcard import scard
+    from smartcard.CardConnection import CardConnection
+except ImportError: #no PC/SC stack (e.g. build machine): recorded/virtual connections still work
+    scard          = None
+    CardConnection = object
+
+import do_stats
+
+#connect/reconnect parameters (same values in pcsc-lite and WinSCard)
+SCARD_SHARE_EXCLUSIVE = getattr(scard, "SCARD_SHARE_EXCLUSIVE", 1)
+SCARD_RESET_CARD      = getattr(scard, "SCARD_RESET_CARD", 1)
+SCARD_UNPOWER_CARD    = getattr(scard, "SCARD_UNPOWER_CARD", 2)
+
+#deadlines (seconds) for a single APDU and for a whole multi-block operation (None = no limit)
+TIMEOUT_APDU      = 2.0
+TIMEOUT_OPERATION = 15.0
+
+#prebuilt APDU headers [CLA, INS, P1, (P2, Lc)], completed by each command with address and data
+APDU_LOAD_KEY = [0xFF, 0x82, 0x00]                #+ [KeySlot, Lc, KeyData...]
+APDU_AUTH     = [0xFF, 0x86, 0x00, 0x00, 0x05]    #+ [Version, KeyStruct, BlockAddr, AuthMode, KeySlot]
+APDU_READ     = [0xFF, 0xB0, 0x00]                #+ [BlockAddr]
+APDU_WRITE    = [0xFF, 0xD6, 0x00]                #+ [BlockAddr, Lc, Data...]
+APDU_GET_DATA = [0xFF, 0xCA]                      #+ [DataType, 0x00, Le]
+APDU_VALUE    = [0xFF, 0xD7, 0x00]                #+ [BlockAddr, 0x05, VB_OP, Value(4 bytes, MSB first)] or [BlockAddr, 0x02, VB_RESTORE, TargetBlock]
+APDU_READ_VALUE = [0xFF, 0xB1, 0x00]              #+ [BlockAddr, 0x04]
+
+#GET DATA types (P1): UID of the card in the field, historical bytes of ATS (ISO 14443-4 cards only)
+GET_DATA_UID = 0x00
+GET_DATA_ATS = 0x01
+
+#MIFARE authentication mode of AUTH: with key A or with key B of the sector
+AUTH_KEY_A = 0x60
+AUTH_KEY_B = 0x61
+
+#Version byte of the AUTH data (PC/SC part 3): always 0x01, the key type is given by AuthMode
+AUTH_VERSION = 0x01
+
+def fnAuthMode(keyTypeAB: str) -> int:
+    return AUTH_KEY_A if keyTypeAB.upper() == 'A' else AUTH_KEY_B
+
+#complete AUTH APDU for the block with the key of the reader slot
+def fnAuthApdu(nBlockThrowCard: int, keyTypeAB: str, nKeySlot: int = 0) -> list[int]:
+    return APDU_AUTH + [AUTH_VERSION, 0x00, nBlockThrowCard, fnAuthMode(keyTypeAB), nKeySlot]
+
+#value block operations (VB_OP of FF D7): increment/decrement are transferred into the same block,
+#restore copies the value of a block into another block of the sector
+VB_STORE     = 0x00
+VB_INCREMENT = 0x01
+VB_DECREMENT = 0x02
+VB_RESTORE   = 0x03
 
 def bytes2str(b) -> str:
     return "[" + " ".join(f"{ch:02X}" for ch in b) + "]"
 
 
+class txResult(Enum):
+    TX_OK            = "ok"
+    TX_AUTH_FAIL     = "authentication failed"
+    TX_ACCESS_DENIED = "access denied"
+    TX_ERROR         = "command failed"
+    TX_CARD_REMOVED  = "card removed"
+    TX_READER_GONE   = "reader gone"
+    TX_TIMEOUT       = "timeout"
+
+    #nothing else can be done with this card/reader, remaining commands are doomed
+    @property
+    def isFatal(self) -> bool:
+        return self in (txResult.TX_CARD_REMOVED, txResult.TX_READER_GONE, txResult.TX_TIMEOUT)
+
+
+class TransmitTimeout(Exception):
+    pass
+
+
+#raised by a connection that cannot stay in step with the card session (e.g. a strict replay
+#diverging from its recording); passed through instead of being classified as a txResult
+class SessionDesync(Exception):
+    pass
+
+
+class TransmitWatchdog:
+    """
+    Runs blocking PC/SC calls in a helper thread and stops waiting at a deadline.
+
+    connection.transmit() has no timeout of its own: a wedged reader or pcscd
+    blocks the calling thread forever. A call that does not return in time is
+    abandoned - its helper thread is left to finish (or hang) on its own and the
+    next call starts a fresh one. Idle helper threads exit after IDLE_TIME.
+    """
+    IDLE_TIME = 5.0
+
+    class pendingCall:
+        def __init__(self, fn, args):
+            self.fn    = fn
+            self.args  = args
+            self.done  = threading.Event()
+            self.isOk  = False
+            self.value = None
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.requests = None  #queue of the current helper thread
+
+    def __worker(self, requests: queue.Queue) -> None:
+        while True:
+            try:
+                job = requests.get(timeout=self.IDLE_TIME)
+            except queue.Empty:
+                with self.lock:
+                    if requests.empty():
+                        if self.requests is requests:
+                            self.requests = None
+                        return
+                continue
+            if job is None: #abandoned by call(), leave
+                return
+            try:
+                job.value = job.fn(*job.args)
+                job.isOk  = True
+            except Exception as e: #any error is raised again by call() in the caller's thread
+                job.value = e
+            job.done.set()
+
+    def call(self, fn, *args, timeout: float):
+        """
+        Call fn(*args) in the helper thread and return its result.
+
+        Raises:
+            TransmitTimeout: fn did not return within timeout seconds.
+            Exception: whatever fn raised.
+        """
+        job = TransmitWatchdog.pendingCall(fn, args)
+        with self.lock:
+            if self.requests is None:
+                self.requests = queue.Queue()
+                threading.Thread(target=self.__worker, args=(self.requests,), daemon=True).start()
+            requests = self.requests
+            requests.put(job)
+        if not job.done.wait(timeout):
+            with self.lock:
+                if self.requests is requests:
+                    self.requests = None
+                requests.put(None)
+            raise TransmitTimeout(f"no answer in {timeout:.3f} s")
+        if not job.isOk:
+            raise job.value
+        return job.value
+
+#shared by plain fnTransmit() calls with a timeout
+transmitWatchdog = TransmitWatchdog()
+
+#one watchdog per calling thread: sessions created one after another (a tap each) reuse its helper thread
+watchdogs = threading.local()
+
+def fnThreadWatchdog() -> TransmitWatchdog:
+    watchdog = getattr(watchdogs, "watchdog", None)
+    if watchdog is None:
+        watchdog = watchdogs.watchdog = TransmitWatchdog()
+    return watchdog
+
+
+#PC/SC error codes (from exception hresult) that mean the card or the reader is not there anymore,
+#with their standard values for use without pyscard (replayed sessions)
+def __scardCodes(**codes) -> set:
+    return {getattr(scard, name, code) & 0xFFFFFFFF for name, code in codes.items()}
+
+scardCardRemoved = __scardCodes(SCARD_W_REMOVED_CARD=0x80100069, SCARD_E_NO_SMARTCARD=0x8010000C,
+                                SCARD_W_UNPOWERED_CARD=0x80100067, SCARD_W_UNRESPONSIVE_CARD=0x80100066,
+                                SCARD_W_RESET_CARD=0x80100068)
+scardReaderGone  = __scardCodes(SCARD_E_READER_UNAVAILABLE=0x80100017, SCARD_E_NO_READERS_AVAILABLE=0x8010002E,
+                                SCARD_E_UNKNOWN_READER=0x80100009, SCARD_E_NO_SERVICE=0x8010001D,
+                                SCARD_E_SERVICE_STOPPED=0x8010001E)
+
+def fnClassifyStatus(ins: int, sw1: int, sw2: int) -> txResult:
+    """
+    Sort status words of a response into txResult classes.
+
+    - 0x9000: success
+    - 0x6300 / 0x6983 / 0x6988 on AUTH (INS 0x86): wrong key, blocked or invalid key slot
+    - 0x6982 / 0x6986: security status not satisfied / command not allowed
+      (sector not authenticated or access bits forbid the operation)
+    - anything else: command failed
+    """
+    if sw1 == 0x90  and  sw2 == 0x00:
+        return txResult.TX_OK
+    if ins == 0x86  and  sw1 in (0x63, 0x69):
+        return txResult.TX_AUTH_FAIL
+    if sw1 == 0x69  and  sw2 in (0x82, 0x86):
+        return txResult.TX_ACCESS_DENIED
+    return txResult.TX_ERROR
+
+
+def fnClassifyException(e: Exception) -> txResult:
+    hresult = getattr(e, "hresult", None)
+    if isinstance(hresult, int):
+        hresult &= 0xFFFFFFFF
+        if hresult in scardCardRemoved:
+            return txResult.TX_CARD_REMOVED
+        if hresult in scardReaderGone:
+            return txResult.TX_READER_GONE
+    #pyscard does not always carry hresult, fall back to exception type and message
+    text = f"{type(e).__name__} {e}".lower()
+    if "nocard" in text  or  "removed" in text  or  "no smart card" in text:
+        return txResult.TX_CARD_REMOVED
+    if "reader" in text  and  ("unavailable" in text  or  "unknown" in text  or  "no readers" in text):
+        return txResult.TX_READER_GONE
+    return txResult.TX_ERROR
+
+
+def fnTransmit(connection, data: list[bytes], timeout: float | None = None, watchdog: TransmitWatchdog | None = None,
+               reader: str | None = None) -> (txResult, list[bytes], int, int):
+    """
+    Send an APDU and classify the outcome instead of reducing it to True/False.
+
+    Args:
+        connection: Active card connection.
+        data: APDU to send.
+        timeout: Seconds to wait for the answer (None = wait forever, no helper thread).
+        watchdog: TransmitWatchdog running the call when timeout is set (default: shared one).
+        reader: Reader name for do_stats (default: asked from connection).
+
+    Returns:
+        tuple: (txResult, response_data, SW1, SW2); SW1/SW2 are -1 if transmit raised
+               or did not answer in time (TX_TIMEOUT).
+    """
+    timeStart = time.perf_counter()
+    try:
+        if timeout is None:
+            response, sw1, sw2 = connection.transmit(data)
+        else:
+            response, sw1, sw2 = (watchdog or transmitWatchdog).call(connection.transmit, data, timeout=timeout)
+    except TransmitTimeout:
+        fnRecordApdu(connection, reader, data, timeStart, "timeout")
+        return txResult.TX_TIMEOUT, None, -1, -1
+    except SessionDesync:
+        raise
+    except Exception as e: #connections of any kind raise their own types, fnClassifyException sorts them
+        fnRecordApdu(connection, reader, data, timeStart, type(e).__name__)
+        return fnClassifyException(e), None, -1, -1
+    fnRecordApdu(connection, reader, data, timeStart, do_stats.outcomeFromStatus(sw1, sw2))
+    result = fnClassifyStatus(data[1] if len(data) > 1 else 0, sw1, sw2)
+    return result, (response if result == txResult.TX_OK else None), sw1, sw2
+
+
+def fnReaderName(connection) -> str:
+    try:
+        return str(connection.getReader())
+    except Exception: #the name is only a label for statistics and logs
+        return "unknown"
+
+
+def fnATR(connection) -> list[bytes]:
+    try:
+        return list(connection.getATR())
+    except Exception: #no ATR from a closed or recorded connection, the card family is unknown then
+        return []
+
+
+#feed do_stats with one command (reader is looked up from connection if not given)
+def fnRecordApdu(connection, reader: str, data: list[bytes], timeStart: float, outcome: str) -> None:
+    if do_stats.stats.enabled:
+        do_stats.stats.recordApdu(reader or fnReaderName(connection), data, time.perf_counter() - timeStart, outcome)
+
+
 def fnDoTransmit(connection, data: list[bytes]) -> (bool, list[bytes]):
     """
     Send an APDU (Application Protocol Data Unit) command to the NFC card.
@@ -36,20 +300,25 @@ def fnDoTransmit(connection, data: list[bytes]) -> (bool, list[bytes]):
         - 0x9000: Success (SW1=0x90, SW2=0x00)
         - Other values indicate various error conditions
     """
+    timeStart = time.perf_counter()
     try:
         # Transmit APDU command to card and receive response
         # response: data bytes returned by the card
         # sw1, sw2: status words indicating command result
         response, sw1, sw2 = connection.transmit(data)
+        fnRecordApdu(connection, None, data, timeStart, do_stats.outcomeFromStatus(sw1, sw2))
         # Check for success status (0x9000 = OK)
         if (sw1 == 0x90) and (sw2 == 0x00):
             return True, response
+    except SessionDesync:
+        raise
     except Exception as e:
+        fnRecordApdu(connection, None, data, timeStart, type(e).__name__)
         print(f"transmit error: {e}")
     return False, None
 
 
-def fnLoadKey(connection: CardConnection, keyData: list[bytes]) -> bool:
+def fnLoadKey(connection: CardConnection, keyData: list[bytes], nKeySlot: int = 0) -> bool:
     """
     Load authentication key into the reader's volatile memory.
     
@@ -60,18 +329,18 @@ def fnLoadKey(connection: CardConnection, keyData: list[bytes]) -> bool:
     - 0xFF: CLA (escape class for PC/SC)
     - 0x82: INS (LOAD KEYS instruction)
     - 0x00: P1 (Key structure - 0x00 = volatile memory)
-    - 0x00: P2 (Key number/slot - 0x00 = first slot)
+    - nKeySlot: P2 (Key number/slot - 0x00 = first slot)
     - Lc: Length of key data (typically 6 bytes for MIFARE)
     - KeyData: The actual key bytes to load
     """
     # APDU: [CLA, INS, P1, P2, Lc, KeyData...]
-    Result, _ = fnDoTransmit(connection, [0xFF, 0x82, 0x00, 0x00, len(keyData)] + list(keyData)) 
+    Result, _ = fnDoTransmit(connection, APDU_LOAD_KEY + [nKeySlot, len(keyData)] + list(keyData)) 
     if not Result:
         print(f"fail to load key: {bytes2str(keyData)}")
     return Result
 
 
-def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: str) -> bool:
+def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: str, nKeySlot: int = 0) -> bool:
     """
     Authenticate to a specific block/sector on the MIFARE card.
     
@@ -79,31 +348,28 @@ def fnSelectBlock(connection: CardConnection, nBlockThrowCard: int, keyTypeAB: s
     access to a sector. After successful authentication, read/write operations
     are allowed for that sector.
     
-    APDU command format: [0xFF, 0x86, 0x00, 0x00, 0x05, KeyType, KeyStruct, BlockAddr, 0x60, 0x00]
+    APDU command format: [0xFF, 0x86, 0x00, 0x00, 0x05, Version, KeyStruct, BlockAddr, AuthMode, KeySlot]
     - 0xFF: CLA (escape class for PC/SC)
     - 0x86: INS (PERFORM SECURITY OPERATION)
     - 0x00: P1 (not used, set to 0)
     - 0x00: P2 (not used, set to 0)
     - 0x05: Lc (length of command data = 5 bytes)
-    - KeyType: 0x00 = Key A, 0x01 = Key B
+    - Version: always 0x01 (AUTH_VERSION); the key type is given by AuthMode
     - KeyStruct: 0x00 = Key stored in volatile memory (from fnLoadKey)
     - BlockAddr: Absolute block number across entire card (0-63 for MIFARE 1K)
-    - 0x60: Authentication mode (MIFARE authentication)
-    - 0x00: Additional parameter (not used)
+    - AuthMode: 0x60 = MIFARE authentication with key A, 0x61 = with key B
+    - KeySlot: Reader key slot the key was loaded into (see fnLoadKey)
     
     Args:
         connection: Active card connection
         nBlockThrowCard: Absolute block number (0-63 for MIFARE 1K)
         keyTypeAB: 'A' or 'B' to specify which key type to use
+        nKeySlot: Volatile reader slot holding the key (default 0)
     
     Returns:
         bool: True if authentication succeeded, False otherwise
     """
-    # Determine key type: 0x00 for Key A, 0x01 for Key B
-    keyID = 0x00 if keyTypeAB.upper() == 'A' else 0x01
-    # APDU: [CLA, INS, P1, P2, Lc, KeyType, KeyStruct, BlockAddr, AuthMode, Param]
-
-    Result, _ = fnDoTransmit(connection, [0xFF, 0x86, 0x00, 0x00, 0x05, keyID, 0x00, nBlockThrowCard, 0x60, 0x00])
+    Result, _ = fnDoTransmit(connection, fnAuthApdu(nBlockThrowCard, keyTypeAB, nKeySlot))
     if not Result:    
         print(f"Authentication failed by key{keyTypeAB} for block:{nBlockThrowCard//4}:{nBlockThrowCard%4}")
     return Result
@@ -133,7 +399,7 @@ def fnWriteBlock(connection: CardConnection, nBlockThrowCard: int, data: list[by
         bool: True if write succeeded, False otherwise
     """
     # APDU: [CLA, INS, P1, BlockAddr, Lc, Data...]
-    Result, _ = fnDoTransmit(connection, [0xFF, 0xD6, 0x00, nBlockThrowCard, len(data)] + data)
+    Result, _ = fnDoTransmit(connection, APDU_WRITE + [nBlockThrowCard, len(data)] + list(data))
     if not Result:
         print(f"fail to write block: {nBlockThrowCard//4}:{nBlockThrowCard%4}")
     return Result
@@ -160,4 +426,513 @@ def fnReadBlock(connection: CardConnection, nBlockThrowCard: int) -> (bool, list
     Returns: tuple: (True, response_data) if read succeeded, (False, None) otherwise
     """
     # APDU: [CLA, INS, P1, BlockAddr, Length]
-    return fnDoTransmit(connection, [0xFF, 0xB0, 0x00, nBlockThrowCard])
+    return fnDoTransmit(connection, APDU_READ + [nBlockThrowCard])
+
+
+def fnGetData(connection: CardConnection, nDataType: int = GET_DATA_UID) -> (bool, list[bytes]):
+    """
+    Ask the reader for data of the card in the field (no key, no authentication).
+
+    The reader answers from what it learned while activating the card, so this
+    is a single fast APDU and does not touch card memory.
+
+    APDU command format: [0xFF, 0xCA, DataType, 0x00, Le]
+    - 0xFF: CLA (escape class for PC/SC)
+    - 0xCA: INS (GET DATA instruction)
+    - DataType: P1, GET_DATA_UID (0x00) or GET_DATA_ATS (0x01, historical bytes of ATS)
+    - 0x00: P2 (not used)
+    - Le: 0x00 = full length (4 or 7 bytes of UID)
+
+    Args:
+        connection: Active card connection
+        nDataType: GET_DATA_UID or GET_DATA_ATS
+
+    Returns: tuple: (True, response_data) if the reader answered 0x9000, (False, None) otherwise
+    """
+    return fnDoTransmit(connection, APDU_GET_DATA + [nDataType, 0x00, 0x00])
+
+
+############################################################################################################
+class CardSession:
+    """
+    Per-connection cache of reader key slots and card authentication state.
+
+    MIFARE Classic stays authenticated to a sector until another sector is
+    authenticated or a command fails, and keys loaded with LOAD KEYS stay in
+    the reader's volatile slots for the whole connection. The session remembers
+    both, so repeated FF 82 / FF 86 commands for the same key and sector are
+    skipped instead of being sent to the reader.
+
+    Every command goes through transmit(), which keeps the txResult class of
+    the last command in lastResult, so callers can tell a wrong key from a
+    removed card and stop early on fatal errors (see txResult.isFatal).
+
+    A MIFARE Classic card answers any failed command (wrong key included) by
+    going to HALT, so every following command fails too. After a non-fatal
+    failure the session re-activates the card with a reader reconnect
+    (SCARD_RESET_CARD) right before the next command, instead of a full
+    disconnect/CardRequest cycle. Count and time spent are kept in
+    reactivations/reactivationTime.
+
+    Each command must answer within apduTimeout, and commands between
+    beginOperation()/endOperation() must finish within operationTimeout.
+    A command that misses its deadline is abandoned (see TransmitWatchdog),
+    the card is reset with a reconnect and TX_TIMEOUT is returned, which is
+    fatal: the caller stops the operation.
+
+    Args:
+        connection: Active CardConnection to wrap.
+        nKeySlots: Number of volatile key slots the reader provides (default 1).
+        autoReactivate: Re-activate the card after a failed command (default True).
+        apduTimeout: Seconds per command, None = no limit (default TIMEOUT_APDU).
+        operationTimeout: Seconds per operation, None = no limit (default TIMEOUT_OPERATION).
+    """
+    def __init__(self, connection: CardConnection, nKeySlots: int = 1, autoReactivate: bool = True,
+                 apduTimeout: float = TIMEOUT_APDU, operationTimeout: float = TIMEOUT_OPERATION):
+        self.connection  = connection
+        self.slots       = [None] * max(1, nKeySlots)  #key bytes currently loaded in each slot
+        self.nextSlot    = 0                           #round-robin slot to replace on a miss
+        self.authSector  = -1                          #sector authenticated now (-1 = none)
+        self.authKeyType = ""                          #'A' or 'B'
+        self.authKey     = None                        #key bytes used for current authentication
+        self.skipped     = 0                           #APDUs saved by the cache
+        self.lastResult  = txResult.TX_OK              #class of the last transmitted command
+        self.autoReactivate   = autoReactivate
+        self.needReactivate   = False                  #card is halted, re-activate before next command
+        self.reactivations    = 0                      #reconnects done
+        self.reactivationTime = 0.0                    #seconds spent in reconnects
+        self.retries          = 0                      #commands repeated by retryPolicy
+        self.apduTimeout      = apduTimeout
+        self.operationTimeout = operationTimeout
+        self.deadline         = None                   #perf_counter() time the current operation must end by
+        self.watchdog         = fnThreadWatchdog()
+        self.readerName       = fnReaderName(connection)
+
+    #start deadline for a multi-command operation (timeout overrides operationTimeout)
+    def beginOperation(self, timeout: float | None = None) -> None:
+        timeout = self.operationTimeout if timeout is None else timeout
+        self.deadline = None if timeout is None else time.perf_counter() + timeout
+
+    def endOperation(self) -> None:
+        self.deadline = None
+
+    #seconds the next command may take: the smaller of APDU and operation deadlines (None = no limit)
+    def commandTimeout(self) -> float:
+        if self.deadline is None:
+            return self.apduTimeout
+        left = max(0.0, self.deadline - time.perf_counter())
+        return left if self.apduTimeout is None else min(left, self.apduTimeout)
+
+    #call a blocking connection method under the command deadline
+    def __call(self, fn, *args, **kwargs):
+        timeout = self.commandTimeout()
+        if timeout is None:
+            return fn(*args, **kwargs)
+        return self.watchdog.call(lambda: fn(*args, **kwargs), timeout=timeout)
+
+    #last command failed because card or reader is gone
+    @property
+    def isFatal(self) -> bool:
+        return self.lastResult.isFatal
+
+    #forget authentication state (after any failed command the card leaves authenticated state)
+    def invalidate(self) -> None:
+        self.authSector  = -1
+        self.authKeyType = ""
+        self.authKey     = None
+
+    #forget everything, including keys loaded into reader slots
+    def reset(self) -> None:
+        self.invalidate()
+        self.slots    = [None] * len(self.slots)
+        self.nextSlot = 0
+        self.needReactivate = False
+
+    def reactivate(self) -> bool:
+        """
+        Re-activate a halted card with a reconnect that resets the card (RF field
+        off/on) but keeps the reader handle and the keys in reader memory.
+
+        Returns:
+            bool: True if the reader accepted the reconnect.
+        """
+        self.needReactivate = False
+        self.invalidate()
+        timeStart = time.perf_counter()
+        try:
+            self.__call(self.connection.reconnect, mode=SCARD_SHARE_EXCLUSIVE, disposition=SCARD_RESET_CARD)
+            Result = True
+        except TransmitTimeout:
+            self.lastResult = txResult.TX_TIMEOUT
+            self.reset()
+            Result = False
+        except SessionDesync:
+            raise
+        except Exception as e: #sorted as for transmit: a removed card ends the session, anything else is retried
+            self.lastResult = fnClassifyException(e)
+            if self.lastResult.isFatal:
+                self.reset()
+            Result = False
+        self.reactivations    += 1
+        self.reactivationTime += time.perf_counter() - timeStart
+        return Result
+
+    #abandon a wedged reader: reset the card with a reconnect, but do not wait for it longer than one command
+    def resetReader(self) -> bool:
+        self.reset()
+        try:
+            self.watchdog.call(lambda: self.connection.reconnect(mode=SCARD_SHARE_EXCLUSIVE, disposition=SCARD_RESET_CARD),
+                               timeout=self.apduTimeout or TIMEOUT_APDU)
+            return True
+        except Exception as e: #the reader is abandoned whatever went wrong
+            print(f"reader reset failed: {e}")
+        return False
+
+    def transmit(self, data: list[bytes]) -> (bool, list[bytes]):
+        if self.needReactivate  and  not self.reactivate()  and  self.lastResult.isFatal:
+            return False, None
+        timeout = self.commandTimeout()
+        if timeout is not None  and  timeout <= 0:
+            self.lastResult = txResult.TX_TIMEOUT #operation deadline passed, do not start another command
+            self.reset()
+            return False, None
+        self.lastResult, response, _, _ = fnTransmit(self.connection, data, timeout, self.watchdog, self.readerName)
+        if self.lastResult != txResult.TX_OK:
+            self.invalidate()
+            if self.lastResult == txResult.TX_TIMEOUT:
+                self.resetReader()
+            elif self.lastResult.isFatal:
+                self.reset()
+            else:
+                #LOAD KEYS and GET DATA are handled by the reader alone, the card is not halted by their failure
+                self.needReactivate = self.autoReactivate  and  data[1] not in (APDU_LOAD_KEY[1], APDU_GET_DATA[1])
+            return False, None
+        return True, response
+
+    def loadKey(self, keyData: list[bytes]) -> int:
+        """
+        Make sure the key is present in a reader slot, loading it only if needed.
+
+        Returns:
+            int: slot number holding the key, -1 if the reader rejected the key.
+        """
+        keyBytes = bytes(keyData)
+        if keyBytes in self.slots:
+            self.skipped += 1
+            return self.slots.index(keyBytes)
+        nSlot = self.nextSlot
+        self.slots[nSlot] = None
+        Result, _ = self.transmit(APDU_LOAD_KEY + [nSlot, len(keyBytes)] + list(keyBytes))
+        if not Result:
+            self.isFatal or print(f"fail to load key: {bytes2str(keyBytes)}")
+            return -1
+        self.slots[nSlot] = keyBytes
+        self.nextSlot     = (nSlot + 1) % len(self.slots)
+        return nSlot
+
+    def selectBlock(self, nBlockThrowCard: int, keyTypeAB: str, nKeySlot: int = 0) -> bool:
+        """
+        Authenticate to the sector of the block unless it is already authenticated
+        with the same key type and key.
+        """
+        nSector   = nBlockThrowCard // 4
+        keyTypeAB = keyTypeAB.upper()
+        keyBytes  = self.slots[nKeySlot]
+        if (keyBytes is not None  and  self.authSector == nSector  and
+                self.authKeyType == keyTypeAB  and  self.authKey == keyBytes):
+            self.skipped += 1
+            return True
+        self.invalidate()
+        Result, _ = self.transmit(fnAuthApdu(nBlockThrowCard, keyTypeAB, nKeySlot))
+        if not Result:
+            self.isFatal or print(f"Authentication failed by key{keyTypeAB} for block:{nBlockThrowCard//4}:{nBlockThrowCard%4}")
+            return False
+        self.authSector  = nSector
+        self.authKeyType = keyTypeAB
+        self.authKey     = keyBytes
+        return True
+
+    #load key (if needed) and authenticate (if needed) in one call
+    def authenticate(self, nBlockThrowCard: int, keyTypeAB: str, keyData: list[bytes]) -> bool:
+        nSlot = self.loadKey(keyData)
+        return nSlot >= 0  and  self.selectBlock(nBlockThrowCard, keyTypeAB, nSlot)
+
+    def readBlock(self, nBlockThrowCard: int) -> (bool, list[bytes]):
+        return self.transmit(APDU_READ + [nBlockThrowCard])
+
+    def getData(self, nDataType: int = GET_DATA_UID) -> (bool, list[bytes]):
+        return self.transmit(APDU_GET_DATA + [nDataType, 0x00, 0x00])
+
+    def writeBlock(self, nBlockThrowCard: int, data: list[bytes]) -> bool:
+        Result, _ = self.transmit(APDU_WRITE + [nBlockThrowCard, len(data)] + list(data))
+        if not Result:
+            self.isFatal or print(f"fail to write block: {nBlockThrowCard//4}:{nBlockThrowCard%4}")
+        return Result
+
+    #store/increment/decrement (VB_STORE...) the value block by amount in one command: the card applies
+    #the operation and transfers the result, so the block is never left half written
+    def valueOperation(self, nBlockThrowCard: int, nOperation: int, amount: int) -> bool:
+        Result, _ = self.transmit(APDU_VALUE + [nBlockThrowCard, 0x05, nOperation] + list(amount.to_bytes(4, "big", signed=True)))
+        if not Result:
+            self.isFatal or print(f"fail value operation {nOperation} on block: {nBlockThrowCard//4}:{nBlockThrowCard%4}")
+        return Result
+
+    #copy value of a block into another block of the same sector (restore + transfer)
+    def restoreValue(self, nSourceBlock: int, nTargetBlock: int) -> bool:
+        Result, _ = self.transmit(APDU_VALUE + [nSourceBlock, 0x02, VB_RESTORE, nTargetBlock])
+        return Result
+
+    def readValue(self, nBlockThrowCard: int) -> (bool, int):
+        Result, response = self.transmit(APDU_READ_VALUE + [nBlockThrowCard, 0x04])
+        if not Result  or  len(response) < 4:
+            return False, None
+        return True, int.from_bytes(bytes(response[:4]), "big", signed=True)
+
+
+#wrap connection into session (or return session as is, so state is shared between calls)
+def fnGetSession(connection) -> CardSession:
+    return connection if isinstance(connection, CardSession) else CardSession(connection)
+
+
+class retryPolicy:
+    """
+    Repeats a card command that failed with TX_ERROR (a card at the edge of the
+    field drops single commands), waiting between attempts.
+
+    The wait grows exponentially with the attempt number and with the failure
+    rate seen recently (exponential moving average over all attempts), so a
+    card that fails often is given more time to settle instead of being
+    hammered, while a good card is retried almost at once. Wrong key, access
+    denied and fatal results are never retried, and no wait is started that
+    would not fit into the operation deadline of the session.
+
+    One policy can be shared by many operations: the failure rate is meant to
+    be learned across taps.
+
+    Args:
+        maxRetries: Extra attempts per command (0 = no retries).
+        baseDelay: Seconds before the first retry with zero failure rate.
+        maxDelay: Upper limit of a single wait.
+        smoothing: Weight of the newest attempt in the failure rate (0..1).
+    """
+    def __init__(self, maxRetries: int = 2, baseDelay: float = 0.005, maxDelay: float = 0.2, smoothing: float = 0.1):
+        self.maxRetries = maxRetries
+        self.baseDelay  = baseDelay
+        self.maxDelay   = maxDelay
+        self.smoothing  = smoothing
+        self.failRate   = 0.0
+
+    def record(self, isOk: bool) -> None:
+        self.failRate += self.smoothing * ((0.0 if isOk else 1.0) - self.failRate)
+
+    #seconds to wait before retry number nAttempt (0 = first retry)
+    def delay(self, nAttempt: int) -> float:
+        return min(self.maxDelay, self.baseDelay * (2 ** nAttempt) * (1.0 + 4.0 * self.failRate))
+
+    def call(self, session: CardSession, attempt: callable) -> (bool, list[bytes]):
+        """
+        Run attempt() (returning (bool, data) like CardSession.readBlock) until it
+        succeeds, fails with a non-retryable result or retries are used up.
+        attempt() must re-authenticate by itself: the failed command halted the card.
+        """
+        Result = attempt()
+        self.record(Result[0])
+        nAttempt = 0
+        while not Result[0]  and  session.lastResult == txResult.TX_ERROR  and  nAttempt < self.maxRetries:
+            wait = self.delay(nAttempt)
+            left = session.commandTimeout()
+            if left is not None  and  wait >= left:
+                break
+            time.sleep(wait)
+            nAttempt += 1
+            session.retries += 1
+            Result = attempt()
+            self.record(Result[0])
+        return Result
+
+
+############################################################################################################
+#one prebuilt command of a script: name is "LOAD KEY", "AUTH", "READ" or "WRITE"
+apduStep   = namedtuple("apduStep",   ["name", "nBlock", "apdu"])
+#outcome of one step; sw1/sw2 are -1 and error holds the exception if transmit raised.
+#A card re-activation after a failed card command is recorded as step "REACTIVATE" (not in the script)
+stepResult = namedtuple("stepResult", ["name", "nBlock", "isOk", "result", "sw1", "sw2", "data", "error"])
+
+class ApduScript:
+    """
+    Sequence of APDU commands built once and executed with fnRunScript().
+
+    All APDUs are assembled when the step is added, so a script describing
+    a full dump or a provisioning image can be built once and replayed on
+    any number of cards without rebuilding commands per card.
+
+    Example:
+        script = ApduScript().loadKey(keyData).authenticate(4, 'B').readBlocks(4, 4)
+    """
+    def __init__(self):
+        self.steps = []
+
+    def loadKey(self, keyData: list[bytes], nKeySlot: int = 0) -> "ApduScript":
+        self.steps.append(apduStep("LOAD KEY", -1, APDU_LOAD_KEY + [nKeySlot, len(keyData)] + list(keyData)))
+        return self
+
+    def authenticate(self, nBlockThrowCard: int, keyTypeAB: str, nKeySlot: int = 0) -> "ApduScript":
+        self.steps.append(apduStep("AUTH", nBlockThrowCard, fnAuthApdu(nBlockThrowCard, keyTypeAB, nKeySlot)))
+        return self
+
+    def readBlocks(self, nBlockFirst: int, count: int = 1) -> "ApduScript":
+        for nBlock in range(nBlockFirst, nBlockFirst + count):
+            self.steps.append(apduStep("READ", nBlock, APDU_READ + [nBlock]))
+        return self
+
+    #data is split into 16 bytes blocks written to consecutive block numbers
+    def writeBlocks(self, nBlockFirst: int, data: list[bytes], nBlockSize: int = 16) -> "ApduScript":
+        for i in range(0, len(data), nBlockSize):
+            nBlock = nBlockFirst + i // nBlockSize
+            chunk  = list(data[i:i + nBlockSize])
+            self.steps.append(apduStep("WRITE", nBlock, APDU_WRITE + [nBlock, len(chunk)] + chunk))
+        return self
+
+
+class ScriptResult:
+    def __init__(self, nTotal: int):
+        self.steps      = []      #stepResult for every executed step
+        self.nTotal     = nTotal  #steps in script
+        self.failedStep = -1      #index of the first failed step (-1 = none)
+
+    @property
+    def isOk(self) -> bool:
+        return self.failedStep < 0  and  len(self.steps) == self.nTotal
+
+    #class of the step that aborted the script (TX_OK if the script was not aborted by card/reader loss)
+    @property
+    def stopReason(self) -> txResult:
+        if len(self.steps) != 0  and  self.steps[-1].result.isFatal:
+            return self.steps[-1].result
+        return txResult.TX_OK
+
+    def __bool__(self) -> bool:
+        return self.isOk
+
+
+def fnRunScript(connection, script: ApduScript, stopOnFail: bool = False, apduTimeout: float | None = None,
+                timeout: float | None = None, reactivate: bool = False) -> ScriptResult:
+    """
+    Execute all steps of the script in one tight loop.
+
+    Nothing is printed per step: status words, response data and exceptions
+    are collected into the returned ScriptResult.
+
+    Args:
+        connection: Active card connection or CardSession. A session's key and
+                    authentication cache is reset, since the script changes both.
+        script: Prebuilt commands to send.
+        stopOnFail: Stop at the first step that did not return 0x9000.
+                    Execution always stops when the card or reader is gone.
+        apduTimeout: Seconds per step (None = no limit).
+        timeout: Seconds for the whole script (None = no limit). With either
+                 deadline set, steps run through a TransmitWatchdog and a missed
+                 deadline stops the script with TX_TIMEOUT.
+        reactivate: After a failed card command (any step but LOAD KEY: the card
+                    halts), re-activate the card (keys stay in the reader) and
+                    record a "REACTIVATE" step. After a failed AUTH the steps up to
+                    the next AUTH or LOAD KEY are skipped; they are not in steps.
+                    After a failed READ or WRITE the last AUTH is sent again (it is
+                    in steps a second time) and the script goes on with the next step.
+
+    Returns:
+        ScriptResult: per-step results, index of the first failure.
+    """
+    if isinstance(connection, CardSession):
+        connection.reset()
+        connection = connection.connection
+    result   = ScriptResult(len(script.steps))
+    append   = result.steps.append
+    transmit = connection.transmit
+    reader   = fnReaderName(connection)
+    record   = do_stats.stats.recordApdu if do_stats.stats.enabled else None
+    clock    = time.perf_counter
+    watchdog = None
+    if apduTimeout is not None  or  timeout is not None:
+        watchdog = fnThreadWatchdog()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+    steps     = script.steps
+    skipping  = False
+    nAuthStep = -1  #last AUTH step, sent again after a failed READ/WRITE re-activated the card
+    redoStep  = -1  #step to send before the next one of the script
+    i = 0
+    while i < len(steps):
+        if redoStep >= 0:
+            nStep, redoStep = redoStep, -1
+        else:
+            nStep, i = i, i + 1
+        name, nBlock, apdu = steps[nStep]
+        if skipping:
+            if name not in ("AUTH", "LOAD KEY"):
+                continue
+            skipping = False
+        if name == "AUTH":
+            nAuthStep = nStep
+        timeStart = clock()
+        try:
+            if watchdog is None:
+                data, sw1, sw2 = transmit(apdu)
+            else:
+                stepTimeout = apduTimeout
+                if deadline is not None:
+                    left = max(0.0, deadline - time.perf_counter())
+                    stepTimeout = left if stepTimeout is None else min(stepTimeout, left)
+                data, sw1, sw2 = watchdog.call(transmit, apdu, timeout=stepTimeout)
+            record and record(reader, apdu, clock() - timeStart, do_stats.outcomeFromStatus(sw1, sw2))
+            if sw1 == 0x90  and  sw2 == 0x00:
+                append(stepResult(name, nBlock, True, txResult.TX_OK, sw1, sw2, data, None))
+                continue
+            stepClass = fnClassifyStatus(apdu[1], sw1, sw2)
+            append(stepResult(name, nBlock, False, stepClass, sw1, sw2, None, None))
+        except TransmitTimeout as e:
+            record and record(reader, apdu, clock() - timeStart, "timeout")
+            stepClass = txResult.TX_TIMEOUT
+            append(stepResult(name, nBlock, False, stepClass, -1, -1, None, e))
+        except SessionDesync:
+            raise
+        except Exception as e: #the step fails whatever the connection raised, fnClassifyException decides if the loop goes on
+            record and record(reader, apdu, clock() - timeStart, type(e).__name__)
+            stepClass = fnClassifyException(e)
+            append(stepResult(name, nBlock, False, stepClass, -1, -1, None, e))
+        if result.failedStep < 0:
+            result.failedStep = nStep
+        if stopOnFail  or  stepClass.isFatal:
+            break
+        if reactivate  and  name != "LOAD KEY": #LOAD KEYS stays inside the reader, any other failure halts the card
+            stepTimeout = None
+            if watchdog is not None:
+                stepTimeout = apduTimeout
+                if deadline is not None:
+                    left = max(0.0, deadline - time.perf_counter())
+                    stepTimeout = left if stepTimeout is None else min(stepTimeout, left)
+            stepClass = fnReactivateScript(connection, watchdog, stepTimeout)
+            append(stepResult("REACTIVATE", nBlock, stepClass == txResult.TX_OK, stepClass, -1, -1, None, None))
+            if stepClass.isFatal:
+                break
+            if name == "AUTH"  or  nAuthStep < 0:
+                skipping = True
+            else:
+                redoStep = nAuthStep
+    return result
+
+
+#reset the halted card for fnRunScript (reconnect keeps the keys loaded into the reader)
+def fnReactivateScript(connection, watchdog: TransmitWatchdog, timeout: float) -> txResult:
+    reconnect = lambda: connection.reconnect(mode=SCARD_SHARE_EXCLUSIVE, disposition=SCARD_RESET_CARD)
+    try:
+        if watchdog is None:
+            reconnect()
+        else:
+            watchdog.call(reconnect, timeout=timeout)
+    except TransmitTimeout:
+        return txResult.TX_TIMEOUT
+    except SessionDesync:
+        raise
+    except Exception as e: #reconnect errors are classified like transmit errors
+        return fnClassifyException(e)
+    return txResult.TX_OK
@@ -0,0 +1,435 @@
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+import card_data
+import do_stats
+
+#access conditions of the MIFARE Classic datasheet (bitAccessMap gives the same as text)
+from card_data import A, B, accessConditions, dataBlockRights, keyBReadable, trailerRights
+
+#ATR a PC/SC reader reports for MIFARE Classic 1K (PC/SC part 3 storage card ATR)
+MIFARE_1K_ATR = [0x3B, 0x8F, 0x80, 0x01, 0x80, 0x4F, 0x0C, 0xA0, 0x00, 0x00, 0x03, 0x06, 0x03, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x6A]
+#transport configuration trailer: key A, access bits FF 07 80 (trailer 001, data 000), GPB 69, key B
+MIFARE_1K_transport_access = [0xFF, 0x07, 0x80]
+MIFARE_1K_transport_GPB    = 0x69
+
+#status words of the virtual reader (same as ACR122-type readers)
+SW_OK          = (0x90, 0x00)
+SW_FAIL        = (0x63, 0x00)   #authentication failed, card halted, wrong length
+SW_DENIED      = (0x69, 0x82)   #not authenticated / access bits forbid the operation
+SW_BAD_ADDRESS = (0x6A, 0x82)   #block out of range
+SW_BAD_SLOT    = (0x69, 0x88)   #key slot out of range or empty
+SW_BAD_INS     = (0x6D, 0x00)   #instruction not supported
+SW_BAD_P1P2    = (0x6A, 0x81)   #function not supported (GET DATA of ATS on ISO 14443-3 card)
+
+#PC/SC code used when there is no card in the virtual reader
+SCARD_W_REMOVED_CARD = 0x80100069
+#connect mode to talk to the reader only (no card needed)
+SCARD_SHARE_DIRECT   = 3
+
+
+class VirtualCardError(Exception):
+    def __init__(self, message: str, hresult: int = SCARD_W_REMOVED_CARD):
+        super().__init__(message)
+        self.hresult = hresult
+
+
+############################################################################################################
+class VirtualMifare1k:
+    """
+    Memory of an emulated MIFARE Classic 1K card: 64 blocks of 16 bytes,
+    block 0 holds UID/BCC/SAK/ATQA (a 7 byte UID has no BCC), block 3 of every sector is the trailer
+    (key A, access bits, GPB, key B). Starts in transport configuration.
+    """
+    def __init__(self, uid: list[bytes] | None = None, key: list[bytes] = card_data.MIFARE_1K_default_key):
+        self.uid    = bytes(uid) if uid is not None else os.urandom(4)
+        self.atr    = list(MIFARE_1K_ATR)
+        self.blocks = [bytearray(card_data.MIFARE_1K_bytes_per_block)
+                       for _ in range(card_data.MIFARE_1K_total_sectors * card_data.MIFARE_1K_blocks_per_sector)]
+        if len(self.uid) == 7:
+            self.blocks[0][0:10]  = self.uid + bytes([0x08, 0x44, 0x00])       #double size UID (no BCC), SAK, ATQA
+            self.blocks[0][10:16] = b"VIRT7B"                                  #manufacturer data
+        else:
+            bcc = self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]
+            self.blocks[0][0:8]  = self.uid + bytes([bcc, 0x08, 0x04, 0x00])   #UID, BCC, SAK, ATQA
+            self.blocks[0][8:16] = b"VIRTCARD"                                 #manufacturer data
+        for iSector in range(card_data.MIFARE_1K_total_sectors):
+            self.setTrailer(iSector, key, MIFARE_1K_transport_access, key)
+
+    def setTrailer(self, nSector: int, keyA: list[bytes], accessBits: list[bytes], keyB: list[bytes], GPB: int = MIFARE_1K_transport_GPB) -> None:
+        self.blocks[self.trailerBlock(nSector)][:] = bytes(keyA) + bytes(accessBits) + bytes([GPB]) + bytes(keyB)
+
+    @staticmethod
+    def trailerBlock(nSector: int) -> int:
+        return nSector * card_data.MIFARE_1K_blocks_per_sector + card_data.MIFARE_1K_blocks_per_sector - 1
+
+    def trailer(self, nSector: int) -> bytearray:
+        return self.blocks[self.trailerBlock(nSector)]
+
+
+#handle passed to CardObserver.update() (same attributes as smartcard.Card)
+class VirtualCardHandle:
+    def __init__(self, reader: "VirtualReader", card: VirtualMifare1k):
+        self.reader = reader.name
+        self.atr    = list(card.atr)
+        self.__reader = reader
+
+    def createConnection(self) -> "VirtualConnection":
+        return self.__reader.createConnection()
+
+
+class latencyModel:
+    """
+    Time the virtual reader spends on each command: mean seconds per instruction
+    byte plus uniform jitter (part of mean). Defaults are do_stats.TYPICAL_LATENCY.
+    """
+    DEFAULT_DELAYS = do_stats.TYPICAL_LATENCY
+
+    def __init__(self, delays: dict | None = None, jitter: float = 0.1, scale: float = 1.0, seed: int | None = None):
+        self.delays = dict(self.DEFAULT_DELAYS if delays is None else delays)
+        self.jitter = jitter
+        self.scale  = scale
+        self.random = random.Random(seed)
+
+    def delay(self, ins: int) -> float:
+        mean = self.delays.get(ins, 0.0) * self.scale
+        return mean * (1.0 + self.random.uniform(-self.jitter, self.jitter)) if mean > 0 else 0.0
+
+#no simulated delays: as fast as the host code runs
+NO_LATENCY = latencyModel(delays={})
+
+
+############################################################################################################
+class VirtualReader:
+    """
+    Emulated PC/SC reader holding at most one VirtualMifare1k card.
+
+    Implements the pseudo-APDUs used by do_comm (FF 82 LOAD KEYS, FF 86 AUTHENTICATE,
+    FF B0 READ BINARY, FF D6 UPDATE BINARY, FF CA GET DATA, FF D7 value block
+    operation, FF B1 read value block), enforcing keys and access bits of
+    the card like real MIFARE Classic: a failed command halts the card until it
+    is re-activated (reconnect with reset). Works as a CardMonitor for
+    CardObserver objects (insert()/remove() notify them) and provides a
+    CardRequest-like factory, so CardProcessor can run on it.
+
+    Args:
+        name: Reader name reported by connections.
+        nKeySlots: Volatile key slots of the reader.
+        latency: latencyModel for command timing (default: no delays).
+        dropRate: Part (0..1) of card commands lost like by a card at the edge
+                  of the field: answered with 63 00 and the card is halted.
+        seed: Seed of the drop generator.
+    """
+    def __init__(self, name: str = "Virtual MIFARE Reader 00 00", nKeySlots: int = 2, latency: latencyModel = NO_LATENCY,
+                 dropRate: float = 0.0, seed: int | None = None):
+        self.name      = name
+        self.latency   = latency
+        self.dropRate  = dropRate
+        self.random    = random.Random(seed)
+        self.lock      = threading.RLock()
+        self.inserted  = threading.Condition(self.lock)
+        self.card      = None
+        self.slots     = [None] * nKeySlots
+        self.observers = []
+        self.commands  = 0  #APDUs handled, for load tests
+        self.controls  = [] #(control code, command) of escape commands received
+        self.__resetCardState()
+
+    def __resetCardState(self) -> None:
+        self.authSector  = -1
+        self.authKeyType = ""
+        self.halted      = False
+
+    #=== card presence and CardMonitor interface ===========================================================
+    def insert(self, card: VirtualMifare1k) -> None:
+        with self.lock:
+            if self.card is not None:
+                self.remove()
+            self.card = card
+            self.__resetCardState()
+            self.inserted.notify_all()
+            observers = list(self.observers)
+        for observer in observers:
+            observer.update(self, ([VirtualCardHandle(self, card)], []))
+
+    def remove(self) -> None:
+        with self.lock:
+            card, self.card = self.card, None
+            self.__resetCardState()
+            observers = list(self.observers)
+        if card is not None:
+            for observer in observers:
+                observer.update(self, ([], [VirtualCardHandle(self, card)]))
+
+    #tap: card stays in the field for dwell seconds (blocks the calling thread)
+    def tap(self, card: VirtualMifare1k, dwell: float) -> None:
+        self.insert(card)
+        time.sleep(dwell)
+        self.remove()
+
+    def addObserver(self, observer) -> None:
+        with self.lock:
+            self.observers.append(observer)
+            card = self.card
+        if card is not None: #like CardMonitor: new observer learns about card already present
+            observer.update(self, ([VirtualCardHandle(self, card)], []))
+
+    def deleteObserver(self, observer) -> None:
+        with self.lock:
+            if observer in self.observers:
+                self.observers.remove(observer)
+
+    #=== CardRequest interface: CardRequest(timeout=...).waitforcard().connection ==========================
+    def CardRequest(self, timeout: float | None = None, **kwargs) -> "VirtualReader.cardRequest":
+        return VirtualReader.cardRequest(self, timeout)
+
+    class cardRequest:
+        def __init__(self, reader: "VirtualReader", timeout: float):
+            self.reader  = reader
+            self.timeout = timeout
+
+        def waitforcard(self) -> "VirtualReader.cardRequest":
+            with self.reader.lock:
+                if not self.reader.inserted.wait_for(lambda: self.reader.card is not None, self.timeout):
+                    raise VirtualCardError("card request timeout")
+            self.connection = self.reader.createConnection()
+            return self
+
+    def createConnection(self) -> "VirtualConnection":
+        return VirtualConnection(self)
+
+    def __str__(self) -> str:
+        return self.name
+
+    #=== APDU processing ===================================================================================
+    def transmit(self, apdu: list[bytes]) -> (list[bytes], int, int):
+        delay = self.latency.delay(apdu[1] if len(apdu) > 1 else 0)
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            if self.card is None:
+                raise VirtualCardError("Card was removed")
+            self.commands += 1
+            data, (sw1, sw2) = self.__execute(list(apdu))
+            #MIFARE Classic goes to HALT after any failed card command (LOAD KEYS and GET DATA stay inside the reader)
+            if (sw1, sw2) != SW_OK  and  apdu[1] not in (0x82, 0xCA):
+                self.halted = True
+                self.authSector = -1
+            return data, sw1, sw2
+
+    def __execute(self, apdu: list[bytes]) -> (list[bytes], tuple):
+        if len(apdu) < 4  or  apdu[0] != 0xFF:
+            return [], SW_BAD_INS
+        ins, p1, p2 = apdu[1], apdu[2], apdu[3]
+        if self.dropRate > 0  and  ins in (0x86, 0xB0, 0xD6, 0xB1, 0xD7)  and  self.random.random() < self.dropRate:
+            return [], SW_FAIL
+        match ins:
+            case 0x82:
+                return [], self.__loadKey(p2, apdu[5:])
+            case 0x86:
+                return [], self.__authenticate(apdu[5:])
+            case 0xB0:
+                return self.__read(p2)
+            case 0xD6:
+                return [], self.__write(p2, apdu[5:])
+            case 0xCA:
+                return (list(self.card.uid), SW_OK) if p1 == 0x00 else ([], SW_BAD_P1P2)
+            case 0xB1:
+                return self.__readValue(p2)
+            case 0xD7:
+                return [], self.__valueOperation(p2, apdu[5:])
+        return [], SW_BAD_INS
+
+    def __loadKey(self, nSlot: int, keyData: list[bytes]) -> tuple:
+        if nSlot >= len(self.slots):
+            return SW_BAD_SLOT
+        if len(keyData) != card_data.MIFARE_1K_bytes_per_key:
+            return SW_FAIL
+        self.slots[nSlot] = bytes(keyData)
+        return SW_OK
+
+    #data: [Version 0x01, 0x00, Block, KeyType 0x60 (A) / 0x61 (B), KeySlot]
+    def __authenticate(self, data: list[bytes]) -> tuple:
+        if len(data) != 5  or  data[0] != 0x01:
+            return SW_FAIL
+        nBlock, keyType, nSlot = data[2], data[3], data[4]
+        if self.halted  or  nBlock >= len(self.card.blocks):
+            return SW_FAIL
+        if nSlot >= len(self.slots)  or  self.slots[nSlot] is None:
+            return SW_BAD_SLOT
+        trailer = self.card.trailer(nBlock // card_data.MIFARE_1K_blocks_per_sector)
+        cardKey = trailer[0:6] if keyType == 0x60 else trailer[10:16]
+        if keyType not in (0x60, 0x61)  or  bytes(cardKey) != self.slots[nSlot]:
+            return SW_FAIL
+        self.authSector  = nBlock // card_data.MIFARE_1K_blocks_per_sector
+        self.authKeyType = A if keyType == 0x60 else B
+        return SW_OK
+
+    #key type used for authentication is in the allowed set, and key B may authenticate (is not readable)
+    def __allowed(self, rights: str, conditions: list[int]) -> bool:
+        if self.authKeyType == B  and  conditions[3] in keyBReadable:
+            return False
+        return self.authKeyType in rights
+
+    #sector of the block is authenticated and has valid access bits: return access conditions
+    def __sectorConditions(self, nBlock: int) -> list[int]:
+        if self.halted  or  self.authSector != nBlock // card_data.MIFARE_1K_blocks_per_sector:
+            return None
+        return accessConditions(self.card.trailer(self.authSector)[6:9])
+
+    def __read(self, nBlock: int) -> (list[bytes], tuple):
+        if nBlock >= len(self.card.blocks):
+            return [], SW_BAD_ADDRESS
+        conditions = self.__sectorConditions(nBlock)
+        if conditions is None:
+            return [], SW_DENIED
+        nInSector = nBlock % card_data.MIFARE_1K_blocks_per_sector
+        block = self.card.blocks[nBlock]
+        if nInSector == card_data.MIFARE_1K_blocks_per_sector - 1:
+            _, readAccess, _, readKeyB, _ = trailerRights[conditions[3]]
+            if not self.__allowed(readAccess, conditions):
+                return [], SW_DENIED
+            keyB = list(block[10:16]) if self.__allowed(readKeyB, conditions) else [0x00] * 6
+            return [0x00] * 6 + list(block[6:10]) + keyB, SW_OK #key A is never readable
+        if not self.__allowed(dataBlockRights[conditions[nInSector]][0], conditions):
+            return [], SW_DENIED
+        return list(block), SW_OK
+
+    def __write(self, nBlock: int, data: list[bytes]) -> tuple:
+        if nBlock >= len(self.card.blocks):
+            return SW_BAD_ADDRESS
+        if len(data) != card_data.MIFARE_1K_bytes_per_block:
+            return SW_FAIL
+        conditions = self.__sectorConditions(nBlock)
+        if conditions is None  or  nBlock == 0: #manufacturer block is read only
+            return SW_DENIED
+        nInSector = nBlock % card_data.MIFARE_1K_blocks_per_sector
+        block = self.card.blocks[nBlock]
+        if nInSector != card_data.MIFARE_1K_blocks_per_sector - 1:
+            if not self.__allowed(dataBlockRights[conditions[nInSector]][1], conditions):
+                return SW_DENIED
+            block[:] = bytes(data)
+            return SW_OK
+        #trailer: every part that changes must be writable (GPB goes with access bits)
+        writeKeyA, _, writeAccess, _, writeKeyB = trailerRights[conditions[3]]
+        for rights, part in ((writeKeyA, slice(0, 6)), (writeAccess, slice(6, 10)), (writeKeyB, slice(10, 16))):
+            if bytes(data[part]) != bytes(block[part])  and  not self.__allowed(rights, conditions):
+                return SW_DENIED
+        block[:] = bytes(data)
+        return SW_OK
+
+    #conditions of a data block (not trailer, not block 0) of the authenticated sector, if key type has the right
+    def __valueRights(self, nBlock: int, nRight: int) -> list[int]:
+        if nBlock >= len(self.card.blocks)  or  nBlock == 0:
+            return None
+        conditions = self.__sectorConditions(nBlock)
+        nInSector  = nBlock % card_data.MIFARE_1K_blocks_per_sector
+        if conditions is None  or  nInSector == card_data.MIFARE_1K_blocks_per_sector - 1:
+            return None
+        return conditions if self.__allowed(dataBlockRights[conditions[nInSector]][nRight], conditions) else None
+
+    def __readValue(self, nBlock: int) -> (list[bytes], tuple):
+        if self.__valueRights(nBlock, 0) is None:
+            return [], SW_DENIED
+        decoded = card_data.decodeValue(self.card.blocks[nBlock])
+        if decoded is None:
+            return [], SW_FAIL
+        return list((decoded[0] & 0xFFFFFFFF).to_bytes(4, "big")), SW_OK
+
+    #FF D7: store (write right), increment (increment right), decrement and restore (decrement/transfer/restore right);
+    #the result is transferred into the block (restore: into target block, which needs the same right)
+    def __valueOperation(self, nBlock: int, data: list[bytes]) -> tuple:
+        if len(data) < 2:
+            return SW_FAIL
+        nOperation = data[0]
+        if nOperation == 0x03:
+            if len(data) != 2  or  self.__valueRights(nBlock, 3) is None  or  self.__valueRights(data[1], 3) is None:
+                return SW_DENIED
+            if card_data.decodeValue(self.card.blocks[nBlock]) is None:
+                return SW_FAIL
+            self.card.blocks[data[1]][:] = self.card.blocks[nBlock]
+            return SW_OK
+        if len(data) != 5  or  nOperation not in (0x00, 0x01, 0x02):
+            return SW_FAIL
+        if self.__valueRights(nBlock, (1, 2, 3)[nOperation]) is None:
+            return SW_DENIED
+        amount = int.from_bytes(bytes(data[1:5]), "big", signed=True)
+        if nOperation == 0x00:
+            self.card.blocks[nBlock][:] = card_data.encodeValue(amount, nBlock)
+            return SW_OK
+        decoded = card_data.decodeValue(self.card.blocks[nBlock])
+        if decoded is None:
+            return SW_FAIL
+        value = decoded[0] + amount if nOperation == 0x01 else decoded[0] - amount
+        value = (value + 0x80000000) % 0x100000000 - 0x80000000 #32-bit arithmetic of the card
+        self.card.blocks[nBlock][:] = card_data.encodeValue(value, decoded[1])
+        return SW_OK
+
+    #card is re-activated (RF reset): halt and authentication are cleared, reader key slots stay
+    def reactivate(self) -> None:
+        with self.lock:
+            if self.card is None:
+                raise VirtualCardError("Card was removed")
+            self.__resetCardState()
+
+
+class VirtualConnection:
+    """CardConnection-like connection to a VirtualReader."""
+    def __init__(self, reader: VirtualReader):
+        self.reader    = reader
+        self.connected = False
+
+    def connect(self, *args, **kwargs) -> None:
+        if kwargs.get("mode") != SCARD_SHARE_DIRECT:
+            self.reader.reactivate()
+        self.connected = True
+
+    def reconnect(self, *args, **kwargs) -> None:
+        self.reader.reactivate()
+
+    def disconnect(self) -> None:
+        self.connected = False
+
+    def getReader(self) -> str:
+        return self.reader.name
+
+    def getATR(self) -> list[int]:
+        with self.reader.lock:
+            if self.reader.card is None:
+                raise VirtualCardError("Card was removed")
+            return list(self.reader.card.atr)
+
+    def transmit(self, command: list[bytes], *args, **kwargs) -> (list[bytes], int, int):
+        return self.reader.transmit(command)
+
+    #escape commands are accepted and recorded (answer 90 00 like ACS readers)
+    def control(self, controlCode: int, command: list[bytes] | None = None) -> list[bytes]:
+        with self.reader.lock:
+            self.reader.controls.append((controlCode, list(command or [])))
+        return [0x90, 0x00]
+
+
+###################################################
+#load test: python do_emul.py [taps] [latency scale]  - full fnRead dump per simulated tap
+if __name__ == "__main__":
+    import do_wr
+    nTaps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    reader = VirtualReader(latency=latencyModel(scale=scale) if scale > 0 else NO_LATENCY)
+    nOk = 0
+    timeStart = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): #fnRead prints per tap
+        for _ in range(nTaps):
+            reader.insert(VirtualMifare1k())
+            connection = reader.createConnection()
+            connection.connect()
+            nOk += bool(do_wr.fnRead(connection, card_data.dumpMifare_1k(), card_data.key()))
+            connection.disconnect()
+            reader.remove()
+    elapsed = time.perf_counter() - timeStart
+    print(f"{nOk}/{nTaps} taps ok, {elapsed:.2f} s, {nTaps / elapsed:.1f} taps/s, {reader.commands / elapsed:.0f} APDU/s")
+    print(do_stats.stats.toStr())
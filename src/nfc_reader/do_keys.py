@@ -0,0 +1,250 @@
+import hashlib
+import hmac
+import threading
+from collections import OrderedDict
+
+import card_data
+
+#keys of factory defaults and public specifications, tried when nothing better is known
+WELL_KNOWN_KEYS = (
+    card_data.MIFARE_1K_default_key,        #transport configuration
+    card_data.MAD_KEY_A,                    #MAD sector 0 (public key A)
+    card_data.NDEF_KEY_A,                   #NFC Forum NDEF sectors (public key A)
+    [0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5],   #MAD key B of some issuers
+    [0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
+    [0xAA, 0xBB, 0xCC, 0xDD, 0xEE, 0xFF],
+    [0x4D, 0x3A, 0x99, 0xC3, 0x51, 0xDD],
+    [0x1A, 0x98, 0x2C, 0x7E, 0x45, 0x9A],
+    [0x71, 0x4C, 0x5C, 0x88, 0x6E, 0x97],
+    [0x58, 0x7E, 0xE5, 0xF9, 0x35, 0x0F],
+    [0xA0, 0x47, 0x8C, 0xC3, 0x90, 0x91],
+    [0x53, 0x3C, 0xB6, 0xC7, 0x23, 0xF6],
+    [0x8F, 0xD0, 0xA4, 0xF2, 0x56, 0xE9],
+)
+
+#registered application provider ID of PC/SC part 3 storage card ATRs
+PCSC_RID = bytes([0xA0, 0x00, 0x00, 0x03, 0x06])
+
+
+#card family for key statistics: card standard and name of a PC/SC storage card ATR
+#(e.g. "030001" - ISO 14443 A part 3, MIFARE Classic 1K), whole ATR for other cards
+def fnCardFamily(atr) -> str:
+    atr = bytes(atr or [])
+    if len(atr) >= 15  and  atr[7:12] == PCSC_RID:
+        return atr[12:15].hex().upper()
+    return atr.hex().upper()
+
+
+#keys of one line of a key file: "[A:|B:]12 hex digits" (spaces allowed, # starts a comment);
+#without a key type the key is tried as A and as B. Empty list for empty/comment lines
+def parseKeyLine(line: str) -> list[card_data.key]:
+    line = line.split("#", 1)[0].strip().upper()
+    if len(line) == 0:
+        return []
+    keyTypes = [card_data.keyType.KT_A, card_data.keyType.KT_B]
+    if len(line) > 2  and  line[1] == ":"  and  line[0] in "AB":
+        keyTypes = [card_data.keyType(line[0])]
+        line     = line[2:]
+    keyData = bytes.fromhex(line.replace(" ", "").replace(":", ""))
+    if len(keyData) != card_data.MIFARE_1K_bytes_per_key:
+        raise ValueError(f"key must be {card_data.MIFARE_1K_bytes_per_key} bytes: {line}")
+    return [card_data.key(kType, list(keyData)) for kType in keyTypes]
+
+
+def fnLoadKeys(path: str) -> list[card_data.key]:
+    Result = []
+    with open(path, "r", encoding="utf-8") as f:
+        for nLine, line in enumerate(f, 1):
+            try:
+                Result += parseKeyLine(line)
+            except ValueError as e:
+                print(f"{path}:{nLine}: {e}")
+    return Result
+
+
+def keyId(key: card_data.key) -> tuple:
+    return (key.keyType.value, bytes(key.keyData))
+
+
+#default derivation: first 6 bytes of HMAC-SHA256(secret, UID | sector number | key type "A"/"B")
+def fnHmacDerive(secret: bytes, uid: bytes, nSector: int, keyTypeAB: str) -> bytes:
+    message = bytes(uid) + bytes([nSector]) + keyTypeAB.encode("ascii")
+    return hmac.new(secret, message, hashlib.sha256).digest()[0:card_data.MIFARE_1K_bytes_per_key]
+
+
+class keyDerivation:
+    """
+    Sector keys diversified per card: derived from the card UID, sector number
+    and key type with a site secret (fnHmacDerive unless another function is
+    given). Derived keys are kept in a bounded LRU cache, so repeated taps of a
+    card do not compute them again.
+
+    Example:
+        keyring.addDerivation(keyDerivation(secret))
+        do_wr.fnRead(connection, dump, None, keyring=keyring)
+    """
+    def __init__(self, secret: bytes, keyTypes: str = "AB", fnDerive: callable = fnHmacDerive, cacheSize: int = 4096):
+        self.secret    = bytes(secret)
+        self.keyTypes  = keyTypes       #key types derived for a sector, in order of trial
+        self.fnDerive  = fnDerive       #(secret, UID, sector, "A"/"B") -> 6 bytes key
+        self.cacheSize = cacheSize
+        self.cache     = OrderedDict()  #(UID, sector, key type) -> key data, least recently used first
+        self.hits      = 0
+        self.misses    = 0
+        self.lock      = threading.Lock()
+
+    def derive(self, uid: bytes, nSector: int, keyTypeAB: str) -> card_data.key:
+        cacheKey = (bytes(uid), nSector, keyTypeAB)
+        with self.lock:
+            keyData = self.cache.get(cacheKey)
+            if keyData is not None:
+                self.cache.move_to_end(cacheKey)
+                self.hits += 1
+                return card_data.key(card_data.keyType(keyTypeAB), list(keyData))
+        keyData = bytes(self.fnDerive(self.secret, bytes(uid), nSector, keyTypeAB))
+        if len(keyData) != card_data.MIFARE_1K_bytes_per_key:
+            raise ValueError(f"derived key must be {card_data.MIFARE_1K_bytes_per_key} bytes")
+        with self.lock:
+            self.misses += 1
+            self.cache[cacheKey] = keyData
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return card_data.key(card_data.keyType(keyTypeAB), list(keyData))
+
+    #derived keys of the sector in order of self.keyTypes
+    def keys(self, uid: bytes, nSector: int) -> list[card_data.key]:
+        return [self.derive(uid, nSector, keyTypeAB) for keyTypeAB in self.keyTypes]
+
+
+#site secret from a file: hex digits (spaces allowed, # starts a comment) or raw bytes if it is not hex
+def fnLoadSecret(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        text = "".join(line.split("#", 1)[0] for line in data.decode("ascii").splitlines())
+        return bytes.fromhex("".join(text.split()))
+    except ValueError:
+        return data
+
+
+class keyRing:
+    """
+    Candidate keys for cards that use a different key per sector.
+
+    Learns which key opened each sector of a card (by card family and UID),
+    so a card seen before authenticates at the first attempt. Cards not seen
+    yet get keys in order of past success for that sector of the family.
+    A key rejected missLimit times in a row by a sector of a card is not tried
+    on it again until forgetMisses(), so a single rejection caused by the card
+    leaving the field does not lose the right key. Keys derived from the UID
+    (addDerivation) are tried right after the known key. Keys added or loaded
+    are tried before the well-known defaults.
+
+    Example:
+        keyring = keyRing()
+        keyring.load("keys.txt")
+        do_wr.fnRead(connection, dump, None, keyring=keyring)
+    """
+    def __init__(self, keys: list[card_data.key] | None = None, withDefaults: bool = True, missLimit: int = 3):
+        self.keys   = []       #candidates in order of preference: added keys, then well-known keys
+        self.nAdded = 0        #added keys at the start of self.keys
+        self.memo   = {}       #(family, UID, sector) -> key that opened the sector
+        self.hits   = {}       #(family, sector, keyId) -> successful authentications
+        self.misses = {}       #(family, UID, sector, keyId) -> rejections of the key by the card since its last success
+        self.missLimit   = missLimit
+        self.derivations = []  #keyDerivation stages, keys for the UID of the card
+        self.lock   = threading.Lock()
+        for key in keys or []:
+            self.add(key)
+        if withDefaults:
+            ids = {keyId(key) for key in self.keys}
+            for kType in (card_data.keyType.KT_A, card_data.keyType.KT_B):
+                for keyData in WELL_KNOWN_KEYS:
+                    key = card_data.key(kType, list(keyData))
+                    if keyId(key) not in ids:
+                        ids.add(keyId(key))
+                        self.keys.append(key)
+
+    #add candidate after keys added before and ahead of the well-known keys; a key held already keeps
+    #its place. Preferred: tried before all others, e.g. a key entered by the user
+    def add(self, key: card_data.key, preferred: bool = False) -> None:
+        with self.lock:
+            ids = [keyId(k) for k in self.keys]
+            if keyId(key) in ids:
+                if not preferred:
+                    return
+                nPos = ids.index(keyId(key))
+                self.keys.pop(nPos)
+                if nPos < self.nAdded:
+                    self.nAdded -= 1
+            self.keys.insert(0 if preferred else self.nAdded, key)
+            self.nAdded += 1
+
+    def addDerivation(self, derivation: keyDerivation) -> None:
+        with self.lock:
+            self.derivations.append(derivation)
+
+    def load(self, path: str) -> int:
+        keys = fnLoadKeys(path)
+        for key in keys:
+            self.add(key)
+        return len(keys)
+
+    #keys to try on the sector: known key of this card, keys derived from its UID,
+    #then by success on the family, then the rest in order
+    def candidates(self, family: str, uid: bytes, nSector: int) -> list[card_data.key]:
+        uid = bytes(uid)
+        with self.lock:
+            derivations = list(self.derivations)
+        derived = [key for derivation in derivations for key in derivation.keys(uid, nSector)] if len(uid) != 0 else []
+        with self.lock:
+            known  = self.memo.get((family, uid, nSector))
+            Result = [key for key in self.keys if not self.__isMissed(family, uid, nSector, key)]
+            #stable sort: keys without hits stay in order of preference
+            Result.sort(key=lambda key: -self.hits.get((family, nSector, keyId(key)), 0))
+            derived = [key for key in derived if not self.__isMissed(family, uid, nSector, key)]
+            derivedIds = {keyId(key) for key in derived}
+            Result  = derived + [key for key in Result if keyId(key) not in derivedIds]
+            if known is not None  and  not self.__isMissed(family, uid, nSector, known):
+                Result = [known] + [key for key in Result if keyId(key) != keyId(known)]
+            return Result
+
+    #key was rejected by the sector of the card too often to be tried again (call with lock held)
+    def __isMissed(self, family: str, uid: bytes, nSector: int, key: card_data.key) -> bool:
+        return self.misses.get((family, uid, nSector, keyId(key)), 0) >= self.missLimit
+
+    #key of the type ("A"/"B") for the sector of the card that needs no trial: the known key of the card
+    #if it has that type, else the key derived from the UID; None if there is neither
+    def keyOfType(self, family: str, uid: bytes, nSector: int, keyTypeAB: str) -> card_data.key:
+        uid = bytes(uid)
+        with self.lock:
+            known       = self.memo.get((family, uid, nSector))
+            derivations = list(self.derivations)
+        if known is not None  and  known.keyType.value == keyTypeAB:
+            return known
+        for derivation in (derivations if len(uid) != 0 else []):
+            if keyTypeAB in derivation.keyTypes:
+                return derivation.derive(uid, nSector, keyTypeAB)
+        return None
+
+    def known(self, family: str, uid: bytes, nSector: int) -> card_data.key:
+        with self.lock:
+            return self.memo.get((family, bytes(uid), nSector))
+
+    def success(self, family: str, uid: bytes, nSector: int, key: card_data.key) -> None:
+        with self.lock:
+            self.memo[(family, bytes(uid), nSector)] = key
+            self.hits[(family, nSector, keyId(key))] = self.hits.get((family, nSector, keyId(key)), 0) + 1
+            self.misses.pop((family, bytes(uid), nSector, keyId(key)), None)
+
+    def miss(self, family: str, uid: bytes, nSector: int, key: card_data.key) -> None:
+        with self.lock:
+            missKey = (family, bytes(uid), nSector, keyId(key))
+            self.misses[missKey] = self.misses.get(missKey, 0) + 1
+            known = self.memo.get((family, bytes(uid), nSector))
+            if self.misses[missKey] >= self.missLimit  and  known is not None  and  keyId(known) == keyId(key):
+                del self.memo[(family, bytes(uid), nSector)] #key was changed on the card
+
+    def forgetMisses(self) -> None:
+        with self.lock:
+            self.misses.clear()
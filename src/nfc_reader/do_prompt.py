@@ -1,16 +1,20 @@
 from enum import Enum
 import sys
 import os
+import mmap
 import select
 import threading
 #import card_data
 
 class actions(Enum):
     A_READ           = "read card"
+    A_READ_UID       = "read card UID only"
+    A_READ_NDEF      = "read NDEF records (MAD sectors only)"
     A_READ_KEY       = "read key"
     A_PRINT_ALL      = "print all data"
     A_PRINT_SECTOR   = "print single sector"
     A_WRITE          = "write block interactively"
+    A_PRINT_STATS    = "print reader statistics"
     A_QUIT           = "quit"
 
 class writeDatType(Enum):
@@ -18,6 +22,7 @@ class writeDatType(Enum):
     W_DATA = "data" 
     W_ZERO = "zeros"
     W_RAND = "random"
+    W_FILE = "file"    #payload from a file or stdin (fnLoadPayload), not offered in the menu
 
 class writeAddress(Enum):
     A_BLOCK  = "block"   #default
@@ -49,6 +54,12 @@ class PromptAnswer_ForWrite:
         self.nBlock     = nBlock
         self.data       = bytearray(0)
 
+    #release a memory-mapped payload (W_FILE)
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = bytearray(0)
+
 
 """
 def fnPromptKey_FromTerminal():
@@ -195,6 +206,67 @@ def askHexData_FromTerminal(nBlockSize: int, cancelEvent: threading.Event) -> by
         return dataBinary if padding == 0 else dataBinary + bytearray(padding)
     return dataBinary
 
+#block numbers of a list like "4,5,8-11" (absolute numbers) or "1:0,2:1-2:2" (sector:block), ValueError if invalid
+def fnParseBlockList(text: str, nBlockCount: int, nCardBlocks: int) -> list[int]:
+    def blockNumber(item: str) -> int:
+        if ":" not in item:
+            return int(item)
+        nSector, nBlock = item.split(":")
+        if not 0 <= int(nBlock) < nBlockCount:
+            raise ValueError(f"invalid block: {item}")
+        return int(nSector) * nBlockCount + int(nBlock)
+
+    Result = []
+    for item in text.replace(" ", "").split(","):
+        first, _, last = item.partition("-")
+        nFirst = blockNumber(first)
+        nLast  = blockNumber(last) if len(last) != 0 else nFirst
+        if not 0 <= nFirst <= nLast < nCardBlocks:
+            raise ValueError(f"invalid block range: {item}")
+        Result += [n for n in range(nFirst, nLast + 1) if n not in Result]
+    return Result
+
+#nSector, nBlock of a start address "SECTOR:BLOCK", ValueError if invalid. Block 0 (manufacturer data)
+#and sector trailers are refused unless allowReserved: a write from there starts at the next data block
+def fnParseBlockAddress(text: str, nBlockCount: int, nSectors: int, allowReserved: bool = False) -> tuple[int, int]:
+    sector, sep, block = text.strip().partition(":")
+    if sep != ":"  or  not sector.isdigit()  or  not block.isdigit():
+        raise ValueError(f"SECTOR:BLOCK expected, e.g. 1:0: {text}")
+    nSector, nBlock = int(sector), int(block)
+    if not (0 <= nSector < nSectors  and  0 <= nBlock < nBlockCount):
+        raise ValueError(f"no such block: {text}")
+    if not allowReserved  and  ((nSector == 0  and  nBlock == 0)  or  nBlock == nBlockCount - 1):
+        raise ValueError(f"{text} is {'block 0' if nBlock == 0 else 'a sector trailer'}, not a data block")
+    return nSector, nBlock
+
+#payload of a binary file, a hex text file (isHex, # starts a comment) or stdin (path "-").
+#A binary file of whole blocks is memory-mapped and written without copies, other input is padded with zeros
+def fnLoadPayload(path: str, nBlockSize: int, isHex: bool = False):
+    if path == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(path, "rb") as f:
+            nSize = os.fstat(f.fileno()).st_size
+            if not isHex  and  nSize != 0  and  nSize % nBlockSize == 0:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) #stays valid after the file is closed
+            data = f.read()
+    if isHex:
+        text = "".join(line.split("#", 1)[0] for line in data.decode("ascii").splitlines())
+        data = bytearray.fromhex(text.replace(":", " ").replace(",", " "))
+    data    = bytearray(data)
+    padding = -len(data) % nBlockSize
+    return data + bytearray(padding)
+
+
+#answer for fnWrite with the payload of a file (see fnLoadPayload), written from the block nSector:nBlock on
+def fnWriteFromFile(path: str, nSector: int, nBlock: int, nBlockSize: int, isHex: bool = False) -> PromptAnswer_ForWrite:
+    answer = PromptAnswer_ForWrite(nSector, nBlock)
+    answer.dataType = writeDatType.W_FILE
+    answer.address  = writeAddress.A_BLOCK
+    answer.data     = fnLoadPayload(path, nBlockSize, isHex)
+    return answer
+
+
 #return key type: "A" or "B",  list[bytes] - 6 bytes of key data
 def askKey_FromTerminal(keyLength: int, cancelEvent: threading.Event) -> (bool, str, list[bytes]):
     # Ask for key type (A or B, default: B)
@@ -0,0 +1,134 @@
+import sys
+import threading
+from collections import namedtuple
+
+try:
+    from smartcard import scard
+except ImportError: #no PC/SC stack: profiles of virtual/recorded readers only
+    scard = None
+
+import do_comm
+
+SCARD_SHARE_DIRECT = getattr(scard, "SCARD_SHARE_DIRECT", 3)
+
+#control code of CCID escape commands (vendor commands to the reader itself, no card needed)
+def SCARD_CTL_CODE(code: int) -> int:
+    if scard is not None  and  hasattr(scard, "SCARD_CTL_CODE"):
+        return scard.SCARD_CTL_CODE(code)
+    return (0x31 << 16 | code << 2) if sys.platform == "win32" else 0x42000000 + code
+
+IOCTL_CCID_ESCAPE = SCARD_CTL_CODE(3500)
+
+#what is known about a reader model:
+#  match - part of PC/SC reader name, nKeySlots - volatile key slots for LOAD KEYS,
+#  apduTimeout - seconds per command, setup - escape commands sent once per reader (buzzer, polling...)
+readerModel = namedtuple("readerModel", ["model", "match", "nKeySlots", "apduTimeout", "setup"])
+
+KNOWN_MODELS = (
+    #ACR122U: FF 00 52 00 00 - no beep on card detection; FF 00 51 A1 00 - auto polling every 250 ms, ISO 14443 A only
+    readerModel("ACR122U",  "ACR122",  2, 1.0, ([0xFF, 0x00, 0x52, 0x00, 0x00], [0xFF, 0x00, 0x51, 0xA1, 0x00])),
+    #ACR1252U: E0 00 00 21 01 87 - LEDs on, buzzer off for card insertion/removal and operations
+    readerModel("ACR1252U", "ACR1252", 2, 1.0, ([0xE0, 0x00, 0x00, 0x21, 0x01, 0x87],)),
+)
+#anything else: one key slot, default timeout, no vendor commands
+GENERIC_MODEL = readerModel("generic", "", 1, do_comm.TIMEOUT_APDU, ())
+
+
+def fnModel(readerName: str) -> readerModel:
+    for model in KNOWN_MODELS:
+        if model.match in readerName:
+            return model
+    return GENERIC_MODEL
+
+
+class readerProfile:
+    """
+    Settings of one attached reader (by PC/SC name): model capabilities, state
+    of the one-time vendor setup and a connection object created in advance,
+    so a tap does not pay for context establishment and reader lookup.
+    """
+    def __init__(self, name: str, model: readerModel):
+        self.name        = name
+        self.model       = model
+        self.nKeySlots   = model.nKeySlots
+        self.apduTimeout = model.apduTimeout
+        self.configured  = False   #setup commands were sent (successfully or not, never repeated)
+        self.setupErrors = []      #escape commands the reader rejected
+        self.connection  = None    #pre-warmed connection for taps on this reader
+        self.lock        = threading.Lock()
+
+    def toStr(self) -> str:
+        Result = f"{self.name}: {self.model.model}, key slots: {self.nKeySlots}, APDU timeout: {self.apduTimeout} s"
+        if len(self.setupErrors) != 0:
+            Result += f", setup failed: {len(self.setupErrors)}/{len(self.model.setup)}"
+        return Result
+
+
+#profiles of known readers by PC/SC name (a re-plugged reader is forgotten and set up again)
+profiles: dict = {}
+profilesLock = threading.Lock()
+
+
+def fnGetProfile(readerName: str) -> readerProfile:
+    with profilesLock:
+        profile = profiles.get(readerName)
+        if profile is None:
+            profile = profiles[readerName] = readerProfile(readerName, fnModel(readerName))
+        return profile
+
+
+def fnForget(readerName: str) -> None:
+    with profilesLock:
+        profiles.pop(readerName, None)
+
+
+#send setup escape commands of the model once per profile
+def fnConfigure(connection, profile: readerProfile) -> bool:
+    with profile.lock:
+        if not profile.configured:
+            for command in profile.model.setup:
+                try:
+                    do_comm.transmitWatchdog.call(connection.control, IOCTL_CCID_ESCAPE, command, timeout=do_comm.TIMEOUT_APDU)
+                except Exception as e: #readers reject unknown escapes in their own ways, all are kept in setupErrors
+                    profile.setupErrors.append((command, e))
+            profile.configured = True
+        return len(profile.setupErrors) == 0
+
+
+def fnPrewarm(reader) -> readerProfile:
+    """
+    Probe a reader as soon as it appears: pick its profile, apply vendor setup
+    through a direct connection (works without a card) and create the
+    connection object later taps will use.
+
+    Args:
+        reader: pyscard Reader or do_emul.VirtualReader.
+    """
+    profile = fnGetProfile(str(reader))
+    try:
+        connection = reader.createConnection()
+        if not profile.configured  and  len(profile.model.setup) != 0:
+            connection.connect(mode=SCARD_SHARE_DIRECT)
+            try:
+                fnConfigure(connection, profile)
+            finally:
+                connection.disconnect()
+        profile.connection = connection
+    except Exception as e: #a reader that cannot be probed is still used, only without pre-warmed connection
+        print(f"reader {profile.name}: {e}")
+    return profile
+
+
+#pre-warmed connection for the reader (None if it was not prewarmed)
+def fnConnection(readerName: str):
+    with profilesLock:
+        profile = profiles.get(readerName)
+    return profile.connection if profile is not None else None
+
+
+#session on a connected card with limits of the reader profile (setup is applied now if prewarm could not do it)
+def fnOpenSession(connection) -> do_comm.CardSession:
+    profile = fnGetProfile(do_comm.fnReaderName(connection))
+    if not profile.configured:
+        fnConfigure(connection, profile)
+    return do_comm.CardSession(connection, nKeySlots=profile.nKeySlots, apduTimeout=profile.apduTimeout)
@@ -0,0 +1,186 @@
+import gzip
+import json
+import sys
+import threading
+import time
+
+import do_comm
+
+#Session file format: one JSON object per line (gzip compressed if the name ends with .gz).
+#First line is the header:
+#    {"v": 1, "reader": "<reader name>", "atr": "<hex>", "start": <unix time>}
+#Every following line is one call on the connection (t - start offset, d - duration, seconds):
+#    {"op": "tx", "t": 0.0123, "d": 0.0041, "c": "<APDU hex>", "r": "<response hex>", "sw": "9000"}
+#    {"op": "tx", "t": ..., "d": ..., "c": "<APDU hex>", "e": "<exception class>", "m": "<message>", "h": <hresult>}
+#    {"op": "reconnect", "t": ..., "d": ...}
+REPLAY_FORMAT_VERSION = 1
+
+def openSessionFile(path: str, mode: str):
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+
+#exception raised by ReplayConnection in place of the recorded one (hresult keeps txResult classification)
+class ReplayedError(Exception):
+    def __init__(self, message: str, hresult: int | None = None):
+        super().__init__(message)
+        self.hresult = hresult
+
+
+#strict replay got a call the recording does not have at this point
+class ReplayMismatch(do_comm.SessionDesync):
+    pass
+
+
+class RecordingConnection:
+    """
+    Wrapper of a CardConnection that logs every APDU, response, status words
+    and timing into a session file, passing calls through unchanged.
+
+    Can be used anywhere a connection is expected (do_comm, do_wr); all other
+    attributes are taken from the wrapped connection.
+
+    Example:
+        with RecordingConnection(cardConnection, "tap.jsonl.gz") as connection:
+            do_wr.fnRead(connection, dump, key)
+    """
+    def __init__(self, connection, path: str):
+        self.connection = connection
+        self.lock       = threading.Lock()
+        self.file       = openSessionFile(path, "w")
+        self.timeStart  = time.perf_counter()
+        atr = bytes(do_comm.fnATR(connection)).hex()
+        self.__write({"v": REPLAY_FORMAT_VERSION, "reader": do_comm.fnReaderName(connection), "atr": atr, "start": time.time()})
+
+    def __write(self, event: dict) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def __event(self, op: str, timeStart: float) -> dict:
+        return {"op": op, "t": round(timeStart - self.timeStart, 6), "d": round(time.perf_counter() - timeStart, 6)}
+
+    def transmit(self, command, *args, **kwargs):
+        timeStart = time.perf_counter()
+        try:
+            response, sw1, sw2 = self.connection.transmit(command, *args, **kwargs)
+        except Exception as e:
+            event = self.__event("tx", timeStart)
+            event.update(c=bytes(command).hex(), e=type(e).__name__, m=str(e), h=getattr(e, "hresult", None))
+            self.__write(event)
+            raise
+        event = self.__event("tx", timeStart)
+        event.update(c=bytes(command).hex(), r=bytes(response).hex(), sw=f"{sw1:02X}{sw2:02X}")
+        self.__write(event)
+        return response, sw1, sw2
+
+    def reconnect(self, *args, **kwargs):
+        timeStart = time.perf_counter()
+        try:
+            return self.connection.reconnect(*args, **kwargs)
+        finally:
+            self.__write(self.__event("reconnect", timeStart))
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class ReplayConnection:
+    """
+    Connection that answers from a recorded session file, no reader needed.
+
+    Args:
+        path: Session file written by RecordingConnection.
+        realtime: Keep original timing (sleep until each answer's recorded time),
+                  otherwise answer as fast as possible.
+        strict: Raise ReplayMismatch if a command differs from the recorded one;
+                otherwise recorded answers are returned in order whatever is sent.
+
+    When the recording is exhausted every call raises ReplayedError with the
+    SCARD_W_REMOVED_CARD code, i.e. the card looks removed.
+    """
+    def __init__(self, path: str, realtime: bool = False, strict: bool = True):
+        with openSessionFile(path, "r") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if len(lines) == 0  or  lines[0].get("v") != REPLAY_FORMAT_VERSION:
+            raise ValueError(f"{path}: not a session file (version {REPLAY_FORMAT_VERSION})")
+        self.header    = lines[0]
+        self.events    = lines[1:]
+        self.position  = 0
+        self.realtime  = realtime
+        self.strict    = strict
+        self.timeStart = time.perf_counter()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.position >= len(self.events)
+
+    def getReader(self) -> str:
+        return self.header.get("reader", "replay")
+
+    def getATR(self) -> list[int]:
+        return list(bytes.fromhex(self.header.get("atr", "")))
+
+    def connect(self, *args, **kwargs) -> None:
+        self.timeStart = time.perf_counter()
+
+    def disconnect(self) -> None:
+        pass
+
+    def __next(self, op: str) -> dict:
+        if self.exhausted:
+            raise ReplayedError("end of recorded session: card was removed", 0x80100069)
+        event = self.events[self.position]
+        if event["op"] != op  and  not self.strict:
+            #skip calls the current code path does not make
+            while not self.exhausted  and  self.events[self.position]["op"] != op:
+                self.position += 1
+            return self.__next(op)
+        if event["op"] != op:
+            raise ReplayMismatch(f"step {self.position}: expected {event['op']}, got {op}")
+        self.position += 1
+        if self.realtime:
+            delay = event["t"] + event["d"] - (time.perf_counter() - self.timeStart)
+            if delay > 0:
+                time.sleep(delay)
+        return event
+
+    def transmit(self, command, *args, **kwargs):
+        event = self.__next("tx")
+        if self.strict  and  bytes(command).hex() != event["c"]:
+            raise ReplayMismatch(f"step {self.position - 1}: expected {event['c'].upper()}, got {bytes(command).hex().upper()}")
+        if "e" in event:
+            raise ReplayedError(f"{event['e']}: {event['m']}", event.get("h"))
+        sw = int(event["sw"], 16)
+        return list(bytes.fromhex(event["r"])), sw >> 8, sw & 0xFF
+
+    def reconnect(self, *args, **kwargs) -> None:
+        if self.strict  or  (not self.exhausted  and  self.events[self.position]["op"] == "reconnect"):
+            self.__next("reconnect")
+
+
+###################################################
+#replay a recorded full dump through do_wr.fnRead: python do_replay.py <session file> [--realtime]
+if __name__ == "__main__":
+    import card_data
+    import do_wr
+    if len(sys.argv) < 2:
+        print("usage: do_replay.py <session file> [--realtime]")
+    else:
+        connection = ReplayConnection(sys.argv[1], realtime="--realtime" in sys.argv, strict=False)
+        dump = card_data.dumpMifare_1k()
+        timeStart = time.perf_counter()
+        do_wr.fnRead(connection, dump, card_data.key())
+        print(f"replayed in {(time.perf_counter() - timeStart) * 1000:.1f} ms")
+        card_data.printDump(dump)
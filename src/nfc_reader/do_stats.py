@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+#names of instruction bytes used by do_comm
+INS_NAMES = {
+    0x82: "LOAD KEY",
+    0x86: "AUTH",
+    0xB0: "READ",
+    0xD6: "WRITE",
+    0xCA: "GET DATA",
+    0xD7: "VALUE",
+    0xB1: "READ VALUE",
+}
+
+#typical seconds per instruction (USB ACR122-type reader, MIFARE Classic) when nothing was measured yet
+TYPICAL_LATENCY = {
+    0x82: 0.0008,
+    0x86: 0.0030,
+    0xB0: 0.0025,
+    0xD6: 0.0060,
+    0xCA: 0.0008,
+    0xD7: 0.0065,
+    0xB1: 0.0025,
+}
+
+#upper bounds (seconds) of latency histogram buckets, +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+#one transmitted command: outcome is "9000"-like SW1SW2 hex, exception class name or "timeout"
+txRecord = namedtuple("txRecord", ["time", "reader", "ins", "nBlock", "elapsed", "outcome"])
+
+
+def insName(ins: int) -> str:
+    return INS_NAMES.get(ins, f"{ins:02X}")
+
+
+def outcomeFromStatus(sw1: int, sw2: int) -> str:
+    return f"{sw1:02X}{sw2:02X}"
+
+
+#counters and latency histogram of one (reader, instruction) pair
+class txSeries:
+    def __init__(self):
+        self.count     = 0
+        self.totalTime = 0.0
+        self.maxTime   = 0.0
+        self.buckets   = [0] * (len(LATENCY_BUCKETS) + 1)  #last one is +Inf
+        self.outcomes  = {}                                 #outcome -> count
+
+    def add(self, elapsed: float, outcome: str) -> None:
+        self.count     += 1
+        self.totalTime += elapsed
+        self.maxTime    = max(self.maxTime, elapsed)
+        iBucket = 0
+        while iBucket < len(LATENCY_BUCKETS)  and  elapsed > LATENCY_BUCKETS[iBucket]:
+            iBucket += 1
+        self.buckets[iBucket] += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def merge(self, other: "txSeries") -> None:
+        self.count     += other.count
+        self.totalTime += other.totalTime
+        self.maxTime    = max(self.maxTime, other.maxTime)
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        for outcome, n in other.outcomes.items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + n
+
+    @property
+    def avgTime(self) -> float:
+        return self.totalTime / self.count if self.count != 0 else 0.0
+
+    #latency below which the given part (0..1) of commands finished, estimated by bucket bounds
+    def quantile(self, part: float) -> float:
+        target = part * self.count
+        nSeen  = 0
+        for i, n in enumerate(self.buckets):
+            nSeen += n
+            if nSeen >= target  and  n != 0:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.maxTime
+        return 0.0
+
+    @property
+    def errors(self) -> int:
+        return self.count - self.outcomes.get("9000", 0)
+
+
+#counters of one thread: only that thread adds to them, snapshot() reads them under the same lock
+class txShard:
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.lock   = threading.Lock()
+        self.series = {}                  #(reader, ins) -> txSeries
+
+
+class txStats:
+    """
+    Per-reader, per-instruction counters and latency histograms of transmitted APDUs.
+
+    record() runs on the transmit path of every thread, so threads do not share
+    a lock: each thread updates its own shard (threading.local) under the lock
+    of the shard, which only snapshot() takes too, so a merged series never
+    sees half of an add(). Shards of finished threads are folded into one set
+    of counters when a new thread starts recording or a snapshot is taken.
+    The last RECENT_SIZE raw records are kept for inspection (deque append is atomic).
+    """
+    RECENT_SIZE = 256
+
+    def __init__(self):
+        self.enabled   = True
+        self.recent    = deque(maxlen=self.RECENT_SIZE)
+        self.__local   = threading.local()
+        self.__shards  = []               #txShard of every thread still running
+        self.__retired = {}               #(reader, ins) -> txSeries of finished threads
+        self.__lock    = threading.Lock() #for the shard list and retired counters
+
+    def __shard(self) -> txShard:
+        shard = getattr(self.__local, "shard", None)
+        if shard is None:
+            shard = txShard()
+            with self.__lock:
+                self.__retireFinished()
+                self.__shards.append(shard)
+            self.__local.shard = shard
+        return shard
+
+    #move counters of finished threads to self.__retired (self.__lock held)
+    def __retireFinished(self) -> None:
+        running = []
+        for shard in self.__shards:
+            if shard.thread.is_alive():
+                running.append(shard)
+                continue
+            with shard.lock:
+                for seriesKey, series in shard.series.items():
+                    self.__retired.setdefault(seriesKey, txSeries()).merge(series)
+        self.__shards = running
+
+    @property
+    def nShards(self) -> int:
+        with self.__lock:
+            return len(self.__shards)
+
+    def record(self, reader: str, ins: int, nBlock: int, elapsed: float, outcome: str) -> None:
+        if not self.enabled:
+            return
+        shard = self.__shard()
+        with shard.lock:
+            series = shard.series.get((reader, ins))
+            if series is None:
+                series = shard.series[(reader, ins)] = txSeries()
+            series.add(elapsed, outcome)
+        self.recent.append(txRecord(time.time(), reader, ins, nBlock, elapsed, outcome))
+
+    #record one APDU: block address is P2 for READ/WRITE, data byte 3 for AUTH, -1 otherwise
+    def recordApdu(self, reader: str, apdu: list[bytes], elapsed: float, outcome: str) -> None:
+        if not self.enabled  or  len(apdu) < 4:
+            return
+        ins = apdu[1]
+        nBlock = apdu[3] if ins in (0xB0, 0xD6, 0xB1, 0xD7) else apdu[7] if ins == 0x86 and len(apdu) > 7 else -1
+        self.record(reader, ins, nBlock, elapsed, outcome)
+
+    #merged counters of all threads: (reader, ins) -> txSeries
+    def snapshot(self) -> dict:
+        Result = {}
+        with self.__lock:
+            self.__retireFinished()
+            for seriesKey, series in self.__retired.items():
+                Result.setdefault(seriesKey, txSeries()).merge(series)
+            for shard in self.__shards:
+                with shard.lock:
+                    for seriesKey, series in shard.series.items():
+                        Result.setdefault(seriesKey, txSeries()).merge(series)
+        return Result
+
+    #measured average seconds of the instruction on the reader (all readers if None), TYPICAL_LATENCY otherwise
+    def avgTime(self, reader: str, ins: int) -> float:
+        series = txSeries()
+        for (seriesReader, seriesIns), seriesData in self.snapshot().items():
+            if seriesIns == ins  and  (reader is None  or  seriesReader == reader):
+                series.merge(seriesData)
+        return series.avgTime if series.count != 0 else TYPICAL_LATENCY.get(ins, 0.0)
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__retired.clear()
+            for shard in self.__shards:
+                with shard.lock:
+                    shard.series.clear()
+        self.recent.clear()
+
+    def toStr(self) -> str:
+        lines = [f"{'reader':<32} {'command':<9} {'count':>7} {'errors':>6} {'avg ms':>8} {'p95 ms':>8} {'max ms':>8}"]
+        for (reader, ins), series in sorted(self.snapshot().items(), key=lambda item: (item[0][0], item[0][1])):
+            lines.append(f"{reader[:32]:<32} {insName(ins):<9} {series.count:>7} {series.errors:>6} "
+                         f"{series.avgTime * 1000:>8.2f} {series.quantile(0.95) * 1000:>8.2f} {series.maxTime * 1000:>8.2f}")
+        return "\n".join(lines)
+
+    def toPrometheus(self) -> str:
+        """Aggregates in Prometheus text exposition format."""
+        def label(value) -> str:
+            return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        lines = ["# HELP nfc_apdu_total APDUs sent to the card reader by outcome (SW1SW2 or exception).",
+                 "# TYPE nfc_apdu_total counter"]
+        snapshot = sorted(self.snapshot().items(), key=lambda item: (item[0][0], item[0][1]))
+        for (reader, ins), series in snapshot:
+            for outcome, n in sorted(series.outcomes.items()):
+                lines.append(f'nfc_apdu_total{{reader="{label(reader)}",ins="{insName(ins)}",outcome="{label(outcome)}"}} {n}')
+        lines += ["# HELP nfc_apdu_duration_seconds Wall time of APDU exchange with the card reader.",
+                  "# TYPE nfc_apdu_duration_seconds histogram"]
+        for (reader, ins), series in snapshot:
+            labels = f'reader="{label(reader)}",ins="{insName(ins)}"'
+            nCumulative = 0
+            for i, n in enumerate(series.buckets):
+                nCumulative += n
+                le = f"{LATENCY_BUCKETS[i]}" if i < len(LATENCY_BUCKETS) else "+Inf"
+                lines.append(f'nfc_apdu_duration_seconds_bucket{{{labels},le="{le}"}} {nCumulative}')
+            lines.append(f"nfc_apdu_duration_seconds_sum{{{labels}}} {series.totalTime:.6f}")
+            lines.append(f"nfc_apdu_duration_seconds_count{{{labels}}} {series.count}")
+        return "\n".join(lines) + "\n"
+
+
+#write Prometheus text file atomically (for node_exporter textfile collector)
+def fnExportPrometheus(path: str, txStatistics: "txStats" = None) -> None:
+    text = (txStatistics or stats).toPrometheus()
+    tmpPath = f"{path}.tmp"
+    with open(tmpPath, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmpPath, path)
+
+
+class periodicExport:
+    """
+    Keeps a Prometheus text file up to date for long-running modes: writes it
+    every interval seconds in a daemon thread and once more on stop(), so the
+    last taps are in the file when the program exits.
+
+    Example:
+        exporter = periodicExport("/var/lib/node_exporter/nfc.prom").start()
+        ...
+        exporter.stop()
+    """
+    def __init__(self, path: str, interval: float = 15.0, txStatistics: "txStats" = None):
+        self.path         = path
+        self.interval     = interval
+        self.txStatistics = txStatistics
+        self.stopEvent    = threading.Event()
+        self.thread       = None
+
+    def start(self) -> "periodicExport":
+        fnExportPrometheus(self.path, self.txStatistics) #a bad path is reported at once
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __run(self) -> None:
+        while not self.stopEvent.wait(self.interval):
+            try:
+                fnExportPrometheus(self.path, self.txStatistics)
+            except OSError as e:
+                print(f"metrics export failed: {e}")
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        fnExportPrometheus(self.path, self.txStatistics)
+
+
+#statistics of all APDUs sent by do_comm
+stats = txStats()
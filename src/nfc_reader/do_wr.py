@@ -1,11 +1,19 @@
 import sys
-import smartcard.scard
-from smartcard.CardRequest import CardRequest
-from smartcard.CardConnection import CardConnection
+import time
+from collections import namedtuple
+
+try:
+    from smartcard.CardRequest import CardRequest
+except ImportError: #no PC/SC stack: only operations on a given (recorded/virtual) connection are available
+    CardRequest = None
 
 import card_data
-import do_prompt
 import do_comm
+import do_keys
+import do_prompt
+import do_stats
+from do_comm import CardConnection
+
 
 def printFailBlocks(nSector: int, sector: card_data.dumpMifare_1k.sector):
     failBlocks = []
@@ -16,46 +24,759 @@ def printFailBlocks(nSector: int, sector: card_data.dumpMifare_1k.sector):
         print(f"Sector[{nSector}]: fail blocks {failBlocks}")
         
 ############################################################################################################
-#read all card info
-def fnRead(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key) -> bool:
-    totalBlocksToRead = len(dump.sectors) * len(dump.sectors[0].blocks)
-    totalFailCount    = 0
-    totalBlocksRead   = 0
+class opResult:
+    """
+    Outcome of a multi-block read or write.
+
+    Converts to bool (True only when every requested block was processed and
+    there was something to process), so
+    callers that only check success keep working. When the card or reader is
+    lost the operation stops at once and stopReason/stopSector/stopBlock tell
+    where it stopped.
+    """
+    def __init__(self, nTotal: int):
+        self.nTotal     = nTotal                      #blocks requested
+        self.nDone      = 0                           #blocks processed successfully
+        self.stopReason = do_comm.txResult.TX_OK      #fatal class that aborted the operation
+        self.stopSector = -1                          #sector:block of the command that aborted the operation
+        self.stopBlock  = -1
+        self.nReactivations   = 0                     #card re-activations after failed commands
+        self.reactivationTime = 0.0                   #seconds spent on them
+        self.nRetries   = 0                           #commands repeated by retryPolicy
+        self.nResumed   = 0                           #blocks kept from an earlier partial dump (counted in nDone)
+        self.nSkipped   = 0                           #blocks not written: card already holds the data (counted in nDone)
+        self.savedTime  = 0.0                         #estimated seconds the skipped writes would have taken
+        self.verified   = {}                          #block number -> read-back matched the written data (verify mode)
+        self.nRewrites  = 0                           #writes repeated because read-back did not match
+        self.nRefused   = 0                           #blocks not tried: access bits of a known trailer deny the operation
+        self.nNotAttempted = 0                        #blocks of sectors not started: the time budget would not cover them
+        self.__startState = None
+
+    #start operation deadline (unless an outer operation already runs one or withDeadline is False) and
+    #start counting re-activations done by the session during this operation
+    def begin(self, session: do_comm.CardSession, timeout: float | None = None, withDeadline: bool = True) -> "opResult":
+        ownDeadline = withDeadline  and  session.deadline is None
+        ownDeadline and session.beginOperation(timeout)
+        self.__startState = (session, ownDeadline, session.reactivations, session.reactivationTime, session.retries)
+        return self
+
+    def end(self) -> "opResult":
+        if self.__startState is not None:
+            session, ownDeadline, nStart, timeStart, nRetriesStart = self.__startState
+            ownDeadline and session.endOperation()
+            self.nReactivations   = session.reactivations - nStart
+            self.reactivationTime = session.reactivationTime - timeStart
+            self.nRetries         = session.retries - nRetriesStart
+            self.__startState = None
+        return self
+
+    @property
+    def isOk(self) -> bool:
+        return self.nTotal > 0  and  self.nDone == self.nTotal
+
+    @property
+    def isAborted(self) -> bool:
+        return self.stopReason.isFatal
+
+    def abort(self, reason: do_comm.txResult, nBlockThrowCard: int) -> None:
+        self.stopReason = reason
+        self.stopSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
+        self.stopBlock  = nBlockThrowCard %  card_data.MIFARE_1K_blocks_per_sector
+
+    def __bool__(self) -> bool:
+        return self.isOk
+
+    #add blocks of a part of the operation (re-activations and retries are counted by begin()/end() of the whole)
+    def merge(self, other: "opResult") -> "opResult":
+        self.nTotal    += other.nTotal
+        self.nDone     += other.nDone
+        self.nResumed  += other.nResumed
+        self.nSkipped  += other.nSkipped
+        self.savedTime += other.savedTime
+        self.nRewrites += other.nRewrites
+        self.nRefused  += other.nRefused
+        self.nNotAttempted += other.nNotAttempted
+        self.verified.update(other.verified)
+        if other.isAborted:
+            self.stopReason, self.stopSector, self.stopBlock = other.stopReason, other.stopSector, other.stopBlock
+        return self
+
+    def toStr(self) -> str:
+        Result = f"{self.nDone}/{self.nTotal}"
+        if self.nResumed != 0:
+            Result += f", resumed: {self.nResumed}"
+        if self.nSkipped != 0:
+            Result += f", unchanged: {self.nSkipped} (~{self.savedTime * 1000:.0f} ms saved)"
+        if len(self.verified) != 0:
+            failed = [f"{n // card_data.MIFARE_1K_blocks_per_sector}:{n % card_data.MIFARE_1K_blocks_per_sector}" for n, isOk in self.verified.items() if not isOk]
+            Result += f", verified: {len(self.verified) - len(failed)}/{len(self.verified)}"
+            Result += f" (mismatch: {' '.join(failed)})" if len(failed) != 0 else ""
+        if self.nRewrites != 0:
+            Result += f", rewrites: {self.nRewrites}"
+        if self.nRefused != 0:
+            Result += f", denied by access bits: {self.nRefused}"
+        if self.nNotAttempted != 0:
+            Result += f", not attempted: {self.nNotAttempted} (out of time budget)"
+        if self.nRetries != 0:
+            Result += f", retries: {self.nRetries}"
+        if self.nReactivations != 0:
+            Result += f", reconnects: {self.nReactivations} ({self.reactivationTime * 1000:.1f} ms)"
+        if self.isAborted:
+            Result += f", aborted at sector[{self.stopSector}]:block[{self.stopBlock}]: {self.stopReason.value}"
+        return Result
+
+
+#dump status after an operation was aborted with fatal txResult
+def statusFromResult(reason: do_comm.txResult) -> card_data.status:
+    match reason:
+        case do_comm.txResult.TX_READER_GONE:
+            return card_data.status.S_NO_READERS
+        case do_comm.txResult.TX_TIMEOUT:
+            return card_data.status.S_TIMEOUT
+    return card_data.status.S_NO_CARD
+
+
+#mark sectors that were not reached because the operation was aborted
+def markNotRead(dump: card_data.dumpMifare_1k, sectorNumbers: list[int]) -> None:
+    for iSector in sectorNumbers:
+        sector = dump.sectors[iSector]
+        sector.status = card_data.status.S_NOT_READ
+        for block in sector.blocks:
+            if block.status != card_data.status.S_OK:
+                block.status = card_data.status.S_NOT_READ
+
+
+############################################################################################################
+#retries of failed block reads, shared by all reads so the backoff learns the failure rate across taps
+blockRetry = do_comm.retryPolicy()
+
+#load key and authenticate to the sector of the block (both skipped by session if already done), then read the block
+def fnAuthRead(session: do_comm.CardSession, nBlockThrowCard: int, key: card_data.key) -> (bool, list[bytes]):
+    nBlock0 = nBlockThrowCard - nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+    if not session.authenticate(nBlock0, key.keyType.value, key.keyData):
+        return False, None
+    return session.readBlock(nBlockThrowCard)
+
+
+#key for the operation (card_data.OP_READ...) on the block by access bits of a trailer seen before:
+#the given key if its type may do it (or the trailer is not known), otherKey if only its type may
+#(key A and key B of a sector differ, the key data of one is not tried as the other), None if no key
+#at hand may do it: nothing is sent then, the card would reject it
+def fnSelectKey(trailer: card_data.dumpMifare_1k.trailer, nBlockThrowCard: int, nOperation: int, key: card_data.key,
+                otherKey: card_data.key = None) -> card_data.key:
+    if trailer is None  or  trailer.status != card_data.status.S_OK:
+        return key
+    allowed = card_data.allowedKeys(trailer.accessBits, nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector, nOperation)
+    if allowed is None  or  key.keyType.value in allowed:
+        return key
+    if otherKey is not None  and  otherKey.keyType.value in allowed:
+        return otherKey
+    return None
+
+
+#key of the other type than key for the sector, as far as the keyring knows it without trying keys
+#(see do_keys.keyRing.keyOfType)
+def fnOtherKey(keyring: do_keys.keyRing, family: str, uid: bytes, nSector: int, key: card_data.key) -> card_data.key:
+    if key is None:
+        return None
+    otherType = card_data.keyType.KT_B if key.keyType == card_data.keyType.KT_A else card_data.keyType.KT_A
+    return keyring.keyOfType(family, uid, nSector, otherType.value)
+
+
+#text for a block whose operation the access bits do not permit to the key at hand
+def fnNotPermittedStr(trailer: card_data.dumpMifare_1k.trailer, nBlockThrowCard: int, nOperation: int) -> str:
+    if fnIsDenied(trailer, nBlockThrowCard, nOperation):
+        return "is denied by access bits"
+    allowed = card_data.allowedKeys(trailer.accessBits, nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector, nOperation)
+    return f"needs key {allowed}, key type not permitted by access bits"
+
+
+#operation on the block is denied to both keys by access bits of a trailer seen before
+def fnIsDenied(trailer: card_data.dumpMifare_1k.trailer, nBlockThrowCard: int, nOperation: int) -> bool:
+    return (trailer.status == card_data.status.S_OK
+            and  card_data.allowedKeys(trailer.accessBits, nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector, nOperation) == "")
+
+
+#authenticate to the sector with keys of the keyring (key known for the card first): the key that opened it, None if none did
+def fnFindKey(session: do_comm.CardSession, keyring: do_keys.keyRing, family: str, uid: bytes, nBlock0: int) -> card_data.key:
+    nSector = nBlock0 // card_data.MIFARE_1K_blocks_per_sector
+    for key in keyring.candidates(family, uid, nSector):
+        if session.authenticate(nBlock0, key.keyType.value, key.keyData):
+            keyring.success(family, uid, nSector, key)
+            return key
+        if session.isFatal:
+            break
+        if session.lastResult == do_comm.txResult.TX_AUTH_FAIL:
+            keyring.miss(family, uid, nSector, key)
+    return None
+
+
+#card family and UID for keyring lookups: the given UID (of a dump bound to the card) or UID by GET DATA (b"" if that fails)
+def fnCardIdentity(session: do_comm.CardSession, uid: bytes | None = None) -> (str, bytes):
+    if uid is None:
+        uidOk, uid = session.getData(do_comm.GET_DATA_UID)
+        uid = uid if uidOk else b""
+    return do_keys.fnCardFamily(do_comm.fnATR(session.connection)), bytes(uid)
+
+
+#block 0 of the card in the field starts with the UID the dump was bound to (with the whole block 0 of the
+#dump if it never was): for readers without GET DATA. Sector 0 is opened with the key or keys of the keyring
+def fnSameBlock0(session: do_comm.CardSession, dump: card_data.dumpMifare_1k, key: card_data.key | None = None,
+                 keyring: do_keys.keyRing | None = None) -> bool:
+    block0 = dump.blockAt(0)
+    expected = bytes(dump.UID) if len(dump.UID) != 0 else bytes(block0.data) if block0.status == card_data.status.S_OK else b""
+    if len(expected) == 0  or  session.isFatal:
+        return False
+    if keyring is not None:
+        family    = do_keys.fnCardFamily(do_comm.fnATR(session.connection))
+        sectorKey = fnFindKey(session, keyring, family, b"", 0)
+        readOk, data = session.readBlock(0) if sectorKey is not None else (False, None)
+    else:
+        readOk, data = fnAuthRead(session, 0, key or card_data.key())
+    return readOk  and  bytes(data[0:len(expected)]) == expected
+
+
+#dump belongs to the card in the field: full UID by GET DATA against the UID the dump was bound to
+#(UID bytes of its block 0 if it never was), so its blocks can be kept and dump.UID is the card's.
+#If the reader rejects GET DATA, block 0 is read again instead (see fnSameBlock0).
+#Otherwise the dump is cleared for the new card and False returned.
+def fnBindCard(session: do_comm.CardSession, dump: card_data.dumpMifare_1k, key: card_data.key | None = None,
+               keyring: do_keys.keyRing | None = None) -> bool:
+    readOk, uid = session.getData(do_comm.GET_DATA_UID)
+    if readOk:
+        uid    = bytes(uid)
+        block0 = dump.blockAt(0)
+        if len(dump.UID) != 0:
+            dumpUid = bytes(dump.UID)
+        else:
+            dumpUid = bytes(block0.data[0:len(uid)]) if block0.status == card_data.status.S_OK else b""
+        if len(uid) != 0  and  uid == dumpUid:
+            dump.UID = bytearray(uid)
+            return True
+    elif fnSameBlock0(session, dump, key, keyring):
+        return True
+    dump.clear()
+    if readOk:
+        dump.UID      = bytearray(uid)
+        dump.head.UID = bytearray(uid)
+    return False
+
+
+#sectors in reading order: sectors of the priority list first (in its order), the others ascending
+def fnSectorOrder(sectorNumbers: list[int], priority: list[int] | None = None) -> list[int]:
+    first = [iSector for iSector in dict.fromkeys(priority or []) if iSector in sectorNumbers]
+    return first + [iSector for iSector in sorted(sectorNumbers) if iSector not in first]
+
+
+#estimated seconds to authenticate to a sector and read nBlocks of its blocks (see do_stats.txStats.avgTime)
+def fnSectorReadCost(readerName: str, nBlocks: int) -> float:
+    avgTime = do_stats.stats.avgTime
+    return avgTime(readerName, do_comm.APDU_AUTH[1]) + nBlocks * avgTime(readerName, do_comm.APDU_READ[1])
+
+
+def fnReadBlocksIter(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, blockNumbers: list[int],
+                     timeout: float | None = None, retry: do_comm.retryPolicy | None = None, resume: bool = False,
+                     keyring: do_keys.keyRing | None = None, priority: list[int] | None = None, budget: float | None = None,
+                     result: opResult = None):
+    """
+    Read the given blocks of the card into dump, stop at once if card or reader
+    is lost or the deadline passed. Other blocks of dump are left as they are.
+    Generator: yields (sector number, sector of dump) as soon as a sector is done,
+    so its blocks and trailer can be used while the next sector is read.
+
+    Args:
+        connection: Active card connection or CardSession (key stays in reader slot for the whole read).
+        dump: Dump to fill.
+        key: Key for every sector. If dump holds the trailer of a sector, its access
+             bits choose key A or B for each block (same key data); blocks no key
+             may read are marked S_DENIED without sending anything.
+        blockNumbers: Absolute block numbers (0-63), any order.
+        timeout: Seconds for the whole read (None = session default).
+        retry: Policy for blocks that failed to read (default blockRetry).
+        resume: Keep blocks of dump that are already S_OK, so a second tap
+                completes a partial read. Done only if the card in the field has
+                the UID of the dump, otherwise the dump is cleared first.
+        keyring: Find the key of each sector in the keyring (key is not used): keys derived
+                 from the UID, keys known for the card, then other candidates;
+                 the keyring learns which key opened which sector of the card.
+        priority: Sectors to read first, most important first; other sectors follow in ascending order.
+        budget: Seconds the card is expected to stay in the field (a short tap). A sector is
+                started only if its estimated read time fits into what is left of the budget;
+                otherwise the read stops cleanly, sectors not attempted are marked S_NOT_READ
+                and dump.status is S_TIMEOUT. A sector once started is read to its end (only
+                timeout limits it). The UID is taken by GET DATA, so the next tap
+                can resume even if sector 0 was not read.
+        result: Filled while reading (blocks read, resumed ones included, where the read
+                was aborted); final when the generator is exhausted or closed.
+
+    Yields:
+        (int, card_data.dumpMifare_1k.sector): sectors in reading order; sectors not
+        attempted after an abort or the end of the budget are not yielded.
+    """
+    session = do_comm.fnGetSession(connection)
+    retry   = retry or blockRetry
+    blocksBySector = {}
+    for nBlock in sorted(set(blockNumbers)):
+        blocksBySector.setdefault(nBlock // card_data.MIFARE_1K_blocks_per_sector, []).append(nBlock % card_data.MIFARE_1K_blocks_per_sector)
+    sectorNumbers = fnSectorOrder(list(blocksBySector), priority)
+    #budget is checked between sectors only: a sector under way is finished under the usual deadlines
+    budgetEnd = None if budget is None else time.perf_counter() + budget
+    result = result if result is not None else opResult(0)
+    result.nTotal = len(set(blockNumbers))
+    result.begin(session, timeout)
     try:
-        for iSector, sector in enumerate(dump.sectors):
+        resume = resume  and  fnBindCard(session, dump, key, keyring)
+        dump.status = card_data.status.S_NOINIT #forget abort status of an earlier tap
+        if keyring is not None  or  budget is not None: #keys are learned (or derived) per card, a short tap may miss sector 0
+            family, uid = fnCardIdentity(session, dump.UID if resume  and  len(dump.UID) != 0 else None)
+            if budget is not None  and  len(uid) != 0: #dump knows its card, so the next tap can resume
+                dump.UID = bytearray(uid)
+        for iPos, iSector in enumerate(sectorNumbers):
+            sector  = dump.sectors[iSector]
             nBlock0 = iSector * card_data.MIFARE_1K_blocks_per_sector
-            if not do_comm.fnLoadKey(connection, key.keyData):
-                sector.status = card_data.status.S_KEY_ERROR
-                totalFailCount += 1
+            nBlockThrowCard = nBlock0
+            blocksToRead = [iBlock for iBlock in blocksBySector[iSector]
+                            if not resume  or  sector.blocks[iBlock].status != card_data.status.S_OK]
+            nResumed = len(blocksBySector[iSector]) - len(blocksToRead)
+            result.nResumed += nResumed
+            result.nDone    += nResumed
+            if len(blocksToRead) == 0:
+                yield iSector, sector
+                continue
+            #blocks the access bits of a known trailer deny to both keys are not even tried
+            denied = [iBlock for iBlock in blocksToRead if fnIsDenied(sector.trailer, nBlock0 + iBlock, card_data.OP_READ)]
+            for iBlock in denied:
+                sector.blocks[iBlock].status = card_data.status.S_DENIED
+                blocksToRead.remove(iBlock)
+            if len(denied) != 0:
+                sector.status = card_data.status.S_DENIED
+                printFailBlocks(iSector, sector)
+            if len(blocksToRead) == 0:
+                yield iSector, sector
+                continue
+            if budgetEnd is not None  and  budgetEnd - time.perf_counter() < fnSectorReadCost(session.readerName, len(blocksToRead)):
+                result.nNotAttempted = len(blocksToRead) + sum(len(blocksBySector[n]) for n in sectorNumbers[iPos + 1:])
+                dump.status = card_data.status.S_TIMEOUT
+                markNotRead(dump, sectorNumbers[iPos:])
+                break
+            sectorKey = key if keyring is None else fnFindKey(session, keyring, family, uid, nBlock0)
+            if sectorKey is None:
+                sector.status = card_data.status.S_AUTH_ERROR
             else:
-                if not do_comm.fnSelectBlock(connection, nBlock0, key.keyType.value):
+                otherKey  = fnOtherKey(keyring, family, uid, iSector, sectorKey) if keyring is not None else None
+                blockKeys = {iBlock: fnSelectKey(sector.trailer, nBlock0 + iBlock, card_data.OP_READ, sectorKey, otherKey) for iBlock in blocksToRead}
+                #blocks only the other key type may read are not tried if no key of that type is at hand
+                for iBlock in [iBlock for iBlock in blocksToRead if blockKeys[iBlock] is None]:
+                    print(f"read of sector[{iSector}]:block[{iBlock}] {fnNotPermittedStr(sector.trailer, nBlock0 + iBlock, card_data.OP_READ)}")
+                    sector.blocks[iBlock].status = card_data.status.S_DENIED
+                    blocksToRead.remove(iBlock)
+                    denied.append(iBlock)
+                nKeySlot = session.loadKey(blockKeys[blocksToRead[0]].keyData) if len(blocksToRead) != 0 else -1
+                if len(blocksToRead) == 0:
+                    sector.status = card_data.status.S_DENIED
+                elif nKeySlot < 0:
+                    sector.status = card_data.status.S_KEY_ERROR
+                elif not session.selectBlock(nBlock0, blockKeys[blocksToRead[0]].keyType.value, nKeySlot):
                     sector.status = card_data.status.S_AUTH_ERROR
-                    totalFailCount += 1
                 else:
-                    failCount = 0
-                    sector.status = card_data.status.S_OK
-                    for iBlock, block in enumerate(sector.blocks):
-                        readOk, data = do_comm.fnReadBlock(connection, nBlock0 + iBlock)
+                    sector.status = card_data.status.S_OK if len(denied) == 0 else card_data.status.S_DENIED
+                    for iBlock in blocksToRead:
+                        block = sector.blocks[iBlock]
+                        nBlockThrowCard = nBlock0 + iBlock
+                        readOk, data = retry.call(session, lambda nBlock=nBlockThrowCard, blockKey=blockKeys[iBlock]: fnAuthRead(session, nBlock, blockKey))
                         if readOk:
                             block.data = data
                             block.status = card_data.status.S_OK
-                            totalBlocksRead += 1
+                            result.nDone += 1
                             if (iBlock + 1) == card_data.MIFARE_1K_blocks_per_sector:
                                 sector.trailer.processLastBlock(block.data)   
                         else:
-                            failCount += 1
-                            totalFailCount += 1
-                            block.status = card_data.status.S_READ_ERROR
-                    if failCount != 0:
-                        sector.status = card_data.status.S_READ_ERROR
+                            block.status  = card_data.status.S_READ_ERROR
+                            sector.status = card_data.status.S_READ_ERROR
+                            if session.isFatal:
+                                break
+                    if sector.status != card_data.status.S_OK  and  not session.isFatal:
                         printFailBlocks(iSector, sector)
-        dump.head.read(dump.sectors[0].blocks[0])
+            if iSector == 0:
+                dump.head.read(sector.blocks[0])
+            if session.isFatal:
+                result.abort(session.lastResult, nBlockThrowCard)
+                dump.status = statusFromResult(session.lastResult)
+                markNotRead(dump, sectorNumbers[iPos + 1:])
+            yield iSector, sector
+            if result.isAborted:
+                break
+    except do_comm.SessionDesync:
+        raise
     except Exception as e:
         dump.status = card_data.status.S_READ_ERROR
         print(f"dump error: {e}\n")
+    finally: #also when the consumer stops early: the operation deadline must not outlive the read
+        result.end()
+
+
+#read the given blocks of the card into dump and print the outcome (see fnReadBlocksIter)
+def fnReadBlocks(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, blockNumbers: list[int],
+                 timeout: float | None = None, retry: do_comm.retryPolicy | None = None, resume: bool = False,
+                 keyring: do_keys.keyRing | None = None, priority: list[int] | None = None, budget: float | None = None) -> opResult:
+    result = opResult(0)
+    for _ in fnReadBlocksIter(connection, dump, key, blockNumbers, timeout, retry, resume, keyring, priority, budget, result):
+        pass
+    print(f"read {result.toStr()}")
+    return result
+
+
+#read all card info (see fnReadBlocks)
+def fnRead(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, timeout: float | None = None,
+           retry: do_comm.retryPolicy = None, resume: bool = False, keyring: do_keys.keyRing = None,
+           priority: list[int] | None = None, budget: float | None = None) -> opResult:
+    nBlocks = len(dump.sectors) * card_data.MIFARE_1K_blocks_per_sector
+    return fnReadBlocks(connection, dump, key, range(nBlocks), timeout, retry, resume, keyring, priority, budget)
+
+
+#generator form of fnRead: yields (sector number, sector) as each sector is read (see fnReadBlocksIter)
+def fnReadIter(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, timeout: float | None = None,
+               retry: do_comm.retryPolicy = None, resume: bool = False, keyring: do_keys.keyRing = None,
+               priority: list[int] | None = None, budget: float | None = None, result: opResult | None = None):
+    nBlocks = len(dump.sectors) * card_data.MIFARE_1K_blocks_per_sector
+    yield from fnReadBlocksIter(connection, dump, key, range(nBlocks), timeout, retry, resume, keyring, priority, budget, result)
+
+
+#read only the given sectors (see fnReadBlocks)
+def fnReadSectors(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, sectorNumbers: list[int],
+                  timeout: float | None = None, retry: do_comm.retryPolicy | None = None, resume: bool = False,
+                  keyring: do_keys.keyRing | None = None, priority: list[int] | None = None, budget: float | None = None) -> opResult:
+    blockNumbers = [iSector * card_data.MIFARE_1K_blocks_per_sector + iBlock
+                    for iSector in sectorNumbers for iBlock in range(card_data.MIFARE_1K_blocks_per_sector)]
+    return fnReadBlocks(connection, dump, key, blockNumbers, timeout, retry, resume, keyring, priority, budget)
+
+
+#read sector 0, find sectors of the application in MAD and read only them: (opResult, application sectors)
+def fnReadApplication(connection: CardConnection, dump: card_data.dumpMifare_1k, aid: int = card_data.NDEF_AID,
+                      key: card_data.key | None = None, madKey: card_data.key | None = None, timeout: float | None = None,
+                      retry: do_comm.retryPolicy = None) -> (opResult, list[int]):
+    session = do_comm.fnGetSession(connection)
+    key     = key    or card_data.key(card_data.keyType.KT_A, card_data.NDEF_KEY_A)
+    madKey  = madKey or card_data.key(card_data.keyType.KT_A, card_data.MAD_KEY_A)
+    result  = opResult(0).begin(session, timeout) #one deadline for both reads
+    sectors = []
+    result.merge(fnReadSectors(session, dump, madKey, [0], retry=retry))
+    if not result.isAborted:
+        sectors = card_data.applicationSectors(card_data.decodeMAD(dump), aid)
+        if len(sectors) != 0:
+            result.merge(fnReadSectors(session, dump, key, sectors, retry=retry))
+    return result.end(), sectors
+
+
+############################################################################################################
+class lazyDump(card_data.dumpMifare_1k):
+    """
+    Dump that reads a sector from the card the first time it is accessed
+    by index (dump.sectors[n]), so callers pay only for sectors they use.
+
+    Reading needs a connected card: attach() a connection or session first
+    (the dump is cleared if a different card is in the field), detach() when
+    the card is gone. Detached, or when iterating over dump.sectors,
+    sectors are returned as they are.
+
+    Example:
+        dump = do_wr.lazyDump(connection, key)
+        card_data.printSector(5, dump.sectors[5])   #authenticates and reads sector 5 only
+    """
+    class lazySectors(list):
+        def __init__(self, dump: "lazyDump", sectors: list):
+            super().__init__(sectors)
+            self.dump = dump
+
+        def __getitem__(self, index):
+            if isinstance(index, int)  and  -len(self) <= index < len(self): #out of range raises IndexError without reading
+                self.dump.fetch(index % len(self))
+            return super().__getitem__(index)
+
+    def __init__(self, connection: CardConnection = None, key: card_data.key = None):
+        super().__init__()
+        self.sectors  = lazyDump.lazySectors(self, self.sectors)
+        self.key      = key or card_data.key()
+        self.session  = None
+        self.fetching = False
+        if connection is not None:
+            self.attach(connection)
+
+    def attach(self, connection: CardConnection, key: card_data.key = None) -> None:
+        self.session = do_comm.fnGetSession(connection)
+        self.key     = key or self.key
+        self.fetching = True #binding looks at block 0 held by the dump, it is not read from the card for that
+        try:
+            fnBindCard(self.session, self, self.key)
+        finally:
+            self.fetching = False
+
+    def detach(self) -> None:
+        self.session = None
+
+    def fetch(self, nSector: int) -> None:
+        if self.session is None  or  self.fetching:
+            return
+        if list.__getitem__(self.sectors, nSector).status not in (card_data.status.S_NOINIT, card_data.status.S_NOT_READ):
+            return
+        self.fetching = True #reads below index dump.sectors too
+        try:
+            fnReadSectors(self.session, self, self.key, [nSector])
+        finally:
+            self.fetching = False
+
+
+############################################################################################################
+#read only UID (and ATS historical bytes if asked) with GET DATA: no key, no authentication, one APDU
+def fnReadUID(connection: CardConnection, dump: card_data.dumpMifare_1k, withATS: bool = False, timeout: float | None = None) -> opResult:
+    session = do_comm.fnGetSession(connection)
+    result  = opResult(1).begin(session, timeout)
+    readOk, uid = session.getData(do_comm.GET_DATA_UID)
+    if readOk:
+        dump.UID      = bytearray(uid)
+        dump.head.UID = bytearray(uid)
+        result.nDone += 1
+        if withATS: #ISO 14443-3 cards (MIFARE Classic) have no ATS, that is not an error
+            atsOk, ats = session.getData(do_comm.GET_DATA_ATS)
+            dump.ATS = bytearray(ats) if atsOk else bytearray(0)
+    elif session.isFatal:
+        result.abort(session.lastResult, 0)
+        dump.status = statusFromResult(session.lastResult)
+    return result.end()
+
+
+############################################################################################################
+#change of a watched block: wall clock time, block number, old content (None for the first sample), new content,
+#changed bytes as (offset, old byte, new byte)
+blockChange = namedtuple("blockChange", ["time", "nBlock", "old", "new", "diff"])
+
+
+def fnBlockDiff(old: bytes, new: bytes) -> list[tuple]:
+    return [(i, a, b) for i, (a, b) in enumerate(zip(old, new)) if a != b]
+
+
+def fnChangeToStr(change: blockChange) -> str:
+    nSector, nBlock = divmod(change.nBlock, card_data.MIFARE_1K_blocks_per_sector)
+    stamp = time.strftime("%H:%M:%S", time.localtime(change.time)) + f".{int(change.time * 1000) % 1000:03d}"
+    if change.old is None:
+        return f"{stamp} sector[{nSector}]:block[{nBlock}] {card_data.bytes2str(change.new)}"
+    diff = " ".join(f"+{offset}:{a:02X}->{b:02X}" for offset, a, b in change.diff)
+    return f"{stamp} sector[{nSector}]:block[{nBlock}] {diff}"
+
+
+def fnWatch(connection: CardConnection, key: card_data.key, blockNumbers: list[int], rate: float = 20.0,
+            duration: float | None = None, keyring: do_keys.keyRing | None = None, result: opResult | None = None):
+    """
+    Read the given blocks again and again in one session and report only what changed.
+
+    Blocks are read in sector order, so each sample authenticates once per sector
+    (the session skips LOAD KEY and AUTH while a sector stays authenticated); the
+    key of each sector is found once. Samples start at the target rate as long
+    as a sample (and the consumer) takes less than the period. A failed read is tried again in the
+    next sample (the session re-activates the halted card). The watch has no operation
+    deadline, every command keeps the APDU timeout of the session.
+
+    Args:
+        connection: Active card connection or CardSession.
+        key: Key for every sector (not used with keyring).
+        blockNumbers: Absolute block numbers (0-63) to watch, at least one.
+        rate: Samples per second, more than 0.
+        duration: Seconds to watch (None = until the card is lost or the consumer stops).
+        keyring: Find the key of each sector in the keyring, once per watch.
+        result: Filled while watching: block reads done out of tried, re-activations,
+                retries and where the watch stopped.
+
+    Returns:
+        Iterator of blockChange: content of every block at the first sample (old is None),
+        then one event per block whose bytes changed, with the changed bytes.
+
+    Raises:
+        ValueError: rate is not positive or blockNumbers is empty (at the call, not at the first sample).
+    """
+    if not rate > 0:
+        raise ValueError(f"rate must be positive: {rate}")
+    if len(blockNumbers) == 0:
+        raise ValueError("no blocks to watch")
+    return fnWatchBlocks(do_comm.fnGetSession(connection), key, sorted(set(blockNumbers)), 1.0 / rate, duration, keyring,
+                         result if result is not None else opResult(0))
+
+
+#samples of fnWatch (arguments checked there); result counts the whole watch, also when the consumer stops early
+def fnWatchBlocks(session: do_comm.CardSession, key: card_data.key, blocks: list[int], period: float, duration: float,
+                  keyring: do_keys.keyRing, result: opResult):
+    keys     = {}    #sector -> key that opened it
+    last     = {}    #block -> content of the last successful read
+    result.begin(session, withDeadline=False)
+    try:
+        if keyring is not None:
+            family, uid = fnCardIdentity(session)
+        timeStart = nextSample = time.perf_counter()
+        while duration is None  or  time.perf_counter() - timeStart < duration:
+            for nBlockThrowCard in blocks:
+                nSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
+                if nSector not in keys:
+                    nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
+                    keys[nSector] = fnFindKey(session, keyring, family, uid, nBlock0) if keyring is not None else key
+                result.nTotal += 1
+                readOk, data = fnAuthRead(session, nBlockThrowCard, keys[nSector]) if keys[nSector] is not None else (False, None)
+                if readOk:
+                    result.nDone += 1
+                    data = bytes(data)
+                    old  = last.get(nBlockThrowCard)
+                    if old != data:
+                        last[nBlockThrowCard] = data
+                        yield blockChange(time.time(), nBlockThrowCard, old, data, fnBlockDiff(old, data) if old is not None else [])
+                elif session.isFatal:
+                    result.abort(session.lastResult, nBlockThrowCard)
+                    return
+            #a sample that took longer than the period (or a slow consumer) shifts the schedule, no catch-up bursts
+            nextSample = max(nextSample + period, time.perf_counter())
+            time.sleep(max(0.0, nextSample - time.perf_counter()))
+    finally:
+        result.end()
+
+
+############################################################################################################
+#Value blocks: each operation is one authentication and one card command (the card computes and transfers
+#the result itself), so a counter is never left half written if the card is pulled away
+def fnValueOperation(connection: CardConnection, nBlockThrowCard: int, nOperation: int, amount: int, key: card_data.key,
+                     timeout: float | None = None) -> opResult:
+    """
+    Store, increment or decrement a value block.
+
+    Args:
+        connection: Active card connection or do_comm.CardSession.
+        nBlockThrowCard: Data block (not block 0, not a trailer) formatted as value block
+                         (except for VB_STORE, which formats it).
+        nOperation: do_comm.VB_STORE, VB_INCREMENT or VB_DECREMENT.
+        amount: New value for VB_STORE, non-negative amount otherwise.
+        key: Key with the right for the operation (access bits of the block).
+
+    Returns:
+        opResult: 1/1 if the card accepted the operation.
+    """
+    if not fnIsDataBlock(nBlockThrowCard)  or  nBlockThrowCard >= card_data.MIFARE_1K_total_sectors * card_data.MIFARE_1K_blocks_per_sector:
+        print(f"block {nBlockThrowCard} can not hold a value")
+        return opResult(0)
+    if not card_data.VALUE_MIN <= amount <= card_data.VALUE_MAX  or  (nOperation != do_comm.VB_STORE  and  amount < 0):
+        print(f"amount {amount} is not valid")
+        return opResult(0)
+    session = do_comm.fnGetSession(connection)
+    result  = opResult(1).begin(session, timeout)
+    nBlock0 = nBlockThrowCard - nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+    if session.authenticate(nBlock0, key.keyType.value, key.keyData)  and  session.valueOperation(nBlockThrowCard, nOperation, amount):
+        result.nDone += 1
+    if session.isFatal:
+        result.abort(session.lastResult, nBlockThrowCard)
+    return result.end()
+
+
+#format block as value block holding value
+def fnFormatValue(connection: CardConnection, nBlockThrowCard: int, value: int, key: card_data.key, timeout: float | None = None) -> opResult:
+    return fnValueOperation(connection, nBlockThrowCard, do_comm.VB_STORE, value, key, timeout)
+
+
+def fnIncrement(connection: CardConnection, nBlockThrowCard: int, amount: int, key: card_data.key, timeout: float | None = None) -> opResult:
+    return fnValueOperation(connection, nBlockThrowCard, do_comm.VB_INCREMENT, amount, key, timeout)
+
+
+def fnDecrement(connection: CardConnection, nBlockThrowCard: int, amount: int, key: card_data.key, timeout: float | None = None) -> opResult:
+    return fnValueOperation(connection, nBlockThrowCard, do_comm.VB_DECREMENT, amount, key, timeout)
+
+
+#copy value block into another block of the same sector (restore + transfer), e.g. from its backup
+def fnRestoreValue(connection: CardConnection, nSourceBlock: int, nTargetBlock: int, key: card_data.key, timeout: float | None = None) -> opResult:
+    nBlock0 = nSourceBlock - nSourceBlock % card_data.MIFARE_1K_blocks_per_sector
+    if nTargetBlock - nTargetBlock % card_data.MIFARE_1K_blocks_per_sector != nBlock0  or  not fnIsDataBlock(nSourceBlock)  or  not fnIsDataBlock(nTargetBlock):
+        print(f"restore works between data blocks of one sector: {nSourceBlock} -> {nTargetBlock}")
+        return opResult(0)
+    session = do_comm.fnGetSession(connection)
+    result  = opResult(1).begin(session, timeout)
+    if session.authenticate(nBlock0, key.keyType.value, key.keyData)  and  session.restoreValue(nSourceBlock, nTargetBlock):
+        result.nDone += 1
+    if session.isFatal:
+        result.abort(session.lastResult, nSourceBlock)
+    return result.end()
 
-    print(f"read {totalBlocksRead}/{totalBlocksToRead})")
-    return totalBlocksRead == len(dump.sectors) * len(dump.sectors[0].blocks)
+
+#value of a value block: (opResult, value); value is None if the block is not readable or not a value block
+def fnReadValue(connection: CardConnection, nBlockThrowCard: int, key: card_data.key, timeout: float | None = None) -> (opResult, int):
+    session = do_comm.fnGetSession(connection)
+    result  = opResult(1).begin(session, timeout)
+    nBlock0 = nBlockThrowCard - nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+    value   = None
+    if session.authenticate(nBlock0, key.keyType.value, key.keyData):
+        readOk, value = session.readValue(nBlockThrowCard)
+        result.nDone += readOk
+    if session.isFatal:
+        result.abort(session.lastResult, nBlockThrowCard)
+    return result.end(), value
+
+
+############################################################################################################
+#full dump as a single prebuilt script, cached per key
+dumpScripts: dict = {}
+
+def fnDumpScript(key: card_data.key) -> do_comm.ApduScript:
+    cacheKey = (key.keyType.value, bytes(key.keyData))
+    script = dumpScripts.get(cacheKey)
+    if script is None:
+        script = do_comm.ApduScript().loadKey(key.keyData)
+        for iSector in range(card_data.MIFARE_1K_total_sectors):
+            nBlock0 = iSector * card_data.MIFARE_1K_blocks_per_sector
+            script.authenticate(nBlock0, key.keyType.value).readBlocks(nBlock0, card_data.MIFARE_1K_blocks_per_sector)
+        dumpScripts[cacheKey] = script
+    return script
+
+
+#read all card info in one batch (no per-APDU output); same result as fnRead: the halted card is
+#re-activated after any failed command, a sector whose key is refused is skipped, a block that
+#failed to read is left out and the sector is authenticated again for the blocks after it
+def fnReadBatch(connection: CardConnection, dump: card_data.dumpMifare_1k, key: card_data.key, stopOnFail: bool = False,
+                timeout: float = do_comm.TIMEOUT_OPERATION) -> opResult:
+    script = do_comm.fnRunScript(connection, fnDumpScript(key), stopOnFail, do_comm.TIMEOUT_APDU, timeout, reactivate=True)
+    result = opResult(len(dump.sectors) * card_data.MIFARE_1K_blocks_per_sector)
+    authSectors = set()
+    for step in script.steps:
+        nSector = step.nBlock // card_data.MIFARE_1K_blocks_per_sector
+        match step.name:
+            case "REACTIVATE":
+                result.nReactivations += 1
+            case "LOAD KEY":
+                if not step.isOk:
+                    for sector in dump.sectors:
+                        sector.status = card_data.status.S_KEY_ERROR
+            case "AUTH":
+                #AUTH sent again after a failed READ keeps the S_READ_ERROR of the sector
+                if nSector not in authSectors:
+                    dump.sectors[nSector].status = card_data.status.S_OK if step.isOk else card_data.status.S_AUTH_ERROR
+                authSectors.add(nSector)
+            case "READ":
+                sector = dump.sectors[nSector]
+                nBlock = step.nBlock % card_data.MIFARE_1K_blocks_per_sector
+                block  = sector.blocks[nBlock]
+                if step.isOk:
+                    block.data   = step.data
+                    block.status = card_data.status.S_OK
+                    result.nDone += 1
+                    if (nBlock + 1) == card_data.MIFARE_1K_blocks_per_sector:
+                        sector.trailer.processLastBlock(block.data)
+                else:
+                    block.status = card_data.status.S_READ_ERROR
+                    if sector.status == card_data.status.S_OK:
+                        sector.status = card_data.status.S_READ_ERROR
+    if script.stopReason.isFatal:
+        lastStep = script.steps[-1]
+        result.abort(script.stopReason, max(lastStep.nBlock, 0))
+        dump.status = statusFromResult(script.stopReason)
+        markNotRead(dump, range(result.stopSector + 1, len(dump.sectors)))
+    else:
+        for iSector, sector in enumerate(dump.sectors):
+            if sector.status == card_data.status.S_READ_ERROR:
+                printFailBlocks(iSector, sector)
+    dump.head.read(dump.sectors[0].blocks[0])
+    print(f"read {result.toStr()}")
+    return result
 
 
 ############################################################################################################
@@ -65,7 +786,7 @@ def fnWriteBlock(nSector: int, nBlock: int, blockData: list[bytes], key: list[by
         request = CardRequest(timeout=10)
         service = request.waitforcard()
         connection = service.connection
-        connection.connect(mode=smartcard.scard.SCARD_SHARE_EXCLUSIVE, disposition=smartcard.scard.SCARD_UNPOWER_CARD)        
+        connection.connect(mode=do_comm.SCARD_SHARE_EXCLUSIVE, disposition=do_comm.SCARD_UNPOWER_CARD)        
         try:
             if do_comm.fnLoadKey(connection, key):
                 nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
@@ -83,72 +804,344 @@ def fnWriteBlock(nSector: int, nBlock: int, blockData: list[bytes], key: list[by
 def fnWriteBlockStr(nSector: int, nBlock: int, blockDataStr: str, key: list[bytes]) -> bool:
     return fnWriteBlock(nSector, nBlock, list(blockDataStr.encode()), key)
 
+############################################################################################################
+#data blocks of one sector written under one authentication: (absolute block number, offset of its data in the payload)
+writeStep = namedtuple("writeStep", ["nSector", "blocks"])
+
+#block 0 (manufacturer data) and sector trailers (keys, access bits) are never written by a payload
+def fnIsDataBlock(nBlockThrowCard: int) -> bool:
+    return nBlockThrowCard > 0  and  nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector != card_data.MIFARE_1K_blocks_per_sector - 1
+
+
+class writePlan:
+    """
+    Payload mapped onto data blocks of the card, grouped by sector.
+
+    Knows the cost before anything is sent: APDU count (one LOAD KEY, one
+    AUTH per sector, one UPDATE per block) and the duration estimated from
+    measured latencies of the reader (do_stats.avgTime).
+    """
+    def __init__(self, nStartBlock: int):
+        self.nStartBlock = nStartBlock
+        self.steps       = []    #writeStep per sector, in card order
+        self.nBlocks     = 0     #blocks to write
+        self.nUnchanged  = 0     #blocks dropped: card already holds the data
+        self.nUnplaced   = 0     #payload blocks beyond the last data block of the card
+
+    def add(self, nBlockThrowCard: int, offset: int) -> None:
+        nSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
+        if len(self.steps) == 0  or  self.steps[-1].nSector != nSector:
+            self.steps.append(writeStep(nSector, []))
+        self.steps[-1].blocks.append((nBlockThrowCard, offset))
+        self.nBlocks += 1
+
+    @property
+    def blockNumbers(self) -> list[int]:
+        return [nBlock for step in self.steps for nBlock, _ in step.blocks]
+
+    @property
+    def nApdu(self) -> int:
+        return (1 if self.nBlocks != 0 else 0) + len(self.steps) + self.nBlocks
+
+    def estimate(self, readerName: str | None = None) -> float:
+        avgTime = do_stats.stats.avgTime
+        return ((avgTime(readerName, do_comm.APDU_LOAD_KEY[1]) if self.nBlocks != 0 else 0.0)
+                + len(self.steps) * avgTime(readerName, do_comm.APDU_AUTH[1])
+                + self.nBlocks    * avgTime(readerName, do_comm.APDU_WRITE[1]))
+
+    def toStr(self, readerName: str | None = None) -> str:
+        Result = f"{self.nBlocks} blocks in {len(self.steps)} sectors, {self.nApdu} APDUs, ~{self.estimate(readerName) * 1000:.0f} ms"
+        if self.nUnchanged != 0:
+            Result += f", unchanged: {self.nUnchanged}"
+        if self.nUnplaced != 0:
+            Result += f", does not fit: {self.nUnplaced} blocks"
+        return Result
+
+
+def fnPlanWrite(writeData: do_prompt.PromptAnswer_ForWrite, baseline: card_data.dumpMifare_1k = None) -> writePlan:
+    """
+    Map the payload onto consecutive data blocks starting at the address of
+    writeData, stepping over block 0 and sector trailers.
+
+    Args:
+        writeData: Payload (multiple of block size) and its start address.
+        baseline: Card content; blocks it holds (S_OK) with the same data are
+                  left out of the plan.
+
+    Returns:
+        writePlan: nUnplaced != 0 if the payload is longer than the rest of the card.
+    """
+    nBlockSize  = card_data.MIFARE_1K_bytes_per_block
+    nCardBlocks = card_data.MIFARE_1K_total_sectors * card_data.MIFARE_1K_blocks_per_sector
+    nStartBlock = 0
+    match writeData.address:
+        case do_prompt.writeAddress.A_BLOCK :
+            nStartBlock = writeData.nSector * card_data.MIFARE_1K_blocks_per_sector + writeData.nBlock
+        case do_prompt.writeAddress.A_SECTOR:
+            nStartBlock = writeData.nSector * card_data.MIFARE_1K_blocks_per_sector
+    plan     = writePlan(nStartBlock)
+    payload  = memoryview(writeData.data)
+    nPayload = len(payload) // nBlockSize
+    nBlock   = nStartBlock
+    for i in range(nPayload):
+        while nBlock < nCardBlocks  and  not fnIsDataBlock(nBlock):
+            nBlock += 1
+        if nBlock >= nCardBlocks:
+            plan.nUnplaced = nPayload - i
+            break
+        cached = baseline.blockAt(nBlock) if baseline is not None else None
+        if cached is not None  and  cached.status == card_data.status.S_OK  and  payload[i * nBlockSize:(i + 1) * nBlockSize] == bytes(cached.data):
+            plan.nUnchanged += 1
+        else:
+            plan.add(nBlock, i * nBlockSize)
+        nBlock += 1
+    return plan
+
+
+#load key and authenticate to the sector of the block (skipped by session if already done), then write the block
+def fnAuthWrite(session: do_comm.CardSession, nBlockThrowCard: int, key: card_data.key, blockData) -> bool:
+    nBlock0 = nBlockThrowCard - nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
+    return session.authenticate(nBlock0, key.keyType.value, key.keyData)  and  session.writeBlock(nBlockThrowCard, blockData)
+
+
+#read blocks of one sector back right after writing them (authentication of the writes is still valid) and
+#compare with their data; mismatched blocks are written and read again up to nRetries times. Results go to result.verified
+def fnVerifySector(session: do_comm.CardSession, key: card_data.key, blocks: list[tuple], nRetries: int, result: opResult,
+                   trailer: card_data.dumpMifare_1k.trailer = None, otherKey: card_data.key = None) -> None:
+    pending = blocks
+    for nAttempt in range(nRetries + 1):
+        mismatched = []
+        for nBlockThrowCard, blockData in pending:
+            #after a failed command the card is halted: the session re-activates it, authentication is repeated
+            if nAttempt != 0  and  not fnAuthWrite(session, nBlockThrowCard, fnSelectKey(trailer, nBlockThrowCard, card_data.OP_WRITE, key, otherKey) or key, blockData):
+                mismatched.append((nBlockThrowCard, blockData))
+            else:
+                readOk, readData = fnAuthRead(session, nBlockThrowCard, fnSelectKey(trailer, nBlockThrowCard, card_data.OP_READ, key, otherKey) or key)
+                isOk = readOk  and  blockData == bytes(readData)
+                result.verified[nBlockThrowCard] = isOk
+                isOk or mismatched.append((nBlockThrowCard, blockData))
+            if session.isFatal:
+                return
+        if len(mismatched) == 0:
+            return
+        result.nRewrites += len(mismatched) if nAttempt < nRetries else 0
+        pending = mismatched
+
+
 #==============================================================================================
-def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWrite, key:card_data.key) -> bool:
+def fnWrite(connection: CardConnection, writeData: do_prompt.PromptAnswer_ForWrite, key:card_data.key, timeout: float | None = None,
+            incremental: bool = False, baseline: card_data.dumpMifare_1k = None,
+            verify: bool = False, verifyRetries: int = 2, keyring: do_keys.keyRing = None,
+            refresh: bool = False) -> opResult:
     """
     Write data to a MIFARE 1K card.
     
-    This function writes data blocks to the card, handling sector authentication
-    automatically when entering a new sector. The starting block is determined
-    based on the address type specified in writeData.
+    The payload is planned first (fnPlanWrite): it goes to data blocks only,
+    block 0 and sector trailers are stepped over, and each sector is
+    authenticated once. The plan with its APDU count and estimated duration
+    is printed before anything is written. A payload longer than the rest of
+    the card is refused as a whole.
     
     Args:
-        writeData: Contains the data to write, address type (block/sector), and
+        connection: Active card connection or do_comm.CardSession (to share key/auth cache).
+        writeData: Contains the data to write, address type (block/sector/entire card), and
                    sector/block numbers indicating where to start writing.
         key: Authentication key object containing key data and key type (A/B).
+        timeout: Deadline for the whole write in seconds (None = session operationTimeout).
+        incremental: Write only blocks whose card content differs from the data.
+                     Content is taken from baseline; blocks it does not hold
+                     are read from the card first (reads are faster than writes
+                     and do not wear EEPROM).
+        baseline: Dump of the card (cached from an earlier read/write). Used if it
+                  belongs to the card in the field (same UID), otherwise it is
+                  cleared. Written blocks are stored into it, so it stays in sync.
+                  Access bits of its trailers choose key A or B for each block;
+                  blocks no key may write are refused without sending anything.
+        verify: Read each sector's written blocks back under the same authentication
+                and compare them with the data; a block counts as done only if it matches.
+        verifyRetries: Times a mismatched (or unreadable) block is written and read again.
+        keyring: Find the key of each sector in the keyring once the UID is known (keys
+                 derived from the UID first); key is used for sectors it has no key for.
+        refresh: With incremental, read all target blocks from the card, also those
+                 baseline holds: a dump of an earlier tap does not see changes made
+                 to the card since, and a changed block would be skipped as unchanged.
     
     Returns:
-        bool: True if the write operation was successful, False otherwise.
+        opResult: blocks written (or found unchanged) out of requested (True if all were),
+                  per-block read-back results in verified (verify mode);
+                  stops at once if the card or reader is lost or the deadline passed.
     """
     # Validate data length - must be a multiple of block size (16 bytes)
+    nBlockSize = card_data.MIFARE_1K_bytes_per_block
     dataLen = len(writeData.data)
-    if dataLen == 0  or  dataLen % card_data.MIFARE_1K_bytes_per_block != 0:
-        print(f"Data length {dataLen} is not valid - must be multiple of {card_data.MIFARE_1K_bytes_per_block}")
-        return False
+    if dataLen == 0  or  dataLen % nBlockSize != 0:
+        print(f"Data length {dataLen} is not valid - must be multiple of {nBlockSize}")
+        return opResult(0)
     
-    # Determine starting block based on address type
-    # For A_BLOCK: start at specific block within sector
-    # For A_SECTOR: start at first block of the sector
-    nStartBlock = 1 #otherwise - first writable block of first sector
-    match writeData.address:
-        case do_prompt.writeAddress.A_BLOCK :
-            nStartBlock = writeData.nSector * card_data.MIFARE_1K_blocks_per_sector + writeData.nBlock
-        case do_prompt.writeAddress.A_SECTOR:
-            #first block of first sector is special
-            if writeData.nSector != 0:
-                nStartBlock = writeData.nSector * card_data.MIFARE_1K_blocks_per_sector
+    session = do_comm.fnGetSession(connection)
+    plan    = fnPlanWrite(writeData)
+    result  = opResult(dataLen // nBlockSize)
+    if plan.nUnplaced != 0:
+        print(f"write refused: {plan.toStr(session.readerName)}")
+        return result
+    
+    result.begin(session, timeout)
     try:
-        # absolute block number from start of card
-        startNewSector = True # Track if we're entering a new sector (requires authentication)
-        totalBlocksToWrite = dataLen // card_data.MIFARE_1K_bytes_per_block 
-        totalBlockWritten = 0
-        # Write each block of data
-        for i in range(totalBlocksToWrite):
-            # Calculate absolute block number across entire card
-            nBlockThrowCard = nStartBlock + i
-            # Calculate which sector this block belongs to
-            nSector = nBlockThrowCard // card_data.MIFARE_1K_blocks_per_sector
-            # Calculate block number within the sector (0-3)
-            nBlockInsideSector = nBlockThrowCard % card_data.MIFARE_1K_blocks_per_sector
-            # If we're continuing in the same sector, no need to re-authenticate
-            isOk = not startNewSector
-            # If entering a new sector, authenticate with the key
-            if startNewSector:
-                # Get first block of the sector (block 0 of the sector)
-                nBlock0 = nSector * card_data.MIFARE_1K_blocks_per_sector
-                # Load key and authenticate to the sector
-                isOk = do_comm.fnLoadKey(connection, key.keyData) and do_comm.fnSelectBlock(connection, nBlock0, key.keyType.value)
-            # If authentication succeeded (or not needed), write the block
-            if isOk:
-                # Extract and write block data from the write buffer with convertation to list of bytes
-                blockDataSlice = list[bytes](writeData.data[i * card_data.MIFARE_1K_bytes_per_block:(i + 1) * card_data.MIFARE_1K_bytes_per_block])
-                # Write the block to the card
-                if do_comm.fnWriteBlock(connection, nBlockThrowCard, (blockDataSlice)):
-                    totalBlockWritten += 1
-                    print(f"Successfully wrote sector[{nSector}]:block[{nBlockInsideSector}] <-- {do_comm.bytes2str(blockDataSlice)}") 
-            # Check if next iteration will be in a new sector (if current block is last in sector)
-            startNewSector = nBlockInsideSector == (card_data.MIFARE_1K_blocks_per_sector - 1)
+        if incremental  or  baseline is not None:
+            baseline = card_data.dumpMifare_1k() if baseline is None else baseline
+            fnBindCard(session, baseline, key, keyring)
+        if keyring is not None:
+            family, uid = fnCardIdentity(session, baseline.UID if baseline is not None  and  len(baseline.UID) != 0 else None)
+        if incremental:
+            # Current content of target blocks not in baseline yet, then plan again without unchanged blocks
+            blocksToRead = [nBlock for nBlock in plan.blockNumbers if refresh  or  baseline.blockAt(nBlock).status != card_data.status.S_OK]
+            if len(blocksToRead) != 0:
+                fnReadBlocks(session, baseline, key, blocksToRead, keyring=keyring)
+            if session.isFatal:
+                result.abort(session.lastResult, plan.nStartBlock)
+            plan = fnPlanWrite(writeData, baseline)
+            result.nSkipped = plan.nUnchanged
+            result.nDone    = plan.nUnchanged
+        if not result.isAborted:
+            print(f"write plan: {plan.toStr(session.readerName)}")
+        # Write sector by sector, block data is a view into the payload (no copies)
+        payload = memoryview(writeData.data)
+        for step in (plan.steps if not result.isAborted else []):
+            nBlock0 = step.nSector * card_data.MIFARE_1K_blocks_per_sector
+            trailer = baseline.sectors[step.nSector].trailer if baseline is not None else None
+            stepKey = (fnFindKey(session, keyring, family, uid, nBlock0) if keyring is not None else None) or key
+            otherKey = fnOtherKey(keyring, family, uid, step.nSector, stepKey) if keyring is not None else None
+            written = []
+            refused = []
+            if stepKey is None:
+                print(f"no key for sector[{step.nSector}]")
+            for nBlockThrowCard, offset in (step.blocks if stepKey is not None else []):
+                blockData = payload[offset:offset + nBlockSize]
+                # Key A or B as access bits of the known trailer allow; a write the card would reject is not sent
+                blockKey = fnSelectKey(trailer, nBlockThrowCard, card_data.OP_WRITE, stepKey, otherKey)
+                if blockKey is None:
+                    refused.append(nBlockThrowCard)
+                    print(f"write to sector[{step.nSector}]:block[{nBlockThrowCard - nBlock0}] {fnNotPermittedStr(trailer, nBlockThrowCard, card_data.OP_WRITE)}")
+                # Load key and authenticate to the sector (skipped by session while it stays authenticated)
+                elif fnAuthWrite(session, nBlockThrowCard, blockKey, blockData):
+                    written.append(nBlockThrowCard)
+                    print(f"Successfully wrote sector[{step.nSector}]:block[{nBlockThrowCard - nBlock0}] <-- {do_comm.bytes2str(blockData)}")
+                elif session.isFatal:
+                    break
+            result.nRefused += len(refused)
+            if verify  and  stepKey is not None  and  not session.isFatal:
+                #blocks that failed to write are read too: the card may hold the data already, otherwise they are rewritten
+                fnVerifySector(session, stepKey, [(n, payload[offset:offset + nBlockSize]) for n, offset in step.blocks if n not in refused],
+                               verifyRetries, result, trailer, otherKey)
+            for nBlockThrowCard, offset in step.blocks:
+                isOk = result.verified.get(nBlockThrowCard, False) if verify else nBlockThrowCard in written
+                result.nDone += isOk
+                cached = baseline.blockAt(nBlockThrowCard) if baseline is not None else None
+                if cached is not None  and  nBlockThrowCard not in refused:
+                    if isOk:
+                        cached.data   = bytearray(payload[offset:offset + nBlockSize])
+                        cached.status = card_data.status.S_OK
+                    else:
+                        cached.status = card_data.status.S_WRITE_ERROR #content unknown now
+            # No card or no reader - remaining blocks are doomed
+            if session.isFatal:
+                result.abort(session.lastResult, nBlock0)
+                break
+        if result.nSkipped != 0:
+            result.savedTime = result.nSkipped * do_stats.stats.avgTime(session.readerName, do_comm.APDU_WRITE[1])
+    except do_comm.SessionDesync:
+        raise
     except Exception as e:
         sys.stdout.write(f"Error writing block: {e}")
 
-    return totalBlocksToWrite == totalBlockWritten
+    result.end()
+    if not result.isOk  or  result.nSkipped != 0  or  verify:
+        print(f"write {result.toStr()}")
+    return result
+
+
+############################################################################################################
+class rekeyJob:
+    """
+    Key rotation of many cards: the new sector trailer (keys, access bits, GPB)
+    is built and checked once per job, so each card costs only the commands
+    on air (see fnRekey).
+
+    Example:
+        accessBits = card_data.accessBitsFromRules("R(A,B) W(B) I(-) D(-)", "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)")
+        job = rekeyJob(card_data.key(), newKeyA, newKeyB, accessBits)
+        for every tapped card: do_wr.fnRekey(connection, job)
+    """
+    def __init__(self, oldKey: card_data.key, newKeyA: list[bytes], newKeyB: list[bytes], accessBits: list[bytes],
+                 sectors: list[int] | None = None, GPB: int = 0x69):
+        trailer = card_data.buildTrailer(newKeyA, accessBits, newKeyB, GPB)
+        sectors = range(card_data.MIFARE_1K_total_sectors) if sectors is None else sectors
+        self.oldKey   = oldKey                                            #key that may write the trailers now
+        self.newKey   = card_data.key(card_data.keyType.KT_A, list(newKeyA)) #new key A: authenticates whatever the access bits are
+        self.trailers = {nSector: trailer for nSector in sorted(set(sectors))}
+        #part of the trailer key A reads back: access bits and GPB, key B too where it stays readable
+        keyBVisible   = card_data.accessConditions(accessBits)[3] in card_data.keyBReadable
+        self.checked  = trailer[6:16] if keyBVisible else trailer[6:10]
+
+    @staticmethod
+    def trailerBlock(nSector: int) -> int:
+        return (nSector + 1) * card_data.MIFARE_1K_blocks_per_sector - 1
+
+    #estimated seconds per card: keys loaded once, per sector auth with the old key, write, auth with the new key, read
+    def estimate(self, readerName: str | None = None) -> float:
+        avgTime = do_stats.stats.avgTime
+        return (2 * avgTime(readerName, do_comm.APDU_LOAD_KEY[1])
+                + len(self.trailers) * (2 * avgTime(readerName, do_comm.APDU_AUTH[1])
+                                        + avgTime(readerName, do_comm.APDU_WRITE[1]) + avgTime(readerName, do_comm.APDU_READ[1])))
+
+    def toStr(self, readerName: str | None = None) -> str:
+        return f"{len(self.trailers)} trailers, old key {self.oldKey.toStr()}, new key {self.newKey.toStr()}, ~{self.estimate(readerName) * 1000:.0f} ms"
+
+
+#authenticate with the new key A and read the trailer back: True if the card holds the trailer of the job
+def fnCheckTrailer(session: do_comm.CardSession, job: rekeyJob, nSector: int) -> bool:
+    readOk, data = fnAuthRead(session, job.trailerBlock(nSector), job.newKey)
+    return readOk  and  bytes(data)[6:6 + len(job.checked)] == job.checked
+
+
+def fnRekey(connection: CardConnection, job: rekeyJob, timeout: float | None = None) -> opResult:
+    """
+    Write the trailers of the job to the card in one session: authenticate with
+    the old key, write the trailer, then authenticate with the new key and read
+    the trailer back. A sector the old key does not open is checked with the new
+    key, so a card cut off in an earlier tap is finished, not failed.
+
+    Args:
+        connection: Active card connection or do_comm.CardSession.
+        job: Trailers and keys (rekeyJob), shared by all cards.
+        timeout: Deadline for the card in seconds (None = session operationTimeout).
+
+    Returns:
+        opResult: sectors with the new trailer (True if all), checks of written
+                  trailers in verified, sectors found rekeyed already in nResumed;
+                  stops at once if the card or reader is lost or the deadline passed.
+    """
+    session = do_comm.fnGetSession(connection)
+    result  = opResult(len(job.trailers)).begin(session, timeout)
+    try:
+        for nSector, trailer in job.trailers.items():
+            nBlockThrowCard = job.trailerBlock(nSector)
+            if fnAuthWrite(session, nBlockThrowCard, job.oldKey, trailer):
+                isOk = result.verified[nBlockThrowCard] = fnCheckTrailer(session, job, nSector)
+            else:
+                #old key rejected: the card halted, the session re-activates it for the check with the new key
+                isOk = not session.isFatal  and  fnCheckTrailer(session, job, nSector)
+                result.nResumed += isOk
+            result.nDone += isOk
+            if not isOk  and  not session.isFatal:
+                print(f"rekey of sector[{nSector}] failed")
+            if session.isFatal:
+                result.abort(session.lastResult, nBlockThrowCard)
+                break
+    except do_comm.SessionDesync:
+        raise
+    except Exception as e: #as in fnWrite: printed, result tells which sectors have the new trailer
+        print(f"rekey error: {e}")
+
+    print(f"rekey {result.end().toStr()}")
+    return result
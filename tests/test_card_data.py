@@ -25,15 +25,39 @@ from nfc_reader.card_data import (
     MIFARE_1K_default_key,
     status,
     parseAccessBits,
+    accessConditions,
+    allowedKeys,
+    ACCESS_CONDITIONS,
+    dataBlockRights,
+    OP_READ,
+    OP_WRITE,
+    OP_DECREMENT,
     bitAccessMap,
     bytes2str,
     accessBitsToStr,
+    encodeAccessBits,
+    accessBitsFromRules,
+    buildTrailer,
     keyType,
     key,
     dumpMifare_1k,
     printSector,
+    sectorToDict,
     printDump,
     printATR,
+    madCRC,
+    decodeMAD,
+    applicationSectors,
+    decodeTLVs,
+    decodeNdefMessage,
+    decodeNdef,
+    ndefRecordToStr,
+    ndefRecord,
+    NDEF_AID,
+    MAD_AID_NOT_APPLIED,
+    encodeValue,
+    decodeValue,
+    VALUE_MIN,
 )
 
 
@@ -126,6 +150,19 @@ class TestParseAccessBits:
         # After XOR with 0xFF, b6 and b7 become 0x00
         assert len(result) == 4
     
+    def test_parseAccessBits_transport(self):
+        """Test transport configuration FF 07 80: data blocks 000, trailer 001."""
+        assert list(parseAccessBits(0xFF, 0x07, 0x80)) == [0b000, 0b000, 0b000, 0b001]
+    
+    def test_parseAccessBits_c2(self):
+        """Test C2 bits are decoded (78 77 88: data blocks 100, trailer 011)."""
+        assert list(parseAccessBits(0x78, 0x77, 0x88)) == [0b100, 0b100, 0b100, 0b011]
+    
+    def test_parseAccessBits_invalid_check_byte(self):
+        """Test inverted copies are validated when all three bytes are given."""
+        assert parseAccessBits(0xFF, 0x07, 0x81) is None
+        assert parseAccessBits(0xFF, 0x17, 0x80) is None
+    
     def test_parseAccessBits_values_in_range(self):
         """Test parseAccessBits produces values in valid range (0-7)."""
         for b6 in range(256):
@@ -135,6 +172,70 @@ class TestParseAccessBits:
                     assert 0 <= val <= 7, f"Access bit value {val} out of range for b6={b6}, b7={b7}"
 
 
+class TestAccessConditions:
+    """Test access condition table and key selection."""
+    
+    def test_table(self):
+        """Test every valid combination is in the table and decodes back."""
+        assert len(ACCESS_CONDITIONS) == 4096
+        assert accessConditions(bytearray([0xFF, 0x07, 0x80])) == [0, 0, 0, 1]
+        assert accessConditions([0x00, 0x00, 0x00]) is None
+    
+    def test_allowedKeys_transport(self):
+        """Test key B is readable in transport configuration, so only key A may access."""
+        assert allowedKeys([0xFF, 0x07, 0x80], 0, OP_WRITE) == "A"
+        assert allowedKeys([0xFF, 0x07, 0x80], 3, OP_WRITE) == "A"
+    
+    def test_allowedKeys_key_b(self):
+        """Test data 100 (write by B) with trailer 011 (key B not readable)."""
+        assert allowedKeys([0x78, 0x77, 0x88], 1, OP_READ) == "AB"
+        assert allowedKeys([0x78, 0x77, 0x88], 1, OP_WRITE) == "B"
+        assert allowedKeys([0x78, 0x77, 0x88], 1, OP_DECREMENT) == ""
+        assert allowedKeys([0x78, 0x77, 0x81], 1, OP_READ) is None
+
+
+class TestEncodeAccessBits:
+    """Test access bits encoder and trailer builder."""
+
+    def test_encode_roundtrip(self):
+        """Test every table entry encodes back to its access bytes."""
+        for accessBytes, conditions in ACCESS_CONDITIONS.items():
+            assert bytes(encodeAccessBits(conditions)) == accessBytes
+
+    def test_encode_transport(self):
+        """Test transport configuration."""
+        assert encodeAccessBits([0, 0, 0, 1]) == bytearray([0xFF, 0x07, 0x80])
+
+    def test_encode_invalid(self):
+        """Test wrong number of conditions or condition out of range."""
+        with pytest.raises(ValueError):
+            encodeAccessBits([0, 0, 0])
+        with pytest.raises(ValueError):
+            encodeAccessBits([0, 0, 0, 8])
+
+    def test_accessBitsFromRules(self):
+        """Test rules as printed give the same access bytes."""
+        assert accessBitsFromRules("r(a,b) w(b) i(-) d(-)", "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)") == bytearray([0x78, 0x77, 0x88])
+        rules = accessBitsToStr([0x78, 0x77, 0x88])[0:3]
+        assert accessBitsFromRules(rules, "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)") == bytearray([0x78, 0x77, 0x88])
+
+    def test_accessBitsFromRules_unknown(self):
+        """Test rule text that is not in the maps."""
+        with pytest.raises(ValueError):
+            accessBitsFromRules("R(A) W(A)", "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)")
+        with pytest.raises(ValueError):
+            accessBitsFromRules("R(A,B) W(B) I(-) D(-)", "R(A,B) W(B) I(-) D(-)")
+
+    def test_buildTrailer(self):
+        """Test trailer layout and checks."""
+        trailer = buildTrailer([0xA1] * 6, [0xFF, 0x07, 0x80], [0xB1] * 6)
+        assert trailer == bytes([0xA1] * 6 + [0xFF, 0x07, 0x80, 0x69] + [0xB1] * 6)
+        with pytest.raises(ValueError):
+            buildTrailer([0xA1] * 6, [0xFF, 0x07, 0x81], [0xB1] * 6)
+        with pytest.raises(ValueError):
+            buildTrailer([0xA1] * 5, [0xFF, 0x07, 0x80], [0xB1] * 6)
+
+
 class TestBitAccessMap:
     """Test bitAccessMap dictionary."""
     
@@ -143,6 +244,12 @@ class TestBitAccessMap:
         expected_keys = {0b000, 0b001, 0b010, 0b011, 0b100, 0b101, 0b110, 0b111}
         assert set(bitAccessMap.keys()) == expected_keys
     
+    def test_bitAccessMap_matches_rights(self):
+        """Test text of each condition agrees with dataBlockRights."""
+        for condition, rights in dataBlockRights.items():
+            text = "R({}) W({}) I({}) D({})".format(*[",".join(keyTypes) or "-" for keyTypes in rights])
+            assert bitAccessMap[condition] == text
+    
     def test_bitAccessMap_values(self):
         """Test bitAccessMap values are strings."""
         for value in bitAccessMap.values():
@@ -397,6 +504,29 @@ class TestDumpMifare1k:
             assert isinstance(sector, dumpMifare_1k.sector)
             assert len(sector.blocks) == MIFARE_1K_blocks_per_sector
 
+    def test_dumpMifare1k_missingSectors(self):
+        """Test sectors never read or not reached are reported missing."""
+        dump = dumpMifare_1k()
+        dump.sectors[0].status = status.S_OK
+        dump.sectors[1].status = status.S_READ_ERROR
+        dump.sectors[2].status = status.S_NOT_READ
+        assert dump.missingSectors() == [2] + list(range(3, MIFARE_1K_total_sectors))
+
+    def test_dumpMifare1k_clear(self):
+        """Test clear forgets card content but keeps ATR."""
+        dump = dumpMifare_1k()
+        dump.ATR = bytearray([0x3B, 0x8F])
+        dump.head.UID = bytearray([1, 2, 3, 4])
+        dump.sectors[3].status = status.S_OK
+        dump.status = status.S_NO_CARD
+        sectors = dump.sectors
+        dump.clear()
+        assert dump.sectors is sectors
+        assert dump.sectors[3].status == status.S_NOINIT
+        assert dump.head.UID == bytearray(4)
+        assert dump.status == status.S_NOINIT
+        assert dump.ATR == bytearray([0x3B, 0x8F])
+
 
 class TestPrintSector:
     """Test printSector function."""
@@ -433,6 +563,34 @@ class TestPrintSector:
         assert mock_print.called
 
 
+class TestSectorToDict:
+    """Test sectorToDict function."""
+
+    def test_sectorToDict_read(self):
+        """Test sectorToDict of a read sector is JSON ready."""
+        import json
+        sector = dumpMifare_1k.sector()
+        sector.status = status.S_OK
+        for i, block in enumerate(sector.blocks):
+            block.status = status.S_OK
+            block.data = bytearray([i] * MIFARE_1K_bytes_per_block)
+        sector.trailer.processLastBlock(bytearray(6) + bytearray([0xFF, 0x07, 0x80, 0x69]) + bytearray([0xFF] * 6))
+
+        record = json.loads(json.dumps(sectorToDict(2, sector)))
+        assert record["sector"] == 2
+        assert record["status"] == "OK"
+        assert record["blocks"][1]["data"] == "01" * MIFARE_1K_bytes_per_block
+        assert record["blocks"][0]["access"] == bitAccessMap[0b000]
+        assert record["trailer"] == {"status": "OK", "accessBits": "FF0780", "GPB": 0x69, "keyB": "FF" * 6}
+
+    def test_sectorToDict_not_read(self):
+        """Test sectorToDict leaves out data that was not read."""
+        record = sectorToDict(0, dumpMifare_1k.sector())
+        assert record["status"] == "NO INIT"
+        assert record["blocks"][0] == {"status": "NO INIT", "data": None, "access": ""}
+        assert record["trailer"] is None
+
+
 class TestPrintDump:
     """Test printDump function."""
     
@@ -500,6 +658,129 @@ class TestPrintATR:
         mock_atr_class.assert_called_once_with(atr_data)
 
 
+#MAD of sectors 1-2 NDEF, rest free (CRC computed by madCRC)
+NDEF_URI_MESSAGE = bytes([0xD1, 0x01, 0x0C, 0x55, 0x04]) + b"example.com"
+
+
+def make_ndef_dump(mad_sectors=(1, 2)):
+    """Dump with MAD in sector 0 and one URI record in the NDEF sectors."""
+    dump = dumpMifare_1k()
+    mad = bytearray(32)
+    mad[1] = 0x01
+    for iSector in mad_sectors:
+        mad[2 * iSector:2 * iSector + 2] = bytes([0x03, 0xE1])
+    mad[0] = madCRC(mad[1:])
+    data = bytes([0x03, len(NDEF_URI_MESSAGE)]) + NDEF_URI_MESSAGE + bytes([0xFE])
+    data += bytes(16 * 3 * len(mad_sectors) - len(data))
+    for iBlock, blockData in ((1, mad[:16]), (2, mad[16:])):
+        dump.sectors[0].blocks[iBlock].data = bytearray(blockData)
+        dump.sectors[0].blocks[iBlock].status = status.S_OK
+    for i, iSector in enumerate(mad_sectors):
+        for iBlock in range(3):
+            offset = (i * 3 + iBlock) * 16
+            dump.sectors[iSector].blocks[iBlock].data = bytearray(data[offset:offset + 16])
+            dump.sectors[iSector].blocks[iBlock].status = status.S_OK
+    return dump
+
+
+class TestMAD:
+    """Test MIFARE Application Directory decoding."""
+
+    def test_madCRC_known_value(self):
+        """Test CRC of a MAD with all 15 sectors NDEF (AN10787 example)."""
+        assert madCRC(bytes([0x01]) + bytes([0x03, 0xE1] * 15)) == 0x14
+
+    def test_decodeMAD(self):
+        """Test AIDs per sector."""
+        mad = decodeMAD(make_ndef_dump())
+        assert len(mad) == MIFARE_1K_total_sectors
+        assert mad[0] == MAD_AID_NOT_APPLIED
+        assert mad[1] == NDEF_AID
+        assert mad[3] == 0x0000
+        assert applicationSectors(mad, NDEF_AID) == [1, 2]
+
+    def test_decodeMAD_bad_crc(self):
+        """Test MAD with wrong CRC is rejected."""
+        dump = make_ndef_dump()
+        dump.sectors[0].blocks[1].data[0] ^= 0xFF
+        assert decodeMAD(dump) is None
+        assert applicationSectors(None, NDEF_AID) == []
+
+    def test_decodeMAD_not_read(self):
+        """Test MAD is not decoded from unread blocks."""
+        assert decodeMAD(dumpMifare_1k()) is None
+
+    def test_decodeMAD_no_DA_bit(self):
+        """Test GPB without DA bit means no MAD."""
+        dump = make_ndef_dump()
+        dump.sectors[0].trailer.status = status.S_OK
+        dump.sectors[0].trailer.GPB = 0x01
+        assert decodeMAD(dump) is None
+
+
+class TestNdef:
+    """Test NDEF TLV and record decoding."""
+
+    def test_decodeTLVs(self):
+        """Test NULL TLVs are skipped and terminator stops decoding."""
+        assert decodeTLVs(bytes([0x00, 0x03, 0x02, 0xAA, 0xBB, 0xFE, 0x03, 0x01, 0xCC])) == [(0x03, bytes([0xAA, 0xBB]))]
+
+    def test_decodeTLVs_long_length(self):
+        """Test 3 byte length form."""
+        value = bytes(300)
+        assert decodeTLVs(bytes([0x03, 0xFF, 0x01, 0x2C]) + value) == [(0x03, value)]
+
+    def test_decodeNdefMessage_uri(self):
+        """Test short URI record."""
+        records = decodeNdefMessage(NDEF_URI_MESSAGE)
+        assert records == [ndefRecord(0x01, b"U", b"", bytes([0x04]) + b"example.com")]
+        assert ndefRecordToStr(records[0]) == "URI: https://example.com"
+
+    def test_text_record(self):
+        """Test well-known text record."""
+        record = ndefRecord(0x01, b"T", b"", bytes([0x02]) + b"en" + b"hello")
+        assert ndefRecordToStr(record) == "Text(en): hello"
+
+    def test_decodeNdef_from_dump(self):
+        """Test records are found through MAD across sectors."""
+        records = decodeNdef(make_ndef_dump())
+        assert len(records) == 1
+        assert records[0].type == b"U"
+
+    def test_decodeNdef_sector_not_read(self):
+        """Test no records when an NDEF sector is missing."""
+        dump = make_ndef_dump()
+        dump.sectors[2].blocks[0].status = status.S_NOINIT
+        assert decodeNdef(dump) == []
+
+
+class TestValueBlock:
+    """Test value block encoding."""
+
+    def test_encodeValue(self):
+        """Test datasheet layout: value, inverted value, value, address bytes."""
+        data = encodeValue(100, 5)
+        assert list(data) == [0x64, 0, 0, 0, 0x9B, 0xFF, 0xFF, 0xFF, 0x64, 0, 0, 0, 0x05, 0xFA, 0x05, 0xFA]
+
+    def test_decodeValue_roundtrip(self):
+        """Test negative and extreme values survive encoding."""
+        for value in (0, -1, 123456, VALUE_MIN):
+            assert decodeValue(encodeValue(value, 9)) == (value, 9)
+
+    def test_decodeValue_invalid(self):
+        """Test data with mismatched copies is not a value block."""
+        data = encodeValue(7)
+        data[8] ^= 0x01
+        assert decodeValue(data) is None
+        assert decodeValue(bytes(16)) is None
+        assert decodeValue(bytes(4)) is None
+
+    def test_encodeValue_range(self):
+        """Test values beyond 32 bits are refused."""
+        with pytest.raises(ValueError):
+            encodeValue(1 << 31)
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
 
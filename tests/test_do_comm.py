@@ -8,9 +8,15 @@ import pytest
 from unittest.mock import MagicMock, patch
 import sys
 import os
+import time
 
 # Import the module to test
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
 
 from nfc_reader.do_comm import (
     bytes2str,
@@ -19,6 +25,19 @@ from nfc_reader.do_comm import (
     fnSelectBlock,
     fnWriteBlock,
     fnReadBlock,
+    fnGetData,
+    GET_DATA_ATS,
+    CardSession,
+    fnGetSession,
+    ApduScript,
+    fnRunScript,
+    txResult,
+    fnTransmit,
+    fnClassifyStatus,
+    fnClassifyException,
+    TransmitWatchdog,
+    TransmitTimeout,
+    retryPolicy,
 )
 
 
@@ -179,8 +198,7 @@ class TestFnSelectBlock:
         apdu = call_args[1]
         assert apdu[0] == 0xFF  # CLA
         assert apdu[1] == 0x86  # INS
-        assert apdu[5] == 0x00  # KeyType = Key A
-        assert apdu[7] == 4     # BlockAddr
+        assert apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 4, 0x60, 0x00]  # Version 0x01, AuthMode key A
     
     @patch('nfc_reader.do_comm.fnDoTransmit')
     def test_fnSelectBlock_success_key_b(self, mock_transmit):
@@ -193,7 +211,7 @@ class TestFnSelectBlock:
         assert result is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
-        assert apdu[5] == 0x01  # KeyType = Key B
+        assert apdu[5] == 0x01  # Version
         assert apdu[7] == 8     # BlockAddr
     
     @patch('nfc_reader.do_comm.fnDoTransmit')
@@ -207,7 +225,8 @@ class TestFnSelectBlock:
         assert result is True
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
-        assert apdu[5] == 0x00  # KeyType = Key A (lowercase converted)
+        assert apdu[5] == 0x01  # Version does not depend on the key type
+        assert apdu[8] == 0x60  # AuthMode = Key A (lowercase converted)
     
     @patch('nfc_reader.do_comm.fnDoTransmit')
     @patch('builtins.print')
@@ -237,8 +256,8 @@ class TestFnSelectBlock:
         
         call_args = mock_transmit.call_args[0]
         apdu = call_args[1]
-        # Verify complete APDU structure
-        assert apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 16, 0x60, 0x00]
+        # Verify complete APDU structure (0x61 - authentication with key B)
+        assert apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 16, 0x61, 0x00]
 
 
 class TestFnWriteBlock:
@@ -373,6 +392,34 @@ class TestFnReadBlock:
             assert call_args[1][3] == block_addr
 
 
+class TestFnGetData:
+    """Test fnGetData function."""
+
+    @patch('nfc_reader.do_comm.fnDoTransmit')
+    def test_fnGetData_uid(self, mock_transmit):
+        """Test fnGetData sends GET DATA for UID by default."""
+        mock_connection = MagicMock()
+        mock_transmit.return_value = (True, [0x01, 0x02, 0x03, 0x04])
+
+        success, data = fnGetData(mock_connection)
+
+        assert success is True
+        assert data == [0x01, 0x02, 0x03, 0x04]
+        assert mock_transmit.call_args[0][1] == [0xFF, 0xCA, 0x00, 0x00, 0x00]
+
+    @patch('nfc_reader.do_comm.fnDoTransmit')
+    def test_fnGetData_ats(self, mock_transmit):
+        """Test fnGetData with ATS data type."""
+        mock_connection = MagicMock()
+        mock_transmit.return_value = (False, None)
+
+        success, data = fnGetData(mock_connection, GET_DATA_ATS)
+
+        assert success is False
+        assert data is None
+        assert mock_transmit.call_args[0][1] == [0xFF, 0xCA, 0x01, 0x00, 0x00]
+
+
 class TestIntegration:
     """Integration tests for multiple operations."""
     
@@ -415,5 +462,436 @@ class TestIntegration:
         assert mock_transmit.call_count == 3
 
 
+class TestCardSession:
+    """Test CardSession key slot and authentication cache."""
+    
+    KEY = (0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF)
+    
+    @staticmethod
+    def make_connection(sw=(0x90, 0x00)):
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], sw[0], sw[1])
+        return mock_connection
+    
+    def test_loadKey_sent_once(self):
+        """Test the same key is loaded into the reader only once."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        
+        assert session.loadKey(self.KEY) == 0
+        assert session.loadKey(bytearray(self.KEY)) == 0
+        
+        assert mock_connection.transmit.call_count == 1
+        assert session.skipped == 1
+    
+    @patch('builtins.print')
+    def test_loadKey_failure(self, mock_print):
+        """Test failed key load returns -1 and is not cached."""
+        mock_connection = self.make_connection((0x63, 0x00))
+        session = CardSession(mock_connection)
+        
+        assert session.loadKey(self.KEY) == -1
+        assert session.loadKey(self.KEY) == -1
+        assert mock_connection.transmit.call_count == 2
+        assert session.lastResult == txResult.TX_ERROR
+    
+    def test_loadKey_multiple_slots(self):
+        """Test keys are spread over reader slots and reused."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection, nKeySlots=2)
+        other_key = [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5]
+        
+        assert session.loadKey(self.KEY) == 0
+        assert session.loadKey(other_key) == 1
+        assert session.loadKey(self.KEY) == 0
+        assert mock_connection.transmit.call_count == 2
+        assert mock_connection.transmit.call_args[0][0][3] == 1  # P2 = slot
+    
+    def test_valueOperation_apdu(self):
+        """Test value operation APDU: block, Lc 5, operation, amount MSB first."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        
+        assert session.valueOperation(5, 0x02, 258)
+        assert mock_connection.transmit.call_args[0][0] == [0xFF, 0xD7, 0x00, 5, 0x05, 0x02, 0x00, 0x00, 0x01, 0x02]
+        assert session.restoreValue(5, 6)
+        assert mock_connection.transmit.call_args[0][0] == [0xFF, 0xD7, 0x00, 5, 0x02, 0x03, 6]
+    
+    def test_readValue(self):
+        """Test read value block response is a signed MSB first value."""
+        mock_connection = self.make_connection()
+        mock_connection.transmit.return_value = ([0xFF, 0xFF, 0xFF, 0xFE], 0x90, 0x00)
+        session = CardSession(mock_connection)
+        
+        assert session.readValue(5) == (True, -2)
+        assert mock_connection.transmit.call_args[0][0] == [0xFF, 0xB1, 0x00, 5, 0x04]
+    
+    def test_selectBlock_key_a_apdu(self):
+        """Test AUTH with key A sends Version 0x01 and AuthMode 0x60."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        
+        assert session.authenticate(8, 'A', self.KEY) is True
+        assert mock_connection.transmit.call_args[0][0] == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 8, 0x60, 0x00]
+    
+    def test_selectBlock_same_sector_skipped(self):
+        """Test re-authentication to the same sector is skipped."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        
+        assert session.authenticate(4, 'B', self.KEY) is True
+        assert session.authenticate(5, 'b', self.KEY) is True
+        
+        assert mock_connection.transmit.call_count == 2  # one LOAD KEY, one AUTH
+    
+    def test_selectBlock_new_sector_or_key_type(self):
+        """Test authentication is repeated for another sector or key type."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        
+        session.authenticate(4, 'B', self.KEY)
+        session.authenticate(8, 'B', self.KEY)
+        session.authenticate(8, 'A', self.KEY)
+        
+        assert mock_connection.transmit.call_count == 4
+    
+    def test_failed_read_invalidates_auth(self):
+        """Test authentication is repeated after a failed read."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        session.authenticate(4, 'B', self.KEY)
+        
+        mock_connection.transmit.return_value = ([], 0x63, 0x00)
+        assert session.readBlock(4) == (False, None)
+        assert session.authSector == -1
+        
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+        session.authenticate(4, 'B', self.KEY)
+        assert mock_connection.transmit.call_count == 4  # LOAD, AUTH, READ, AUTH
+    
+    def test_card_removed_is_fatal(self):
+        """Test removed card is reported as fatal and clears the cache."""
+        mock_connection = self.make_connection()
+        session = CardSession(mock_connection)
+        session.authenticate(4, 'B', self.KEY)
+        
+        error = Exception("Card was removed")
+        error.hresult = 0x80100069  # SCARD_W_REMOVED_CARD
+        mock_connection.transmit.side_effect = error
+        
+        assert session.readBlock(4) == (False, None)
+        assert session.isFatal is True
+        assert session.lastResult == txResult.TX_CARD_REMOVED
+        assert session.slots == [None]
+    
+    @patch('builtins.print')
+    def test_reactivate_after_auth_failure(self, mock_print):
+        """Test card is re-activated before the command following a failed auth."""
+        mock_connection = self.make_connection((0x63, 0x00))
+        session = CardSession(mock_connection)
+        session.slots[0] = bytes(self.KEY)
+        
+        assert session.selectBlock(4, 'B', 0) is False
+        assert session.needReactivate is True
+        mock_connection.reconnect.assert_not_called()  # nothing sent yet, nothing to re-activate for
+        
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+        assert session.selectBlock(8, 'B', 0) is True
+        mock_connection.reconnect.assert_called_once()
+        assert session.reactivations == 1
+        assert session.needReactivate is False
+    
+    @patch('builtins.print')
+    def test_no_reactivate_after_load_key_failure(self, mock_print):
+        """Test failed LOAD KEYS does not re-activate the card."""
+        mock_connection = self.make_connection((0x63, 0x00))
+        session = CardSession(mock_connection)
+        
+        session.loadKey(self.KEY)
+        assert session.needReactivate is False
+    
+    @patch('builtins.print')
+    def test_no_reactivate_when_disabled(self, mock_print):
+        """Test autoReactivate=False keeps the old behaviour."""
+        mock_connection = self.make_connection((0x63, 0x00))
+        session = CardSession(mock_connection, autoReactivate=False)
+        session.slots[0] = bytes(self.KEY)
+        
+        session.selectBlock(4, 'B', 0)
+        session.selectBlock(8, 'B', 0)
+        mock_connection.reconnect.assert_not_called()
+    
+    @patch('builtins.print')
+    def test_reactivate_card_removed(self, mock_print):
+        """Test removed card found during re-activation stops the next command."""
+        mock_connection = self.make_connection((0x63, 0x00))
+        error = Exception("Card was removed")
+        error.hresult = 0x80100069
+        mock_connection.reconnect.side_effect = error
+        session = CardSession(mock_connection)
+        session.readBlock(4)
+        
+        assert session.readBlock(5) == (False, None)
+        assert session.lastResult == txResult.TX_CARD_REMOVED
+        assert mock_connection.transmit.call_count == 1
+    
+    def test_fnGetSession(self):
+        """Test fnGetSession wraps connections and passes sessions through."""
+        connection = MagicMock()
+        session = fnGetSession(connection)
+        
+        assert isinstance(session, CardSession)
+        assert session.connection is connection
+        assert fnGetSession(session) is session
+
+
+class TestTransmitClassification:
+    """Test txResult classification of status words and exceptions."""
+    
+    def test_classify_status(self):
+        """Test status words are sorted into classes."""
+        assert fnClassifyStatus(0xB0, 0x90, 0x00) == txResult.TX_OK
+        assert fnClassifyStatus(0x86, 0x63, 0x00) == txResult.TX_AUTH_FAIL
+        assert fnClassifyStatus(0x86, 0x69, 0x83) == txResult.TX_AUTH_FAIL
+        assert fnClassifyStatus(0xD6, 0x69, 0x82) == txResult.TX_ACCESS_DENIED
+        assert fnClassifyStatus(0xB0, 0x63, 0x00) == txResult.TX_ERROR
+    
+    def test_classify_exception_hresult(self):
+        """Test PC/SC error codes from exceptions."""
+        removed = Exception("transmit failed")
+        removed.hresult = -2146434967  # SCARD_W_REMOVED_CARD as signed LONG
+        gone = Exception("transmit failed")
+        gone.hresult = 0x80100017      # SCARD_E_READER_UNAVAILABLE
+        
+        assert fnClassifyException(removed) == txResult.TX_CARD_REMOVED
+        assert fnClassifyException(gone) == txResult.TX_READER_GONE
+        assert fnClassifyException(Exception("other")) == txResult.TX_ERROR
+    
+    def test_classify_exception_message(self):
+        """Test fallback on exception message when hresult is missing."""
+        assert fnClassifyException(Exception("Card was removed.")) == txResult.TX_CARD_REMOVED
+    
+    def test_fatal_classes(self):
+        """Test only card/reader loss and timeouts are fatal."""
+        fatal = {result for result in txResult if result.isFatal}
+        assert fatal == {txResult.TX_CARD_REMOVED, txResult.TX_READER_GONE, txResult.TX_TIMEOUT}
+    
+    def test_fnTransmit(self):
+        """Test fnTransmit returns class, data and status words."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0x01], 0x90, 0x00)
+        assert fnTransmit(mock_connection, [0xFF, 0xB0, 0x00, 4]) == (txResult.TX_OK, [0x01], 0x90, 0x00)
+        
+        mock_connection.transmit.return_value = ([], 0x63, 0x00)
+        assert fnTransmit(mock_connection, [0xFF, 0x86, 0x00, 0x00]) == (txResult.TX_AUTH_FAIL, None, 0x63, 0x00)
+
+
+class TestApduScript:
+    """Test ApduScript builder and fnRunScript executor."""
+    
+    def test_script_apdus(self):
+        """Test prebuilt APDUs match the single-command helpers."""
+        key_data = [0xFF] * 6
+        script = ApduScript().loadKey(key_data).authenticate(4, 'B').readBlocks(4, 2).writeBlocks(5, [0x01] * 32)
+        
+        assert [step.name for step in script.steps] == ["LOAD KEY", "AUTH", "READ", "READ", "WRITE", "WRITE"]
+        assert script.steps[0].apdu == [0xFF, 0x82, 0x00, 0x00, 0x06] + key_data
+        assert script.steps[1].apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 4, 0x61, 0x00]
+        assert script.steps[3].apdu == [0xFF, 0xB0, 0x00, 5]
+        assert script.steps[5].apdu == [0xFF, 0xD6, 0x00, 6, 16] + [0x01] * 16
+    
+    def test_run_script_success(self):
+        """Test all steps are executed and collected."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([0xAA] * 16, 0x90, 0x00)
+        script = ApduScript().loadKey([0xFF] * 6).authenticate(0, 'A').readBlocks(0, 4)
+        
+        result = fnRunScript(mock_connection, script)
+        
+        assert result.isOk is True
+        assert len(result.steps) == 6
+        assert mock_connection.transmit.call_count == 6
+        assert result.steps[-1].data == [0xAA] * 16
+        assert script.steps[1].apdu == [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 0, 0x60, 0x00]
+    
+    def test_run_script_stop_on_fail(self):
+        """Test execution stops at first failure when requested."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [([], 0x90, 0x00), ([], 0x63, 0x00), ([], 0x90, 0x00)]
+        script = ApduScript().loadKey([0xFF] * 6).authenticate(0, 'A').readBlocks(0, 1)
+        
+        result = fnRunScript(mock_connection, script, stopOnFail=True)
+        
+        assert result.isOk is False
+        assert result.failedStep == 1
+        assert len(result.steps) == 2
+        assert (result.steps[1].sw1, result.steps[1].sw2) == (0x63, 0x00)
+        assert result.steps[1].result == txResult.TX_AUTH_FAIL
+    
+    def test_run_script_stops_on_card_removed(self):
+        """Test execution always stops when the card is gone."""
+        mock_connection = MagicMock()
+        error = Exception("Card was removed")
+        error.hresult = 0x80100069
+        mock_connection.transmit.side_effect = [([], 0x90, 0x00), error, ([], 0x90, 0x00)]
+        
+        result = fnRunScript(mock_connection, ApduScript().readBlocks(0, 3))
+        
+        assert len(result.steps) == 2
+        assert result.stopReason == txResult.TX_CARD_REMOVED
+    
+    def test_run_script_exception(self):
+        """Test exception is stored in step result and execution continues."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = [Exception("gone"), ([], 0x90, 0x00)]
+        script = ApduScript().readBlocks(0, 2)
+        
+        result = fnRunScript(mock_connection, script)
+        
+        assert result.failedStep == 0
+        assert len(result.steps) == 2
+        assert result.steps[0].sw1 == -1
+        assert str(result.steps[0].error) == "gone"
+    
+    def test_run_script_resets_session(self):
+        """Test session cache is reset because the script changes reader state."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+        session = CardSession(mock_connection)
+        session.slots[0] = bytes([0xFF] * 6)
+        session.authSector = 1
+        
+        fnRunScript(session, ApduScript().readBlocks(4))
+        
+        assert session.slots == [None]
+        assert session.authSector == -1
+
+
+class TestTransmitWatchdog:
+    """Test per-APDU and per-operation deadlines."""
+    
+    def test_call_returns_value(self):
+        """Test result of the call is passed through."""
+        watchdog = TransmitWatchdog()
+        assert watchdog.call(lambda a, b: a + b, 1, 2, timeout=1.0) == 3
+    
+    def test_call_raises_exception(self):
+        """Test exception of the call is re-raised in the caller."""
+        watchdog = TransmitWatchdog()
+        with pytest.raises(ValueError):
+            watchdog.call(int, "x", timeout=1.0)
+    
+    def test_call_timeout(self):
+        """Test hanging call is abandoned and next call still works."""
+        watchdog = TransmitWatchdog()
+        with pytest.raises(TransmitTimeout):
+            watchdog.call(time.sleep, 0.5, timeout=0.05)
+        assert watchdog.call(lambda: 7, timeout=1.0) == 7
+    
+    def test_fnTransmit_timeout(self):
+        """Test fnTransmit reports TX_TIMEOUT for a wedged reader."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = lambda apdu: time.sleep(0.5)
+        
+        result = fnTransmit(mock_connection, [0xFF, 0xB0, 0x00, 4], timeout=0.05)
+        
+        assert result == (txResult.TX_TIMEOUT, None, -1, -1)
+    
+    @patch('builtins.print')
+    def test_session_apdu_timeout_resets_reader(self, mock_print):
+        """Test session returns timeout and resets the card with a reconnect."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = lambda apdu: time.sleep(0.5)
+        session = CardSession(mock_connection, apduTimeout=0.05)
+        
+        assert session.readBlock(4) == (False, None)
+        assert session.lastResult == txResult.TX_TIMEOUT
+        assert session.isFatal is True
+        mock_connection.reconnect.assert_called_once()
+    
+    def test_session_operation_deadline(self):
+        """Test no command is sent after the operation deadline passed."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.return_value = ([], 0x90, 0x00)
+        session = CardSession(mock_connection)
+        
+        session.beginOperation(0.0)
+        assert session.readBlock(4) == (False, None)
+        assert session.lastResult == txResult.TX_TIMEOUT
+        mock_connection.transmit.assert_not_called()
+        
+        session.endOperation()
+        assert session.readBlock(4) == (True, [])
+    
+    def test_run_script_timeout(self):
+        """Test script stops with TX_TIMEOUT on a wedged step."""
+        mock_connection = MagicMock()
+        mock_connection.transmit.side_effect = lambda apdu: time.sleep(0.5) if apdu[3] == 1 else ([], 0x90, 0x00)
+        
+        result = fnRunScript(mock_connection, ApduScript().readBlocks(0, 3), apduTimeout=0.05)
+        
+        assert len(result.steps) == 2
+        assert result.stopReason == txResult.TX_TIMEOUT
+
+
+class TestRetryPolicy:
+    """Test retryPolicy backoff and retry decisions."""
+
+    def make_session(self, results):
+        """Session whose attempts return the given (isOk, txResult) pairs in order."""
+        session = CardSession(MagicMock())
+        answers = iter(results)
+
+        def attempt():
+            isOk, session.lastResult = next(answers)
+            return isOk, [0x01] if isOk else None
+        return session, attempt
+
+    def test_delay_grows_with_attempt_and_fail_rate(self):
+        """Test backoff is exponential and longer when failures were seen."""
+        policy = retryPolicy(baseDelay=0.01, maxDelay=1.0)
+        assert policy.delay(0) == pytest.approx(0.01)
+        assert policy.delay(2) == pytest.approx(0.04)
+        policy.failRate = 0.5
+        assert policy.delay(0) == pytest.approx(0.03)
+        assert retryPolicy(baseDelay=0.1, maxDelay=0.15).delay(3) == 0.15
+
+    def test_record_moves_fail_rate(self):
+        """Test failure rate follows outcomes."""
+        policy = retryPolicy(smoothing=0.5)
+        policy.record(False)
+        assert policy.failRate == 0.5
+        policy.record(True)
+        assert policy.failRate == 0.25
+
+    def test_retries_until_success(self):
+        """Test TX_ERROR is retried and success stops retrying."""
+        session, attempt = self.make_session([(False, txResult.TX_ERROR), (True, txResult.TX_OK)])
+        policy = retryPolicy(maxRetries=3, baseDelay=0.0)
+        assert policy.call(session, attempt) == (True, [0x01])
+        assert session.retries == 1
+
+    def test_retries_limited(self):
+        """Test attempts stop after maxRetries."""
+        session, attempt = self.make_session([(False, txResult.TX_ERROR)] * 3)
+        policy = retryPolicy(maxRetries=2, baseDelay=0.0)
+        assert policy.call(session, attempt) == (False, None)
+        assert session.retries == 2
+
+    @pytest.mark.parametrize("result", [txResult.TX_AUTH_FAIL, txResult.TX_ACCESS_DENIED, txResult.TX_CARD_REMOVED])
+    def test_not_retryable(self, result):
+        """Test wrong key, access denied and fatal results are not retried."""
+        session, attempt = self.make_session([(False, result)])
+        assert retryPolicy(baseDelay=0.0).call(session, attempt) == (False, None)
+        assert session.retries == 0
+
+    def test_no_wait_past_deadline(self):
+        """Test no retry is started if its wait does not fit into the operation deadline."""
+        session, attempt = self.make_session([(False, txResult.TX_ERROR), (True, txResult.TX_OK)])
+        session.beginOperation(0.01)
+        assert retryPolicy(baseDelay=0.5, maxDelay=1.0).call(session, attempt) == (False, None)
+        assert session.retries == 0
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,823 @@
+"""
+Tests for do_emul module.
+
+This module tests the virtual MIFARE Classic 1K card and reader: APDU handling,
+key and access bit enforcement, halt after failure, card events and
+do_wr operations running against the emulator.
+"""
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+import card_data
+import do_comm
+import do_keys
+import do_prompt
+import do_wr
+
+from nfc_reader.do_emul import (
+    MIFARE_1K_ATR,
+    VirtualCardError,
+    VirtualMifare1k,
+    VirtualReader,
+    accessConditions,
+    latencyModel,
+)
+
+KEY_FF = [0xFF] * 6
+KEY_A1 = [0xA1] * 6
+
+
+def auth_apdu(nBlock, keyType=0x60, nSlot=0):
+    return [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, nBlock, keyType, nSlot]
+
+
+def make_connection(card=None):
+    reader = VirtualReader()
+    reader.insert(card if card is not None else VirtualMifare1k(uid=[1, 2, 3, 4]))
+    connection = reader.createConnection()
+    connection.connect()
+    return reader, connection
+
+
+class TestAccessConditions:
+    def test_transport_configuration(self):
+        assert accessConditions([0xFF, 0x07, 0x80]) == [0b000, 0b000, 0b000, 0b001]
+
+    def test_invalid_inverted_copy(self):
+        assert accessConditions([0xFF, 0x07, 0x81]) is None
+
+
+class TestVirtualCard:
+    def test_block0(self):
+        card = VirtualMifare1k(uid=[0x11, 0x22, 0x33, 0x44])
+        assert list(card.blocks[0][0:6]) == [0x11, 0x22, 0x33, 0x44, 0x11 ^ 0x22 ^ 0x33 ^ 0x44, 0x08]
+        assert card.atr == MIFARE_1K_ATR
+
+    def test_transport_trailer(self):
+        card = VirtualMifare1k()
+        assert list(card.trailer(5)) == KEY_FF + [0xFF, 0x07, 0x80, 0x69] + KEY_FF
+
+
+class TestVirtualReaderApdu:
+    def test_read_after_auth(self):
+        _reader, connection = make_connection()
+        assert connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)[1:] == (0x90, 0x00)
+        assert connection.transmit(auth_apdu(4))[1:] == (0x90, 0x00)
+        data, sw1, sw2 = connection.transmit([0xFF, 0xB0, 0x00, 4, 16])
+        assert (sw1, sw2) == (0x90, 0x00)
+        assert data == [0] * 16
+
+    def test_auth_version_checked(self):
+        _reader, connection = make_connection()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        apdu = auth_apdu(4)
+        apdu[5] = 0x00  #Version must be 0x01
+        assert connection.transmit(apdu)[1:] == (0x63, 0x00)
+
+    def test_read_without_auth_denied(self):
+        _reader, connection = make_connection()
+        assert connection.transmit([0xFF, 0xB0, 0x00, 4, 16])[1:] == (0x69, 0x82)
+
+    def test_read_other_sector_denied(self):
+        _reader, connection = make_connection()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        connection.transmit(auth_apdu(4))
+        assert connection.transmit([0xFF, 0xB0, 0x00, 8, 16])[1:] == (0x69, 0x82)
+
+    def test_wrong_key_halts_card(self):
+        _reader, connection = make_connection()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_A1)
+        assert connection.transmit(auth_apdu(4))[1:] == (0x63, 0x00)
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        assert connection.transmit(auth_apdu(4))[1:] == (0x63, 0x00) #halted
+        connection.reconnect()
+        assert connection.transmit(auth_apdu(4))[1:] == (0x90, 0x00)
+
+    def test_trailer_read_hides_key_a(self):
+        _reader, connection = make_connection()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        connection.transmit(auth_apdu(7))
+        data, sw1, sw2 = connection.transmit([0xFF, 0xB0, 0x00, 7, 16])
+        assert (sw1, sw2) == (0x90, 0x00)
+        assert data == [0] * 6 + [0xFF, 0x07, 0x80, 0x69] + KEY_FF  #key B readable in transport configuration
+
+    def test_write_block0_denied(self):
+        _reader, connection = make_connection()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        connection.transmit(auth_apdu(0))
+        assert connection.transmit([0xFF, 0xD6, 0x00, 0, 16] + [0] * 16)[1:] == (0x69, 0x82)
+
+    def test_write_respects_access_bits(self):
+        card = VirtualMifare1k()
+        card.setTrailer(1, KEY_FF, [0x78, 0x77, 0x88], KEY_A1) #data 100: read AB, write B
+        _reader, connection = make_connection(card)
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        connection.transmit(auth_apdu(4))
+        assert connection.transmit([0xFF, 0xB0, 0x00, 4, 16])[1:] == (0x90, 0x00)
+        assert connection.transmit([0xFF, 0xD6, 0x00, 4, 16] + [1] * 16)[1:] == (0x69, 0x82)
+        connection.reconnect()
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_A1)
+        connection.transmit(auth_apdu(4, keyType=0x61))
+        assert connection.transmit([0xFF, 0xD6, 0x00, 4, 16] + [1] * 16)[1:] == (0x90, 0x00)
+        assert list(card.blocks[4]) == [1] * 16
+
+    def test_invalid_access_bits_block_sector(self):
+        card = VirtualMifare1k()
+        card.setTrailer(2, KEY_FF, [0x00, 0x00, 0x00], KEY_FF)
+        _reader, connection = make_connection(card)
+        connection.transmit([0xFF, 0x82, 0x00, 0x00, 0x06] + KEY_FF)
+        connection.transmit(auth_apdu(8))
+        assert connection.transmit([0xFF, 0xB0, 0x00, 8, 16])[1:] == (0x69, 0x82)
+
+    def test_unknown_instruction(self):
+        _reader, connection = make_connection()
+        assert connection.transmit([0xFF, 0xA4, 0x00, 0x00])[1:] == (0x6D, 0x00)
+
+    def test_removed_card_raises(self):
+        reader, connection = make_connection()
+        reader.remove()
+        with pytest.raises(VirtualCardError) as e:
+            connection.transmit([0xFF, 0xB0, 0x00, 4, 16])
+        assert do_comm.fnClassifyException(e.value) == do_comm.txResult.TX_CARD_REMOVED
+
+
+class TestVirtualReaderEvents:
+    def test_observer_notified(self):
+        events = []
+
+        class observer:
+            def update(self, observable, handlers):
+                inserted, removed = handlers
+                events.append((len(inserted), len(removed), (inserted or removed)[0].atr))
+
+        reader = VirtualReader()
+        reader.addObserver(observer())
+        reader.insert(VirtualMifare1k())
+        reader.remove()
+        assert events == [(1, 0, MIFARE_1K_ATR), (0, 1, MIFARE_1K_ATR)]
+
+    def test_card_request(self):
+        reader = VirtualReader()
+        with pytest.raises(VirtualCardError):
+            reader.CardRequest(timeout=0.01).waitforcard()
+        reader.insert(VirtualMifare1k())
+        service = reader.CardRequest(timeout=0.01).waitforcard()
+        assert service.connection.getReader() == reader.name
+
+    def test_latency_model(self):
+        model = latencyModel(delays={0xB0: 0.01}, jitter=0.2, seed=1)
+        assert 0.008 <= model.delay(0xB0) <= 0.012
+        assert model.delay(0x82) == 0.0
+
+
+class TestDoWrOnEmulator:
+    def test_read_full_dump(self):
+        card = VirtualMifare1k(uid=[1, 2, 3, 4])
+        card.blocks[5][:] = bytes(range(16))
+        _reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.fnRead(connection, dump, card_data.key())
+        assert result.isOk
+        assert list(dump.sectors[1].blocks[1].data) == list(range(16))
+        assert list(dump.head.UID) == [1, 2, 3, 4]
+
+    def test_write_then_read(self):
+        reader, connection = make_connection()
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=3, nBlock=1)
+        writeData.data = bytearray([0x5A] * 16)
+        assert do_wr.fnWrite(connection, writeData, card_data.key())
+        assert list(reader.card.blocks[13]) == [0x5A] * 16
+
+    def test_read_batch_other_sector_key(self, capsys):
+        card = VirtualMifare1k(uid=[1, 2, 3, 4])
+        card.setTrailer(2, KEY_A1, [0xFF, 0x07, 0x80], KEY_A1)
+        for nBlock in (5, 9, 13):
+            card.blocks[nBlock][:] = bytes([nBlock] * 16)
+        reader, connection = make_connection(card)
+        batch = card_data.dumpMifare_1k()
+        result = do_wr.fnReadBatch(connection, batch, card_data.key())
+        assert result.nDone == 60  and  result.nReactivations == 1
+        assert batch.sectors[2].status == card_data.status.S_AUTH_ERROR
+        assert batch.sectors[3].status == card_data.status.S_OK
+
+        reader.remove()
+        reader.insert(card)
+        connection.reconnect()
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnRead(connection, dump, card_data.key()).nDone == result.nDone
+        assert [sector.status for sector in batch.sectors] == [sector.status for sector in dump.sectors]
+        assert [(block.status, block.data) for sector in batch.sectors for block in sector.blocks] == \
+               [(block.status, block.data) for sector in dump.sectors for block in sector.blocks]
+
+    def test_read_batch_read_denied_block(self, capsys):
+        card = VirtualMifare1k(uid=[1, 2, 3, 4])
+        card.setTrailer(2, KEY_FF, card_data.encodeAccessBits([0b000, 0b111, 0b000, 0b001]), KEY_FF)
+        for nBlock in (8, 10, 13):
+            card.blocks[nBlock][:] = bytes([nBlock] * 16)
+        reader, connection = make_connection(card)
+        batch = card_data.dumpMifare_1k()
+        result = do_wr.fnReadBatch(connection, batch, card_data.key())
+        assert result.nDone == 63  and  result.nReactivations == 1
+        assert batch.sectors[2].blocks[1].status == card_data.status.S_READ_ERROR
+        assert list(batch.sectors[2].blocks[2].data) == [10] * 16
+        assert batch.sectors[3].status == card_data.status.S_OK
+
+        reader.remove()
+        reader.insert(card)
+        connection.reconnect()
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnRead(connection, dump, card_data.key()).nDone == result.nDone
+        assert [sector.status for sector in batch.sectors] == [sector.status for sector in dump.sectors]
+        assert [(block.status, block.data) for sector in batch.sectors for block in sector.blocks] == \
+               [(block.status, block.data) for sector in dump.sectors for block in sector.blocks]
+
+    def test_write_mapped_file(self, tmp_path):
+        path = tmp_path / "image.bin"
+        path.write_bytes(bytes(range(48)))
+        writeData = do_prompt.fnWriteFromFile(str(path), 1, 2, 16)
+        reader, connection = make_connection()
+        assert do_wr.fnWrite(connection, writeData, card_data.key(), verify=True)
+        writeData.close()
+        assert list(reader.card.blocks[6]) == list(range(16))
+        assert list(reader.card.blocks[8]) == list(range(16, 32))  #trailer 7 stepped over
+        assert list(reader.card.blocks[9]) == list(range(32, 48))
+
+    def test_plan_steps_over_trailers(self):
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=0, nBlock=2)
+        writeData.data = bytearray(16 * 4)
+        plan = do_wr.fnPlanWrite(writeData)
+        assert plan.blockNumbers == [2, 4, 5, 6]
+        assert [step.nSector for step in plan.steps] == [0, 1]
+        assert plan.nApdu == 1 + 2 + 4
+        assert plan.estimate() > 0
+        assert plan.nUnplaced == 0
+
+    def test_plan_does_not_fit(self):
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=15, nBlock=1)
+        writeData.data = bytearray(16 * 3)
+        plan = do_wr.fnPlanWrite(writeData)
+        assert plan.blockNumbers == [61, 62]
+        assert plan.nUnplaced == 1
+
+        reader, connection = make_connection()
+        assert not do_wr.fnWrite(connection, writeData, card_data.key())
+        assert reader.commands == 0   #refused before anything is sent
+
+    def test_write_entire_card(self):
+        reader, connection = make_connection()
+        trailers = [bytes(reader.card.blocks[nBlock]) for nBlock in range(3, 64, 4)]
+        writeData = do_prompt.PromptAnswer_ForWrite()
+        writeData.address = do_prompt.writeAddress.A_ALL
+        writeData.data = bytearray([0x77] * 16 * 47)
+        result = do_wr.fnWrite(connection, writeData, card_data.key())
+        assert result.isOk
+        assert reader.commands == do_wr.fnPlanWrite(writeData).nApdu == 1 + 16 + 47
+        assert [bytes(reader.card.blocks[nBlock]) for nBlock in range(3, 64, 4)] == trailers
+        assert list(reader.card.blocks[1]) == [0x77] * 16
+        assert list(reader.card.blocks[62]) == [0x77] * 16
+
+    def test_write_verify(self):
+        reader, connection = make_connection()
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=1, nBlock=0)
+        writeData.data = bytearray([0x42] * 32)
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), verify=True)
+        assert result.isOk
+        assert result.verified == {4: True, 5: True}
+        assert reader.commands == 1 + 1 + 2 + 2  #read-back under the same authentication
+
+    def test_write_verify_mismatch_rewritten(self):
+        reader, connection = make_connection()
+        transmit = reader.transmit
+        corrupted = []
+        def corruptFirstWrite(apdu):
+            Result = transmit(apdu)
+            if apdu[1] == 0xD6  and  len(corrupted) == 0:
+                corrupted.append(apdu[3])
+                reader.card.blocks[apdu[3]][0] ^= 0xFF
+            return Result
+        reader.transmit = corruptFirstWrite
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=2, nBlock=1)
+        writeData.data = bytearray([0x42] * 16)
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), verify=True)
+        assert result.isOk
+        assert result.verified == {9: True}
+        assert result.nRewrites == 1
+        assert list(reader.card.blocks[9]) == [0x42] * 16
+
+    def test_write_verify_denied(self):
+        card = VirtualMifare1k()
+        card.setTrailer(1, KEY_FF, [0x78, 0x77, 0x88], KEY_A1) #data: read AB, write B only
+        _reader, connection = make_connection(card)
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=1, nBlock=0)
+        writeData.data = bytearray([0x42] * 16)
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), verify=True, verifyRetries=1)
+        assert not result.isOk
+        assert result.verified == {4: False}
+        assert result.nRewrites == 1
+        assert "mismatch: 1:0" in result.toStr()
+
+    def test_write_incremental_skips_unchanged(self):
+        reader, connection = make_connection()
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=3, nBlock=0)
+        writeData.data = bytearray([0x5A] * 16 + [0x00] * 16)  #block 13 stays zeros
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump)
+        assert result.isOk
+        assert (result.nDone, result.nSkipped) == (2, 1)
+        assert list(reader.card.blocks[12]) == [0x5A] * 16
+        assert list(dump.blockAt(12).data) == [0x5A] * 16
+
+        #same data again: baseline is up to date, nothing is read or written
+        nCommands = reader.commands
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump)
+        assert result.isOk
+        assert result.nSkipped == 2
+        assert result.savedTime > 0
+        assert reader.commands == nCommands + 1  #GET DATA only
+
+    def test_write_incremental_refresh(self):
+        reader, connection = make_connection()
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=3, nBlock=0)
+        writeData.data = bytearray([0x5A] * 16)
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump)
+        reader.card.blocks[12][:] = bytes(16)  #changed on the card after the baseline was taken
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump, refresh=True)
+        assert result.isOk
+        assert result.nSkipped == 0
+        assert list(reader.card.blocks[12]) == [0x5A] * 16
+
+    def test_write_incremental_other_card(self):
+        reader, connection = make_connection(VirtualMifare1k(uid=[1, 2, 3, 4]))
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=1, nBlock=0)
+        writeData.data = bytearray([0x11] * 16)
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump)
+        reader.insert(VirtualMifare1k(uid=[5, 6, 7, 8]))
+        connection.connect()
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), incremental=True, baseline=dump)
+        assert result.nSkipped == 0   #cached content was of the first card
+        assert list(reader.card.blocks[4]) == [0x11] * 16
+        assert list(dump.head.UID) == [5, 6, 7, 8]
+
+    def test_value_block_operations(self):
+        reader, connection = make_connection()
+        session = do_comm.CardSession(connection)
+        key = card_data.key()
+        assert do_wr.fnFormatValue(session, 5, 10, key)
+        assert card_data.decodeValue(reader.card.blocks[5]) == (10, 5)
+        assert do_wr.fnIncrement(session, 5, 7, key)
+        assert do_wr.fnDecrement(session, 5, 20, key)
+        result, value = do_wr.fnReadValue(session, 5, key)
+        assert result.isOk  and  value == -3
+        assert do_wr.fnRestoreValue(session, 5, 6, key)
+        assert card_data.decodeValue(reader.card.blocks[6]) == (-3, 5)
+        assert reader.commands == 1 + 1 + 5  #one key load and authentication for all operations
+
+    def test_value_decrement_single_exchange(self):
+        card = VirtualMifare1k()
+        card.blocks[8][:] = card_data.encodeValue(3, 8)
+        reader, connection = make_connection(card)
+        assert do_wr.fnDecrement(connection, 8, 1, card_data.key())
+        assert reader.commands == 3      #LOAD KEY, AUTH, DECREMENT
+        assert card_data.decodeValue(card.blocks[8]) == (2, 8)
+
+    def test_value_operation_refused(self):
+        card = VirtualMifare1k()
+        card.setTrailer(1, KEY_FF, [0x78, 0x77, 0x88], KEY_A1) #data: read AB, write B, no increment/decrement
+        card.blocks[4][:] = card_data.encodeValue(3)
+        _reader, connection = make_connection(card)
+        assert not do_wr.fnDecrement(connection, 4, 1, card_data.key())
+        assert card_data.decodeValue(card.blocks[4]) == (3, 0)
+        assert not do_wr.fnIncrement(connection, 9, 1, card_data.key())  #block 9 is not a value block
+        assert not do_wr.fnDecrement(connection, 7, 1, card_data.key())  #trailer
+        assert not do_wr.fnDecrement(connection, 9, -1, card_data.key())
+
+    def test_read_picks_key_from_trailer(self):
+        card = VirtualMifare1k()
+        #data blocks 011 (read/write by key B only), trailer 011 (key B not readable)
+        accessBytes = next(k for k, v in card_data.ACCESS_CONDITIONS.items() if v == (0b011, 0b011, 0b011, 0b011))
+        card.setTrailer(2, KEY_FF, accessBytes, KEY_FF)
+        card.blocks[9][:] = bytes([0x99] * 16)
+        reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        assert not do_wr.fnReadSectors(connection, dump, card_data.key(), [0, 2])  #key A: only the trailer of sector 2
+        assert dump.sectors[2].trailer.status == card_data.status.S_OK
+
+        #key B of the sector is not known: key A data is not tried as key B
+        nCommands = reader.commands
+        result = do_wr.fnReadSectors(connection, dump, card_data.key(), [0, 2], resume=True)
+        assert not result.isOk
+        assert reader.commands == nCommands + 1  #GET DATA of the resume check only
+        assert dump.sectors[2].blocks[1].status == card_data.status.S_DENIED
+
+        #key B derived from the UID is known without a trial
+        keyring = do_keys.keyRing(withDefaults=False)
+        keyring.addDerivation(do_keys.keyDerivation(b"site", fnDerive=lambda *args: bytes(KEY_FF)))
+        result = do_wr.fnReadSectors(connection, dump, None, [0, 2], keyring=keyring)
+        assert result.isOk
+        assert list(dump.sectors[2].blocks[1].data) == [0x99] * 16
+
+    def test_write_denied_by_known_trailer(self):
+        card = VirtualMifare1k()
+        accessBytes = next(k for k, v in card_data.ACCESS_CONDITIONS.items() if v == (0b010, 0b010, 0b010, 0b001))
+        card.setTrailer(1, KEY_FF, accessBytes, KEY_FF) #data blocks read only
+        reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnReadSectors(connection, dump, card_data.key(), [0, 1])
+        nCommands = reader.commands
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=1, nBlock=0)
+        writeData.data = bytearray([0x42] * 16)
+        result = do_wr.fnWrite(connection, writeData, card_data.key(), baseline=dump)
+        assert not result.isOk
+        assert result.nRefused == 1
+        assert reader.commands == nCommands + 1  #GET DATA of the baseline check only
+        assert dump.sectors[1].blocks[0].status == card_data.status.S_OK
+
+    def test_read_uid(self):
+        reader, connection = make_connection(VirtualMifare1k(uid=[0xDE, 0xAD, 0xBE, 0xEF]))
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.fnReadUID(connection, dump, withATS=True)
+        assert result.isOk
+        assert list(dump.head.UID) == [0xDE, 0xAD, 0xBE, 0xEF]
+        assert len(dump.ATS) == 0     #MIFARE Classic has no ATS
+        assert reader.commands == 2   #no key, no authentication
+        assert not reader.halted
+
+    def test_read_uid_card_removed(self):
+        reader, connection = make_connection()
+        reader.remove()
+        result = do_wr.fnReadUID(connection, card_data.dumpMifare_1k())
+        assert not result
+        assert result.stopReason == do_comm.txResult.TX_CARD_REMOVED
+
+    def test_read_marginal_card_retried(self):
+        reader = VirtualReader(dropRate=0.05, seed=7)
+        reader.insert(VirtualMifare1k())
+        connection = reader.createConnection()
+        connection.connect()
+        result = do_wr.fnRead(connection, card_data.dumpMifare_1k(), card_data.key(),
+                              retry=do_comm.retryPolicy(maxRetries=5, baseDelay=0.0))
+        assert result.isOk
+        assert result.nRetries > 0
+
+    def test_read_resume_same_card(self):
+        card = VirtualMifare1k(uid=[1, 2, 3, 4])
+        reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        transmit = connection.transmit
+        sent = []
+
+        def transmitUntilRemoved(apdu):  #card leaves the field after 20 commands
+            sent.append(apdu)
+            if len(sent) == 20:
+                reader.remove()
+            return transmit(apdu)
+        connection.transmit = transmitUntilRemoved
+        first = do_wr.fnRead(connection, dump, card_data.key())
+        assert first.isAborted
+        nFirst = first.nDone
+
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        nCommands = reader.commands
+        second = do_wr.fnRead(connection, dump, card_data.key(), resume=True)
+        assert second.isOk
+        assert second.nResumed == nFirst
+        assert reader.commands - nCommands < 1 + 16 + 64  #full dump: LOAD KEY, 16 AUTH, 64 READ
+        assert dump.status == card_data.status.S_NOINIT
+
+    def test_read_resume_7_byte_uid(self):
+        uid  = [0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66]
+        card = VirtualMifare1k(uid=uid)
+        assert list(card.blocks[0][0:10]) == uid + [0x08, 0x44, 0x00]
+        reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        transmit = connection.transmit
+        sent = []
+
+        def transmitUntilRemoved(apdu):  #card leaves the field after 20 commands
+            sent.append(apdu)
+            if len(sent) == 20:
+                reader.remove()
+            return transmit(apdu)
+        connection.transmit = transmitUntilRemoved
+        first = do_wr.fnRead(connection, dump, card_data.key())
+        assert first.isAborted
+
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        second = do_wr.fnRead(connection, dump, card_data.key(), resume=True)  #bound by block 0
+        assert second.isOk
+        assert second.nResumed == first.nDone
+        assert list(dump.UID) == uid
+
+        session = do_comm.fnGetSession(connection)
+        assert do_wr.fnBindCard(session, dump)  #bound by the full UID of GET DATA
+        reader.insert(VirtualMifare1k(uid=uid[0:4] + [0x99, 0x99, 0x99]))
+        connection.connect()
+        assert not do_wr.fnBindCard(do_comm.fnGetSession(connection), dump)
+        assert dump.missingSectors() == list(range(16))
+
+    def test_read_resume_without_get_data(self):
+        reader, connection = make_connection(VirtualMifare1k(uid=[1, 2, 3, 4]))
+        transmit = connection.transmit
+
+        def transmitWithoutGetData(apdu):  #reader rejects FF CA
+            return ([], 0x6A, 0x81) if apdu[1] == 0xCA else transmit(apdu)
+        connection.transmit = transmitWithoutGetData
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnRead(connection, dump, card_data.key())
+        nCommands = reader.commands
+        result = do_wr.fnRead(connection, dump, card_data.key(), resume=True)  #bound by block 0 read again
+        assert result.nResumed == 64
+        assert reader.commands - nCommands == 3  #LOAD KEY, AUTH, READ of block 0
+
+        reader.insert(VirtualMifare1k(uid=[5, 6, 7, 8]))
+        connection.connect()
+        assert not do_wr.fnBindCard(do_comm.fnGetSession(connection), dump, card_data.key())
+        assert dump.missingSectors() == list(range(16))
+
+    def test_read_resume_other_card(self):
+        reader, connection = make_connection(VirtualMifare1k(uid=[1, 2, 3, 4]))
+        dump = card_data.dumpMifare_1k()
+        do_wr.fnRead(connection, dump, card_data.key())
+        reader.insert(VirtualMifare1k(uid=[5, 6, 7, 8]))
+        connection.connect()
+        result = do_wr.fnRead(connection, dump, card_data.key(), resume=True)
+        assert result.isOk
+        assert result.nResumed == 0
+        assert list(dump.head.UID) == [5, 6, 7, 8]
+
+    def test_read_sectors_only(self):
+        reader, connection = make_connection()
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.fnReadSectors(connection, dump, card_data.key(), [2, 5])
+        assert result.isOk
+        assert result.nTotal == 8
+        assert reader.commands == 1 + 2 + 8  #LOAD KEY, 2 AUTH, 8 READ
+        assert dump.missingSectors() == [iSector for iSector in range(16) if iSector not in (2, 5)]
+
+    def test_read_block_range(self):
+        card = VirtualMifare1k()
+        card.blocks[6][:] = bytes([6] * 16)
+        _reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.fnReadBlocks(connection, dump, card_data.key(), range(6, 9))
+        assert result.isOk
+        assert list(dump.sectors[1].blocks[2].data) == [6] * 16
+        assert dump.sectors[1].blocks[1].status == card_data.status.S_NOINIT
+        assert dump.sectors[2].blocks[0].status == card_data.status.S_OK
+
+    def test_sector_order(self):
+        assert do_wr.fnSectorOrder([0, 1, 2, 3, 5], [5, 9, 2, 5]) == [5, 2, 0, 1, 3]
+        assert do_wr.fnSectorOrder([3, 1]) == [1, 3]
+
+    def test_read_priority_order(self):
+        _reader, connection = make_connection()
+        dump = card_data.dumpMifare_1k()
+        authBlocks = []
+        transmit = connection.transmit
+        def recordAuth(apdu):
+            apdu[1] == 0x86 and authBlocks.append(apdu[7])
+            return transmit(apdu)
+        connection.transmit = recordAuth
+        assert do_wr.fnReadSectors(connection, dump, card_data.key(), [0, 1, 2, 3], priority=[3, 1])
+        assert authBlocks == [12, 4, 0, 8]
+
+    def test_read_budget(self):
+        #clock of the read advances 10 ms per command the reader handles; a sector costs 40 ms:
+        #GET DATA and sector 7 (LOAD KEY, AUTH, 4 READ) end at 70 ms, sector 3 at 120 ms = budget
+        reader, connection = make_connection()
+        clock = SimpleNamespace(perf_counter=lambda: reader.commands * 0.01)
+        dump = card_data.dumpMifare_1k()
+        with patch.object(do_wr, "fnSectorReadCost", return_value=0.04), patch.object(do_wr, "time", clock):
+            result = do_wr.fnRead(connection, dump, card_data.key(), priority=[7, 3], budget=0.12)
+        assert not result.isAborted
+        assert not result.isOk
+        assert dump.sectors[7].status == card_data.status.S_OK
+        assert dump.sectors[3].status == card_data.status.S_OK
+        assert result.nDone == 8
+        assert result.nNotAttempted == result.nTotal - result.nDone
+        assert 0 in dump.missingSectors()
+        assert dump.status == card_data.status.S_TIMEOUT
+
+        #next tap completes the dump
+        result = do_wr.fnRead(connection, dump, card_data.key(), resume=True)
+        assert result.isOk
+        assert result.nResumed >= 8
+
+    def test_read_iter(self):
+        card = VirtualMifare1k(uid=[1, 2, 3, 4])
+        card.blocks[9][:] = bytes([9] * 16)
+        _reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.opResult(0)
+        sectors = []
+        for nSector, sector in do_wr.fnReadIter(connection, dump, card_data.key(), result=result):
+            assert sector is dump.sectors[nSector]
+            assert sector.status == card_data.status.S_OK  #complete when yielded
+            sectors.append(nSector)
+        assert sectors == list(range(16))
+        assert result.isOk
+        assert list(dump.sectors[2].blocks[1].data) == [9] * 16
+        assert list(dump.head.UID) == [1, 2, 3, 4]
+
+    def test_read_iter_stop_early(self):
+        _reader, connection = make_connection()
+        session = do_comm.fnGetSession(connection)
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.opResult(0)
+        reads = do_wr.fnReadIter(session, dump, card_data.key(), timeout=5.0, priority=[4], result=result)
+        assert next(reads)[0] == 4
+        reads.close()
+        assert session.deadline is None  #operation ended with the consumer
+        assert result.nDone == 4
+        assert dump.missingSectors() == [iSector for iSector in range(16) if iSector != 4]
+
+    def test_read_iter_card_removed(self):
+        reader, connection = make_connection()
+        dump = card_data.dumpMifare_1k()
+        result = do_wr.opResult(0)
+        sectors = []
+        for nSector, sector in do_wr.fnReadIter(connection, dump, card_data.key(), result=result):
+            sectors.append(nSector)
+            if nSector == 1:
+                reader.remove()
+        assert sectors == [0, 1, 2]  #sector under way when the card left is yielded with its errors
+        assert result.stopReason == do_comm.txResult.TX_CARD_REMOVED
+        assert dump.sectors[3].status == card_data.status.S_NOT_READ
+
+    def test_rekey(self):
+        accessBits = card_data.accessBitsFromRules("R(A,B) W(B) I(-) D(-)", "keyA W(B) access R(A,B) W(B) keyB R(-) W(B)")
+        job = do_wr.rekeyJob(card_data.key(), KEY_A1, [0xB1] * 6, accessBits, sectors=[1, 2])
+        assert job.estimate() > 0
+        reader, connection = make_connection()
+        result = do_wr.fnRekey(connection, job)
+        assert result.isOk
+        assert result.verified == {7: True, 11: True}
+        assert list(reader.card.trailer(1)) == KEY_A1 + [0x78, 0x77, 0x88, 0x69] + [0xB1] * 6
+        assert list(reader.card.trailer(3)) == KEY_FF + [0xFF, 0x07, 0x80, 0x69] + KEY_FF
+        #new key B may now write the data blocks
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=1, nBlock=0)
+        writeData.data = bytearray([0x33] * 16)
+        assert do_wr.fnWrite(connection, writeData, card_data.key(card_data.keyType.KT_B, [0xB1] * 6))
+
+    def test_rekey_resumes_rekeyed_card(self):
+        job = do_wr.rekeyJob(card_data.key(), KEY_A1, [0xB1] * 6, [0xFF, 0x07, 0x80], sectors=[1, 2])
+        card = VirtualMifare1k()
+        card.setTrailer(1, KEY_A1, [0xFF, 0x07, 0x80], [0xB1] * 6)  #done by a tap that was cut off
+        _reader, connection = make_connection(card)
+        result = do_wr.fnRekey(connection, job)
+        assert result.isOk
+        assert result.nResumed == 1
+        assert list(card.trailer(2))[0:6] == KEY_A1
+
+    def test_rekey_wrong_old_key(self):
+        job = do_wr.rekeyJob(card_data.key(card_data.keyType.KT_A, [0x12] * 6), KEY_A1, [0xB1] * 6, [0xFF, 0x07, 0x80], sectors=[4])
+        reader, connection = make_connection()
+        result = do_wr.fnRekey(connection, job)
+        assert not result.isOk
+        assert not result.isAborted
+        assert list(reader.card.trailer(4))[0:6] == KEY_FF
+
+    def test_watch_changes(self):
+        card = VirtualMifare1k()
+        card.blocks[4][:] = bytes([1] * 16)
+        reader, connection = make_connection(card)
+        result = do_wr.opResult(0)
+        watch = do_wr.fnWatch(connection, card_data.key(), [8, 4, 5], rate=1000.0, result=result)
+        initial = [next(watch) for _ in range(3)]
+        assert [change.nBlock for change in initial] == [4, 5, 8]
+        assert initial[0].old is None  and  initial[0].new == bytes([1] * 16)
+
+        nCommands = reader.commands
+        card.blocks[5][2] = 0x42
+        change = next(watch)
+        assert (change.nBlock, change.diff) == (5, [(2, 0x00, 0x42)])
+        assert change.old == bytes(16)
+        assert "sector[1]:block[1] +2:00->42" in do_wr.fnChangeToStr(change)
+        #next sample up to block 5: AUTH of sector 1 (key stays loaded), READ 4, READ 5
+        assert reader.commands - nCommands == 1 + 2
+        watch.close()
+        assert result.nDone == result.nTotal
+
+    def test_watch_card_removed(self):
+        reader, connection = make_connection()
+        result = do_wr.opResult(0)
+        changes = []
+        for change in do_wr.fnWatch(connection, card_data.key(), [4], rate=1000.0, result=result):
+            changes.append(change)
+            reader.remove()
+        assert len(changes) == 1
+        assert result.stopReason == do_comm.txResult.TX_CARD_REMOVED
+
+    def test_watch_duration(self):
+        _reader, connection = make_connection()
+        result = do_wr.opResult(0)
+        changes = list(do_wr.fnWatch(connection, card_data.key(), [4, 5], rate=100.0, duration=0.05, result=result))
+        assert len(changes) == 2  #initial content only
+        assert 1 <= result.nTotal // 2 <= 7
+
+    def test_watch_counts_reactivations(self):
+        card = VirtualMifare1k()
+        card.setTrailer(2, KEY_A1, [0xFF, 0x07, 0x80], KEY_A1)
+        _reader, connection = make_connection(card)
+        session = do_comm.fnGetSession(connection)
+        result = do_wr.opResult(0)
+        changes = list(do_wr.fnWatch(session, card_data.key(), [4, 8], rate=100.0, duration=0.03, result=result))
+        assert [change.nBlock for change in changes] == [4]
+        assert result.nDone < result.nTotal
+        assert result.nReactivations >= 1  #sector 2 refuses the key in every sample
+        assert session.deadline is None
+
+    def test_watch_invalid_arguments(self):
+        reader, connection = make_connection()
+        for blockNumbers, rate in (([4], 0.0), ([4], -1.0), ([], 20.0)):
+            with pytest.raises(ValueError):
+                do_wr.fnWatch(connection, card_data.key(), blockNumbers, rate=rate)
+        assert reader.commands == 0
+
+    def test_lazy_dump(self):
+        card = VirtualMifare1k()
+        card.blocks[21][:] = bytes([0x21] * 16)
+        reader, connection = make_connection(card)
+        dump = do_wr.lazyDump(connection, card_data.key())
+        assert reader.commands == 1  #GET DATA only
+        assert list(dump.sectors[5].blocks[1].data) == [0x21] * 16
+        assert reader.commands == 1 + 1 + 1 + 4
+        assert dump.missingSectors() == [iSector for iSector in range(16) if iSector != 5]
+        dump.sectors[5]  #already read
+        assert reader.commands == 7
+
+        dump.detach()
+        assert dump.sectors[6].status == card_data.status.S_NOINIT
+        assert reader.commands == 7
+
+    def test_lazy_dump_index(self):
+        reader, connection = make_connection()
+        dump = do_wr.lazyDump(connection)
+        for index in (16, -17):
+            with pytest.raises(IndexError):
+                dump.sectors[index]
+        assert reader.commands == 1  #GET DATA only
+        assert dump.sectors[-1].status == card_data.status.S_OK
+        assert dump.missingSectors() == list(range(15))
+
+    def test_lazy_dump_other_card(self):
+        reader, connection = make_connection(VirtualMifare1k(uid=[1, 2, 3, 4]))
+        dump = do_wr.lazyDump(connection)
+        dump.sectors[0]
+        reader.insert(VirtualMifare1k(uid=[5, 6, 7, 8]))
+        connection.connect()
+        dump.attach(connection)
+        assert dump.missingSectors() == list(range(16))
+        assert list(dump.head.UID) == [5, 6, 7, 8]
+
+    def test_read_application(self):
+        card = VirtualMifare1k()
+        mad = bytearray(32)
+        mad[1] = 0x01
+        mad[2:6] = bytes([0x03, 0xE1, 0x03, 0xE1])  #sectors 1, 2
+        mad[0] = card_data.madCRC(mad[1:])
+        card.blocks[1][:], card.blocks[2][:] = mad[:16], mad[16:]
+        card.setTrailer(0, card_data.MAD_KEY_A, [0x78, 0x77, 0x88], [0x11] * 6, GPB=0xC1)
+        message = bytes([0xD1, 0x01, 0x05, 0x55, 0x01]) + b"a.io"
+        card.blocks[4][0:len(message) + 3] = bytes([0x03, len(message)]) + message + bytes([0xFE])
+        for iSector in (1, 2):
+            card.setTrailer(iSector, card_data.NDEF_KEY_A, [0x7F, 0x07, 0x88], [0x11] * 6, GPB=0x40)
+        _reader, connection = make_connection(card)
+        dump = card_data.dumpMifare_1k()
+        result, sectors = do_wr.fnReadApplication(connection, dump)
+        assert result.isOk
+        assert sectors == [1, 2]
+        assert result.nTotal == 12
+        assert dump.missingSectors() == list(range(3, 16))
+        assert [card_data.ndefRecordToStr(r) for r in card_data.decodeNdef(dump)] == ["URI: http://www.a.io"]
+
+    def test_read_application_no_mad(self):
+        _reader, connection = make_connection()
+        result, sectors = do_wr.fnReadApplication(connection, card_data.dumpMifare_1k(), key=card_data.key(), madKey=card_data.key())
+        assert sectors == []
+        assert result.nTotal == 4
+
+    def test_read_card_removed(self):
+        reader, connection = make_connection()
+        reader.remove()
+        result = do_wr.fnRead(connection, card_data.dumpMifare_1k(), card_data.key())
+        assert not result.isOk
+        assert result.stopReason == do_comm.txResult.TX_CARD_REMOVED
@@ -0,0 +1,290 @@
+"""
+Tests for do_keys module.
+
+This module tests key file parsing, card family detection, keys derived per
+UID and the keyring: key memo per card and sector, ordering by past success
+and cached misses.
+"""
+import hashlib
+import hmac
+import os
+import sys
+
+import pytest
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+import card_data
+import do_prompt
+import do_wr
+from do_emul import MIFARE_1K_ATR, VirtualMifare1k, VirtualReader
+
+from nfc_reader.do_keys import (
+    WELL_KNOWN_KEYS,
+    fnCardFamily,
+    fnHmacDerive,
+    fnLoadKeys,
+    fnLoadSecret,
+    keyDerivation,
+    keyRing,
+    parseKeyLine,
+)
+
+KEY_A1 = [0xA1] * 6
+UID = bytes([1, 2, 3, 4])
+
+
+def make_key(kType, keyData):
+    return card_data.key(card_data.keyType(kType), list(keyData))
+
+
+class TestParsing:
+    """Test key file lines."""
+
+    def test_parseKeyLine_types(self):
+        """Test key type prefix, both types without it, comments."""
+        keys = parseKeyLine("a0 a1 a2 a3 a4 a5  # MAD")
+        assert [k.keyType.value for k in keys] == ["A", "B"]
+        assert keys[0].keyData == card_data.MAD_KEY_A
+        assert [k.keyType.value for k in parseKeyLine("B:FFFFFFFFFFFF")] == ["B"]
+        assert parseKeyLine("   # comment") == []
+
+    def test_parseKeyLine_invalid(self):
+        """Test wrong key length is refused."""
+        with pytest.raises(ValueError):
+            parseKeyLine("FFFF")
+
+    def test_fnLoadKeys(self, tmp_path, capsys):
+        """Test bad lines are reported and skipped."""
+        path = tmp_path / "keys.txt"
+        path.write_text("A:112233445566\nxyz\n\n")
+        keys = fnLoadKeys(str(path))
+        assert len(keys) == 1
+        assert "keys.txt:2" in capsys.readouterr().out
+
+    def test_fnCardFamily(self):
+        """Test PC/SC storage card ATR gives standard and card name."""
+        assert fnCardFamily(MIFARE_1K_ATR) == "030001"
+        assert fnCardFamily([0x3B, 0x80]) == "3B80"
+
+
+class TestKeyRing:
+    """Test candidate ordering and memo."""
+
+    def test_defaults(self):
+        """Test well-known keys are candidates as A, then as B."""
+        keyring = keyRing()
+        candidates = keyring.candidates("f", UID, 1)
+        assert len(candidates) == 2 * len(WELL_KNOWN_KEYS)
+        assert candidates[0].keyType == card_data.keyType.KT_A
+        assert candidates[0].keyData == card_data.MIFARE_1K_default_key
+
+    def test_preferred(self):
+        """Test a preferred key moves in front without duplicates."""
+        keyring = keyRing()
+        keyring.add(make_key("A", card_data.NDEF_KEY_A), preferred=True)
+        candidates = keyring.candidates("f", UID, 1)
+        assert candidates[0].keyData == card_data.NDEF_KEY_A
+        assert len(candidates) == 2 * len(WELL_KNOWN_KEYS)
+
+    def test_loaded_keys_before_defaults(self, tmp_path):
+        """Test keys of a key file are tried before well-known keys, in file order."""
+        path = tmp_path / "keys.txt"
+        path.write_text("A:A1A1A1A1A1A1\nB:112233445566\n")
+        keyring = keyRing()
+        assert keyring.load(str(path)) == 2
+        candidates = keyring.candidates("f", UID, 1)
+        assert [key.keyData for key in candidates[0:2]] == [KEY_A1, [0x11, 0x22, 0x33, 0x44, 0x55, 0x66]]
+        assert candidates[2].keyData == card_data.MIFARE_1K_default_key
+        assert len(candidates) == 2 + 2 * len(WELL_KNOWN_KEYS)
+
+    def test_add_duplicate_keeps_place(self):
+        """Test adding a key held already does not move it."""
+        keyring = keyRing()
+        keyring.add(make_key("A", KEY_A1))
+        keyring.add(make_key("B", KEY_A1))
+        keyring.add(make_key("A", KEY_A1))
+        keyring.add(make_key("A", card_data.MIFARE_1K_default_key))
+        candidates = keyring.candidates("f", UID, 1)
+        assert [(key.keyType, key.keyData) for key in candidates[0:3]] == [
+            (card_data.keyType.KT_A, KEY_A1), (card_data.keyType.KT_B, KEY_A1),
+            (card_data.keyType.KT_A, card_data.MIFARE_1K_default_key)]
+        assert len(candidates) == 2 + 2 * len(WELL_KNOWN_KEYS)
+
+    def test_memo_and_hits(self):
+        """Test known key of the card first, family statistics for other cards."""
+        keyring = keyRing(withDefaults=False)
+        keyFF = make_key("A", card_data.MIFARE_1K_default_key)
+        keyA1 = make_key("A", KEY_A1)
+        keyring.add(keyFF)
+        keyring.add(keyA1)
+        keyring.success("f", UID, 3, keyA1)
+        assert keyring.known("f", UID, 3) is keyA1
+        assert keyring.candidates("f", UID, 3)[0] is keyA1
+        assert keyring.candidates("f", bytes(4), 3)[0] is keyA1   #same family
+        assert keyring.candidates("g", bytes(4), 3)[0] is keyFF   #other family
+
+    def test_keyOfType(self):
+        """Test key of a type is the known key or the derived key, never a candidate to try."""
+        keyring = keyRing()
+        keyA1 = make_key("A", KEY_A1)
+        keyring.success("f", UID, 3, keyA1)
+        assert keyring.keyOfType("f", UID, 3, "A") is keyA1
+        assert keyring.keyOfType("f", UID, 3, "B") is None
+        keyring.addDerivation(keyDerivation(b"site"))
+        assert keyring.keyOfType("f", UID, 3, "B").keyData == list(fnHmacDerive(b"site", UID, 3, "B"))
+
+    def test_miss(self):
+        """Test key rejected missLimit times is not offered again for the card until misses are forgotten."""
+        keyring = keyRing(withDefaults=False, missLimit=2)
+        keyFF = make_key("A", card_data.MIFARE_1K_default_key)
+        keyring.add(keyFF)
+        keyring.success("f", UID, 3, keyFF)
+        keyring.miss("f", UID, 3, keyFF)
+        assert keyring.candidates("f", UID, 3) == [keyFF]   #one rejection may be the card leaving the field
+        assert keyring.known("f", UID, 3) is keyFF
+        keyring.miss("f", UID, 3, keyFF)
+        assert keyring.candidates("f", UID, 3) == []
+        assert keyring.known("f", UID, 3) is None
+        assert len(keyring.candidates("f", UID, 4)) == 1
+        keyring.forgetMisses()
+        assert len(keyring.candidates("f", UID, 3)) == 1
+
+    def test_success_clears_misses(self):
+        """Test a success starts counting rejections of the key again."""
+        keyring = keyRing(withDefaults=False, missLimit=2)
+        keyFF = make_key("A", card_data.MIFARE_1K_default_key)
+        keyring.add(keyFF)
+        keyring.miss("f", UID, 3, keyFF)
+        keyring.success("f", UID, 3, keyFF)
+        keyring.miss("f", UID, 3, keyFF)
+        assert keyring.candidates("f", UID, 3) == [keyFF]
+
+
+class TestKeyDerivation:
+    """Test keys derived from UID and site secret."""
+
+    def test_fnHmacDerive(self):
+        """Test key is the start of HMAC-SHA256 over UID, sector and key type."""
+        expected = hmac.new(b"site", UID + bytes([5]) + b"B", hashlib.sha256).digest()[0:6]
+        assert fnHmacDerive(b"site", UID, 5, "B") == expected
+        assert fnHmacDerive(b"site", UID, 5, "A") != expected
+        assert fnHmacDerive(b"site", UID, 6, "B") != expected
+
+    def test_cache(self):
+        """Test derived keys are cached and the cache is bounded (least recently used dropped)."""
+        calls = []
+        def derive(secret, uid, nSector, keyTypeAB):
+            calls.append((uid, nSector, keyTypeAB))
+            return bytes([nSector] * 6)
+        derivation = keyDerivation(b"site", fnDerive=derive, cacheSize=2)
+        assert derivation.derive(UID, 1, "A").keyData == [1] * 6
+        derivation.derive(UID, 1, "A")
+        derivation.derive(UID, 2, "A")
+        derivation.derive(UID, 1, "A")  #1 is now the most recently used
+        derivation.derive(UID, 3, "A")  #drops 2
+        assert (derivation.hits, derivation.misses) == (2, 3)
+        derivation.derive(UID, 2, "A")
+        assert calls.count((UID, 2, "A")) == 2
+        assert len(derivation.cache) == 2
+
+    def test_bad_key_length(self):
+        """Test derivation function must return a key of 6 bytes."""
+        with pytest.raises(ValueError):
+            keyDerivation(b"site", fnDerive=lambda *args: b"1234").derive(UID, 0, "A")
+
+    def test_candidates_derived_first(self):
+        """Test derived keys come right after the known key, not for an unknown UID."""
+        keyring = keyRing()
+        keyring.addDerivation(keyDerivation(b"site"))
+        candidates = keyring.candidates("f", UID, 3)
+        assert [key.keyData for key in candidates[0:2]] == [list(fnHmacDerive(b"site", UID, 3, t)) for t in "AB"]
+        assert [key.keyType.value for key in candidates[0:2]] == ["A", "B"]
+        assert len(keyring.candidates("f", b"", 3)) == len(keyRing().candidates("f", b"", 3))
+
+    def test_fnLoadSecret(self, tmp_path):
+        """Test secret file as hex with comments or raw bytes."""
+        path = tmp_path / "site.key"
+        path.write_text("# site secret\n0011 2233\nAABB\n")
+        assert fnLoadSecret(str(path)) == bytes([0x00, 0x11, 0x22, 0x33, 0xAA, 0xBB])
+        path.write_bytes(b"\xff\x01raw")
+        assert fnLoadSecret(str(path)) == b"\xff\x01raw"
+
+
+class TestReadWithKeyRing:
+    """Test do_wr reads with a keyring on the emulator."""
+
+    def test_learns_sector_keys(self):
+        """Test second read of the same card authenticates at the first attempt."""
+        card = VirtualMifare1k(uid=UID)
+        card.setTrailer(2, KEY_A1, [0xFF, 0x07, 0x80], KEY_A1)
+        reader = VirtualReader()
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        keyring = keyRing()
+        keyring.add(make_key("A", KEY_A1))
+
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnReadSectors(connection, dump, None, [1, 2], keyring=keyring)
+        first = reader.commands
+        assert keyring.known("030001", UID, 2).keyData == KEY_A1
+
+        reader.commands = 0
+        assert do_wr.fnReadSectors(connection, card_data.dumpMifare_1k(), None, [1, 2], keyring=keyring)
+        assert reader.commands == 1 + 2 * (1 + 1 + 4)   #GET DATA, then LOAD KEY + AUTH + 4 READ per sector, no misses
+        assert reader.commands < first
+
+    def test_dropped_auth_not_remembered(self):
+        """Test the right key rejected once (card at the edge of the field) opens the sector at the next tap."""
+        card = VirtualMifare1k(uid=UID)
+        reader = VirtualReader(dropRate=1.0)
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        keyring = keyRing(withDefaults=False)
+        keyring.add(make_key("A", card_data.MIFARE_1K_default_key))
+        assert not do_wr.fnReadSectors(connection, card_data.dumpMifare_1k(), None, [1], keyring=keyring)
+
+        reader.dropRate = 0.0
+        reader.remove()
+        reader.insert(card)
+        connection.reconnect()
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnReadSectors(connection, dump, None, [1], keyring=keyring)
+        assert dump.sectors[1].status == card_data.status.S_OK
+
+    def test_derived_keys(self):
+        """Test card with keys diversified per UID is read and written without entering keys."""
+        card = VirtualMifare1k(uid=UID)
+        for nSector in (0, 1, 2):
+            card.setTrailer(nSector, list(fnHmacDerive(b"site", UID, nSector, "A")), [0xFF, 0x07, 0x80],
+                            list(fnHmacDerive(b"site", UID, nSector, "B")))
+        reader = VirtualReader()
+        reader.insert(card)
+        connection = reader.createConnection()
+        connection.connect()
+        keyring = keyRing()
+        derivation = keyDerivation(b"site")
+        keyring.addDerivation(derivation)
+
+        dump = card_data.dumpMifare_1k()
+        assert do_wr.fnReadSectors(connection, dump, None, [0, 1, 2], keyring=keyring)
+        assert reader.commands == 1 + 3 * (1 + 1 + 4)  #derived key A opens each sector at once
+        assert derivation.misses == 3 * 2
+
+        writeData = do_prompt.PromptAnswer_ForWrite(nSector=2, nBlock=0)
+        writeData.data = bytearray([0x42] * 16)
+        assert do_wr.fnWrite(connection, writeData, None, baseline=dump, verify=True, keyring=keyring)
+        assert list(card.blocks[8]) == [0x42] * 16
+        assert derivation.misses == 3 * 2  #keys of the card came from the cache
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
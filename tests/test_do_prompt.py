@@ -9,6 +9,7 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import io
+import mmap
 
 # Import the module to test
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -30,6 +31,10 @@ from nfc_reader.do_prompt import (
     askHexData_FromTerminal,
     askKey_FromTerminal,
     fnAskWrite,
+    fnLoadPayload,
+    fnWriteFromFile,
+    fnParseBlockList,
+    fnParseBlockAddress,
 )
 
 
@@ -80,6 +85,101 @@ class TestPromptAnswer_ForWrite:
         assert answer.data == bytearray(0)
 
 
+class TestFnParseBlockList:
+    """Test block lists of watch mode."""
+
+    def test_numbers_and_ranges(self):
+        """Test absolute numbers, ranges and duplicates."""
+        assert fnParseBlockList("4, 5,8-10,5", 4, 64) == [4, 5, 8, 9, 10]
+
+    def test_sector_block(self):
+        """Test sector:block addresses."""
+        assert fnParseBlockList("1:0-1:2,15:3", 4, 64) == [4, 5, 6, 63]
+
+    def test_invalid(self):
+        """Test out of card, reversed range, bad block and text."""
+        for text in ("64", "9-8", "1:4", "x", ""):
+            with pytest.raises(ValueError):
+                fnParseBlockList(text, 4, 64)
+
+
+class TestFnParseBlockAddress:
+    """Test the start address of file writes."""
+
+    def test_data_block(self):
+        """Test a data block address."""
+        assert fnParseBlockAddress("1:0", 4, 16) == (1, 0)
+        assert fnParseBlockAddress("15:2", 4, 16) == (15, 2)
+
+    def test_invalid(self):
+        """Test out of card, negative, malformed and missing parts."""
+        for text in ("16:0", "1:4", "-1:0", "1:-1", "3", "1:x", "1:2:3", ""):
+            with pytest.raises(ValueError):
+                fnParseBlockAddress(text, 4, 16)
+
+    def test_reserved_blocks(self):
+        """Test block 0 and trailers need allowReserved."""
+        for text in ("0:0", "0:3", "5:3"):
+            with pytest.raises(ValueError):
+                fnParseBlockAddress(text, 4, 16)
+            assert fnParseBlockAddress(text, 4, 16, allowReserved=True) == tuple(int(n) for n in text.split(":"))
+
+
+class TestFnLoadPayload:
+    """Test payloads from files and stdin."""
+
+    def test_binary_whole_blocks_mapped(self, tmp_path):
+        """Test binary file of whole blocks is memory-mapped, not copied."""
+        path = tmp_path / "image.bin"
+        path.write_bytes(bytes(range(32)))
+        payload = fnLoadPayload(str(path), 16)
+        assert isinstance(payload, mmap.mmap)
+        assert payload[16:32] == bytes(range(16, 32))
+        payload.close()
+
+    def test_binary_padded(self, tmp_path):
+        """Test binary file with a partial last block is padded with zeros."""
+        path = tmp_path / "image.bin"
+        path.write_bytes(b"abc")
+        assert fnLoadPayload(str(path), 16) == bytearray(b"abc" + bytes(13))
+
+    def test_hex_file(self, tmp_path):
+        """Test hex file with comments and separators."""
+        path = tmp_path / "image.hex"
+        path.write_text("# header\nE7 45:00,98  # tail\n03FF\n")
+        assert fnLoadPayload(str(path), 16, isHex=True) == bytearray([0xE7, 0x45, 0x00, 0x98, 0x03, 0xFF] + [0] * 10)
+
+    def test_hex_invalid(self, tmp_path):
+        """Test hex file with other characters."""
+        path = tmp_path / "image.hex"
+        path.write_text("E7 4G")
+        with pytest.raises(ValueError):
+            fnLoadPayload(str(path), 16, isHex=True)
+
+    def test_stdin(self):
+        """Test payload from stdin."""
+        with patch('sys.stdin', io.TextIOWrapper(io.BytesIO(b"48656C6C6F"))):
+            assert fnLoadPayload("-", 16, isHex=True) == bytearray(b"Hello" + bytes(11))
+
+    def test_empty_file(self, tmp_path):
+        """Test empty file gives empty payload."""
+        path = tmp_path / "empty.bin"
+        path.write_bytes(b"")
+        assert fnLoadPayload(str(path), 16) == bytearray(0)
+
+    def test_fnWriteFromFile(self, tmp_path):
+        """Test answer for fnWrite and releasing the mapping."""
+        path = tmp_path / "image.bin"
+        path.write_bytes(bytes(48))
+        answer = fnWriteFromFile(str(path), 2, 1, 16)
+        assert (answer.nSector, answer.nBlock) == (2, 1)
+        assert answer.dataType == writeDatType.W_FILE
+        assert answer.address == writeAddress.A_BLOCK
+        assert len(answer.data) == 48
+        answer.close()
+        assert answer.data == bytearray(0)
+
+
 class TestFnInputString_FromTerminal_WithCancellation:
     """Test fnInputString_FromTerminal_WithCancellation function."""
     
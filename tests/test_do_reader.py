@@ -0,0 +1,113 @@
+"""
+Tests for do_reader module.
+
+This module tests reader model matching, per-reader profile caching,
+one-time vendor setup and sessions opened with profile limits.
+"""
+import os
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+import do_comm
+import do_reader
+from do_emul import VirtualMifare1k, VirtualReader
+
+ACR122_NAME = "ACS ACR122U PICC Interface 00 00"
+
+
+@pytest.fixture(autouse=True)
+def clear_profiles():
+    """Every test starts with no known readers."""
+    do_reader.profiles.clear()
+    yield
+    do_reader.profiles.clear()
+
+
+class TestModel:
+    def test_known_model(self):
+        """Test model is found by part of PC/SC reader name."""
+        model = do_reader.fnModel(ACR122_NAME)
+        assert model.model == "ACR122U"
+        assert model.nKeySlots == 2
+
+    def test_generic_model(self):
+        """Test unknown reader gets conservative defaults."""
+        model = do_reader.fnModel("Some Reader 00 00")
+        assert model is do_reader.GENERIC_MODEL
+        assert model.nKeySlots == 1
+        assert model.setup == ()
+
+
+class TestProfile:
+    def test_profile_cached_by_name(self):
+        """Test the same profile object is returned for one reader name."""
+        assert do_reader.fnGetProfile(ACR122_NAME) is do_reader.fnGetProfile(ACR122_NAME)
+
+    def test_forget(self):
+        """Test a forgotten reader gets a new profile."""
+        profile = do_reader.fnGetProfile(ACR122_NAME)
+        do_reader.fnForget(ACR122_NAME)
+        assert do_reader.fnGetProfile(ACR122_NAME) is not profile
+
+    def test_configure_once(self):
+        """Test setup commands are sent only the first time."""
+        connection = MagicMock()
+        profile = do_reader.fnGetProfile(ACR122_NAME)
+        assert do_reader.fnConfigure(connection, profile)
+        assert do_reader.fnConfigure(connection, profile)
+        assert connection.control.call_count == len(profile.model.setup)
+        connection.control.assert_any_call(do_reader.IOCTL_CCID_ESCAPE, [0xFF, 0x00, 0x52, 0x00, 0x00])
+
+    def test_configure_errors_kept(self):
+        """Test rejected setup commands are recorded and not repeated."""
+        connection = MagicMock()
+        connection.control.side_effect = Exception("not supported")
+        profile = do_reader.fnGetProfile(ACR122_NAME)
+        assert not do_reader.fnConfigure(connection, profile)
+        assert not do_reader.fnConfigure(connection, profile)
+        assert len(profile.setupErrors) == len(profile.model.setup)
+        assert "setup failed" in profile.toStr()
+
+
+class TestPrewarm:
+    def test_prewarm_without_card(self):
+        """Test setup is applied through a direct connection before any card is present."""
+        reader = VirtualReader(name=ACR122_NAME)
+        profile = do_reader.fnPrewarm(reader)
+        assert profile.configured
+        assert [command for _, command in reader.controls] == list(profile.model.setup)
+        assert do_reader.fnConnection(ACR122_NAME) is profile.connection
+
+        do_reader.fnPrewarm(reader) #reader reported again: no second setup
+        assert len(reader.controls) == len(profile.model.setup)
+
+    def test_session_uses_profile(self):
+        """Test sessions get key slots and timeout of the reader profile."""
+        reader = VirtualReader(name=ACR122_NAME)
+        reader.insert(VirtualMifare1k())
+        connection = do_reader.fnPrewarm(reader).connection
+        connection.connect()
+        session = do_reader.fnOpenSession(connection)
+        assert len(session.slots) == 2
+        assert session.apduTimeout == 1.0
+
+    def test_session_unknown_reader(self):
+        """Test unknown readers keep do_comm defaults."""
+        reader = VirtualReader()
+        reader.insert(VirtualMifare1k())
+        connection = reader.createConnection()
+        connection.connect()
+        session = do_reader.fnOpenSession(connection)
+        assert len(session.slots) == 1
+        assert session.apduTimeout == do_comm.TIMEOUT_APDU
+        assert reader.controls == []
@@ -0,0 +1,135 @@
+"""
+Tests for do_replay module.
+
+This module tests recording of card sessions and their replay without a
+reader, including replay through do_wr.fnRead.
+"""
+import os
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+import card_data
+import do_comm
+import do_wr
+
+from nfc_reader.do_replay import (
+    RecordingConnection,
+    ReplayConnection,
+    ReplayedError,
+    ReplayMismatch,
+)
+
+
+def make_connection():
+    """Connection answering 16 bytes of block number to READ and 9000 to everything else."""
+    mock_connection = MagicMock()
+    mock_connection.getReader.return_value = "Test Reader 00"
+    mock_connection.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    mock_connection.transmit.side_effect = lambda apdu: ([apdu[3]] * 16 if apdu[1] == 0xB0 else [], 0x90, 0x00)
+    return mock_connection
+
+
+class CardRemoved(Exception):
+    pass
+
+
+class TestRecordReplay:
+    """Test recording and replaying of APDU exchanges."""
+    
+    @pytest.mark.parametrize("name", ["session.jsonl", "session.jsonl.gz"])
+    def test_roundtrip(self, tmp_path, name):
+        """Test replay returns recorded answers (plain and gzip files)."""
+        path = str(tmp_path / name)
+        with RecordingConnection(make_connection(), path) as connection:
+            assert connection.transmit([0xFF, 0xB0, 0x00, 5]) == ([5] * 16, 0x90, 0x00)
+            connection.reconnect()
+            assert connection.getReader() == "Test Reader 00"
+        
+        replay = ReplayConnection(path)
+        assert replay.getReader() == "Test Reader 00"
+        assert replay.getATR() == [0x3B, 0x8F, 0x80, 0x01]
+        assert replay.transmit([0xFF, 0xB0, 0x00, 5]) == ([5] * 16, 0x90, 0x00)
+        replay.reconnect()
+        assert replay.exhausted is True
+    
+    def test_recorded_exception(self, tmp_path):
+        """Test recorded exception is replayed with its PC/SC code."""
+        path = str(tmp_path / "session.jsonl")
+        mock_connection = make_connection()
+        error = CardRemoved("Card was removed")
+        error.hresult = 0x80100069
+        mock_connection.transmit.side_effect = error
+        with RecordingConnection(mock_connection, path) as connection, pytest.raises(CardRemoved):
+            connection.transmit([0xFF, 0xB0, 0x00, 1])
+        
+        replay = ReplayConnection(path)
+        with pytest.raises(ReplayedError) as raised:
+            replay.transmit([0xFF, 0xB0, 0x00, 1])
+        assert do_comm.fnClassifyException(raised.value) == do_comm.txResult.TX_CARD_REMOVED
+    
+    def test_strict_mismatch(self, tmp_path):
+        """Test a different command raises ReplayMismatch in strict mode."""
+        path = str(tmp_path / "session.jsonl")
+        with RecordingConnection(make_connection(), path) as connection:
+            connection.transmit([0xFF, 0xB0, 0x00, 1])
+        
+        with pytest.raises(ReplayMismatch):
+            ReplayConnection(path).transmit([0xFF, 0xB0, 0x00, 2])
+        assert ReplayConnection(path, strict=False).transmit([0xFF, 0xB0, 0x00, 2]) == ([1] * 16, 0x90, 0x00)
+    
+    def test_end_of_session_is_card_removed(self, tmp_path):
+        """Test exhausted replay looks like a removed card."""
+        path = str(tmp_path / "session.jsonl")
+        RecordingConnection(make_connection(), path).close()
+        
+        with pytest.raises(ReplayedError) as raised:
+            ReplayConnection(path).transmit([0xFF, 0xB0, 0x00, 1])
+        assert do_comm.fnClassifyException(raised.value) == do_comm.txResult.TX_CARD_REMOVED
+    
+    def test_not_a_session_file(self, tmp_path):
+        """Test other files are rejected."""
+        path = tmp_path / "other.jsonl"
+        path.write_text('{"hello": 1}\n')
+        with pytest.raises(ValueError):
+            ReplayConnection(str(path))
+    
+    def test_fnRead_replay(self, tmp_path, capsys):
+        """Test a recorded full dump is reproduced by fnRead without a reader."""
+        path = str(tmp_path / "dump.jsonl.gz")
+        recorded = card_data.dumpMifare_1k()
+        with RecordingConnection(make_connection(), path) as connection:
+            assert do_wr.fnRead(connection, recorded, card_data.key())
+        
+        replayed = card_data.dumpMifare_1k()
+        replay = ReplayConnection(path)
+        result = do_wr.fnRead(replay, replayed, card_data.key())
+        
+        assert result.isOk is True
+        assert replay.exhausted is True
+        assert [block.data for sector in replayed.sectors for block in sector.blocks] == \
+               [block.data for sector in recorded.sectors for block in sector.blocks]
+
+    
+    def test_fnRead_strict_mismatch_stops(self, tmp_path, capsys):
+        """Test fnRead fails on a recording of other commands instead of going on out of step."""
+        path = str(tmp_path / "dump.jsonl")
+        with RecordingConnection(make_connection(), path) as connection:
+            assert do_wr.fnRead(connection, card_data.dumpMifare_1k(), card_data.key())
+        
+        replay = ReplayConnection(path)
+        with pytest.raises(ReplayMismatch):
+            do_wr.fnRead(replay, card_data.dumpMifare_1k(), card_data.key(card_data.keyType.KT_B))
+        assert replay.exhausted is False
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,229 @@
+"""
+Tests for do_stats module.
+
+This module tests per-reader, per-instruction APDU counters, latency
+histograms and Prometheus export.
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+# Import the module to test
+src_path = os.path.join(os.path.dirname(__file__), '..', 'src')
+sys.path.insert(0, src_path)
+
+# Add src/nfc_reader to path for relative imports
+nfc_reader_path = os.path.join(src_path, 'nfc_reader')
+sys.path.insert(0, nfc_reader_path)
+
+from nfc_reader.do_stats import (
+    LATENCY_BUCKETS,
+    TYPICAL_LATENCY,
+    fnExportPrometheus,
+    insName,
+    outcomeFromStatus,
+    periodicExport,
+    txSeries,
+    txStats,
+)
+
+
+class TestHelpers:
+    """Test naming helpers."""
+    
+    def test_insName(self):
+        """Test known and unknown instruction names."""
+        assert insName(0x82) == "LOAD KEY"
+        assert insName(0x86) == "AUTH"
+        assert insName(0xB0) == "READ"
+        assert insName(0xD6) == "WRITE"
+        assert insName(0xCA) == "GET DATA"
+        assert insName(0xD7) == "VALUE"
+        assert insName(0xA4) == "A4"
+    
+    def test_outcomeFromStatus(self):
+        """Test status words are formatted as hex."""
+        assert outcomeFromStatus(0x90, 0x00) == "9000"
+        assert outcomeFromStatus(0x63, 0x00) == "6300"
+
+
+class TestTxSeries:
+    """Test counters and histogram of a single series."""
+    
+    def test_add(self):
+        """Test counters, buckets and outcomes."""
+        series = txSeries()
+        series.add(0.0005, "9000")
+        series.add(0.015, "9000")
+        series.add(10.0, "6300")
+        
+        assert series.count == 3
+        assert series.errors == 1
+        assert series.maxTime == 10.0
+        assert series.buckets[0] == 1
+        assert series.buckets[LATENCY_BUCKETS.index(0.02)] == 1
+        assert series.buckets[-1] == 1
+        assert series.quantile(0.5) == 0.02
+    
+    def test_merge(self):
+        """Test merging two series."""
+        first, second = txSeries(), txSeries()
+        first.add(0.001, "9000")
+        second.add(0.003, "6300")
+        first.merge(second)
+        
+        assert first.count == 2
+        assert first.outcomes == {"9000": 1, "6300": 1}
+        assert first.totalTime == pytest.approx(0.004)
+
+
+class TestTxStats:
+    """Test aggregation of records."""
+    
+    def test_recordApdu_block_address(self):
+        """Test block address is taken from the right APDU byte."""
+        stats = txStats()
+        stats.recordApdu("reader", [0xFF, 0xB0, 0x00, 12], 0.001, "9000")
+        stats.recordApdu("reader", [0xFF, 0x86, 0x00, 0x00, 0x05, 0x01, 0x00, 8, 0x60, 0x00], 0.001, "9000")
+        stats.recordApdu("reader", [0xFF, 0x82, 0x00, 0x00, 0x06] + [0xFF] * 6, 0.001, "9000")
+        
+        assert [record.nBlock for record in stats.recent] == [12, 8, -1]
+    
+    def test_snapshot_merges_threads(self):
+        """Test records from several threads are merged."""
+        stats = txStats()
+        
+        def worker():
+            for _ in range(100):
+                stats.record("reader", 0xB0, 4, 0.001, "9000")
+        
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert stats.snapshot()[("reader", 0xB0)].count == 400
+    
+    def test_snapshot_retires_finished_threads(self):
+        """Test shards of finished threads are dropped, their counters are kept."""
+        stats = txStats()
+        
+        for _ in range(3):
+            thread = threading.Thread(target=stats.record, args=("reader", 0xB0, 4, 0.001, "9000"))
+            thread.start()
+            thread.join()
+        
+        assert stats.snapshot()[("reader", 0xB0)].count == 3
+        assert stats.nShards == 0
+        stats.record("reader", 0xB0, 4, 0.001, "9000")
+        assert stats.snapshot()[("reader", 0xB0)].count == 4
+        assert stats.nShards == 1
+    
+    def test_snapshot_consistent_while_recording(self):
+        """Test a snapshot taken during record() has as many commands as the +Inf bucket."""
+        stats = txStats()
+        stop = threading.Event()
+        
+        def worker():
+            while not stop.is_set():
+                stats.record("reader", 0xB0, 4, 0.001, "9000")
+        
+        thread = threading.Thread(target=worker)
+        thread.start()
+        try:
+            for _ in range(200):
+                series = stats.snapshot().get(("reader", 0xB0))
+                if series is not None:
+                    assert series.count == sum(series.buckets) == sum(series.outcomes.values())
+        finally:
+            stop.set()
+            thread.join()
+    
+    def test_disabled(self):
+        """Test nothing is recorded when disabled."""
+        stats = txStats()
+        stats.enabled = False
+        stats.record("reader", 0xB0, 4, 0.001, "9000")
+        
+        assert stats.snapshot() == {}
+    
+    def test_reset(self):
+        """Test reset clears all counters."""
+        stats = txStats()
+        stats.record("reader", 0xB0, 4, 0.001, "9000")
+        stats.reset()
+        
+        assert stats.snapshot() == {}
+        assert len(stats.recent) == 0
+    
+    def test_avgTime(self):
+        """Test measured average per reader, typical latency without measurements."""
+        stats = txStats()
+        stats.record("r1", 0xD6, 4, 0.010, "9000")
+        stats.record("r1", 0xD6, 5, 0.020, "9000")
+        stats.record("r2", 0xD6, 4, 0.030, "9000")
+        
+        assert stats.avgTime("r1", 0xD6) == pytest.approx(0.015)
+        assert stats.avgTime(None, 0xD6) == pytest.approx(0.020)
+        assert stats.avgTime("r3", 0xD6) == TYPICAL_LATENCY[0xD6]
+        assert stats.avgTime("r1", 0xA4) == 0.0
+    
+    def test_toStr(self):
+        """Test printable table has a line per series."""
+        stats = txStats()
+        stats.record("reader", 0xB0, 4, 0.001, "9000")
+        stats.record("reader", 0x86, 4, 0.002, "6300")
+        
+        lines = stats.toStr().split("\n")
+        assert len(lines) == 3
+        assert "AUTH" in lines[1]
+        assert "READ" in lines[2]
+
+
+class TestPrometheus:
+    """Test Prometheus text exposition."""
+    
+    def test_toPrometheus(self):
+        """Test counters and cumulative histogram buckets."""
+        stats = txStats()
+        stats.record('ACS "ACR122U"', 0xB0, 4, 0.0015, "9000")
+        stats.record('ACS "ACR122U"', 0xB0, 5, 0.0015, "6300")
+        
+        text = stats.toPrometheus()
+        
+        assert 'nfc_apdu_total{reader="ACS \\"ACR122U\\"",ins="READ",outcome="9000"} 1' in text
+        assert 'nfc_apdu_duration_seconds_bucket{reader="ACS \\"ACR122U\\"",ins="READ",le="0.001"} 0' in text
+        assert 'nfc_apdu_duration_seconds_bucket{reader="ACS \\"ACR122U\\"",ins="READ",le="0.002"} 2' in text
+        assert 'nfc_apdu_duration_seconds_bucket{reader="ACS \\"ACR122U\\"",ins="READ",le="+Inf"} 2' in text
+        assert 'nfc_apdu_duration_seconds_count{reader="ACS \\"ACR122U\\"",ins="READ"} 2' in text
+    
+    def test_fnExportPrometheus(self, tmp_path):
+        """Test export writes the text file."""
+        stats = txStats()
+        stats.record("reader", 0xD6, 4, 0.01, "9000")
+        path = tmp_path / "nfc.prom"
+        
+        fnExportPrometheus(str(path), stats)
+        
+        assert path.read_text() == stats.toPrometheus()
+        assert not os.path.exists(f"{path}.tmp")
+    
+    def test_periodicExport(self, tmp_path):
+        """Test the file is written at start, kept up to date and written again on stop."""
+        stats = txStats()
+        path = tmp_path / "nfc.prom"
+        
+        exporter = periodicExport(str(path), interval=0.01, txStatistics=stats).start()
+        assert path.read_text() == stats.toPrometheus()
+        stats.record("reader", 0xB0, 4, 0.001, "9000")
+        exporter.stop()
+        
+        assert 'nfc_apdu_total{reader="reader",ins="READ",outcome="9000"} 1' in path.read_text()
+        assert exporter.thread is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])